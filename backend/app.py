@@ -1,14 +1,100 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, current_app, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
+import os
 import csv
+import json
+import queue
 import socket
-from scheduler import GroupScheduler
-from csv_parser import get_csv, parse_student_data, parse_all_constraints
+import functools
+import threading
+from csv_parser import get_csv, get_csvs, parse_given_attributes, MAX_UPLOAD_MB
+from pipeline import solve_rows, solve_prepared, prepare_rows, parse_dataset, prepare_dataset, cached_result
+from datasets import DatasetStore
+from jobs import JobManager
+from result_cache import ResultCache
+from metrics import SolveMetrics
+from batch import split_sections, read_sections, solve_sections
+from response_format import compact_result, json_response
+from repair import repair_schedule
+from validate import validate_sheet
+from export import parse_export_options, export_rows, stream_csv, stream_xlsx, Workbook
 
-app = Flask(__name__)
-CORS(app)
+# defaults, can be overridden with environment variables
+MAX_REQUEST_MB = float(os.environ.get('SMARTGROUPS_MAX_REQUEST_MB', MAX_UPLOAD_MB)) # whole request body (file + form fields)
+MAX_CONCURRENT_SOLVES = int(os.environ.get('SMARTGROUPS_MAX_CONCURRENT_SOLVES', os.cpu_count() or 1)) # per server process
+SOLVE_QUEUE_TIMEOUT = float(os.environ.get('SMARTGROUPS_SOLVE_QUEUE_TIMEOUT', 30)) # seconds to wait for a free solve slot
 
-@app.route('/api/upload', methods=['POST'])
+api = Blueprint('api', __name__)
+
+class Services:
+    """the long-lived state of one app (one per server process, see create_app)"""
+    def __init__(self, max_concurrent_solves=MAX_CONCURRENT_SOLVES):
+        # background solves for /api/jobs (bounded number of worker processes)
+        self.job_manager = JobManager()
+
+        # results of earlier solves, so re-posting the same csv + constraints doesn't solve again
+        self.result_cache = ResultCache()
+
+        # parsed uploads, so a professor can tweak constraints and re-solve without re-sending the csv
+        self.dataset_store = DatasetStore()
+
+        # phase timings / model sizes / solver stats of every solve, for /api/metrics
+        self.solve_metrics = SolveMetrics()
+
+        # solves that run in the request thread; past this many at once, requests wait for a free slot
+        self.solve_slots = threading.BoundedSemaphore(max_concurrent_solves)
+
+def create_app(max_concurrent_solves=MAX_CONCURRENT_SOLVES):
+    """
+    the flask app with the api routes and its own job manager, caches and metrics
+    (wsgi.py calls this in every server worker; app.py's __main__ for the dev server)
+    """
+    app = Flask(__name__)
+    CORS(app)
+    app.config['MAX_CONTENT_LENGTH'] = int(MAX_REQUEST_MB * 1024 * 1024)
+    # form fields like previous_result (a whole earlier result) can be big too
+    app.config['MAX_FORM_MEMORY_SIZE'] = app.config['MAX_CONTENT_LENGTH']
+    app.extensions['smartgroups'] = Services(max_concurrent_solves)
+    app.register_blueprint(api)
+    return app
+
+def services():
+    """the Services of the app handling this request"""
+    return current_app.extensions['smartgroups']
+
+def limit_solves(view):
+    """
+    for routes that solve in the request thread: wait for one of the app's solve slots first,
+    so a burst of uploads doesn't have every solve fighting over the same cores (503 if none frees up in time)
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        slots = services().solve_slots
+        if not slots.acquire(timeout=SOLVE_QUEUE_TIMEOUT):
+            return server_busy()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            slots.release()
+    return wrapper
+
+def server_busy():
+    return jsonify({'error': 'The server is busy solving other requests, please try again in a minute.'}), 503
+
+@api.app_errorhandler(413)
+def request_too_large(e):
+    return jsonify({'error': f'Upload is too large (the limit is {MAX_REQUEST_MB:g} MB).'}), 413
+
+def result_response(body, status=200):
+    """json response for results: gzipped when the client accepts it (see response_format.py)"""
+    return json_response(body, status, request.headers.get('Accept-Encoding', ''))
+
+def wants_compact():
+    """format=compact (form field or query parameter): results come in the compact format (see compact_result)"""
+    return request.values.get('format', '').strip().lower() == 'compact'
+
+@api.route('/api/upload', methods=['POST'])
+@limit_solves
 def upload_csv():
     """
     upload csv file, parse into list of constraints, 
@@ -23,61 +109,356 @@ def upload_csv():
         csv_input = get_csv(request)
         if 'error' in csv_input:
             return jsonify({'error': csv_input['error']}), csv_input['status'] # this is an error message
-            
-        # check for student attributes (if they exist)
-        given_attributes = []
-        if request.form.get('given_attributes'):
-            given_attributes = [attr.strip().lower() for attr in request.form['given_attributes'].split(',')]
-        
-        # get the data as df
-        data = csv_input['data'] # get the data
-        results = parse_student_data(data, given_attributes)
-        if 'error' in results:
-            return jsonify({'error': results['error']}), results['status']
-        
-        df = results['df']
-        student_names = results['student_names']
-        student_attributes = results['student_attributes']
-        student_availabilities = results['student_availabilities']
-        unassigned_students = results['unassigned_students']
-
-        constraints = parse_all_constraints(request, len(df), len(student_availabilities[0]), given_attributes)
-
-        # run the scheduler
-        student_data = {
-            'names': student_names,  
-            'attributes': student_attributes,
-            'availabilities': student_availabilities
-        }
-        
-        scheduler = GroupScheduler(student_data, constraints)
-        schedule = scheduler.schedule()
-
-        # add unassigned students to the response if any exist
-        if 'error' not in schedule and unassigned_students:
-            groups_list = list(schedule.get('groups', []))  # type: ignore
-            
-            # add unassigned group
-            groups_list.append({  # type: ignore
-                'group_id': len(groups_list) + 1,
-                'time_slot': 'Unassigned - no availabilities',
-                'students': unassigned_students,
-                'size': len(unassigned_students),
-                'is_unassigned': True
-            })
-            
-            schedule['groups'] = groups_list  # type: ignore
-            
-            # update total students count
-            total_students = int(schedule.get('total_students', 0))
-            schedule['total_students'] = total_students + len(unassigned_students)  # type: ignore
-
-        return jsonify(schedule)
+
+        # parse the data + constraints and run the scheduler
+        schedule, status = solve_rows(csv_input['data'], request.form.to_dict(), cache=services().result_cache, metrics=services().solve_metrics)
+        if wants_compact():
+            schedule = compact_result(schedule)
+        return result_response(schedule, status)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/upload/stream', methods=['POST'])
+def upload_csv_stream():
+    """
+    same input as /api/upload, but the response is a stream of server-sent events:
+    a 'solution' event for every better grouping the solver finds (so there's something to show right away),
+    then one 'result' event with the final answer (or an 'error' event)
+    """
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    try:
+        csv_input = get_csv(request)
+        if 'error' in csv_input:
+            return jsonify({'error': csv_input['error']}), csv_input['status']
+
+        prepared = prepare_rows(csv_input['data'], request.form.to_dict())
+        if 'error' in prepared:
+            return jsonify({'error': prepared['error']}), prepared['status']
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    scheduler = prepared['scheduler']
+    events = queue.Queue()
+    state = services() # the solve runs in its own thread, outside the app context
+
+    # the solve slot is held until the stream ends (limit_solves would give it back when this function returns)
+    if not state.solve_slots.acquire(timeout=SOLVE_QUEUE_TIMEOUT):
+        return server_busy()
+
+    def run():
+        try:
+            schedule, _ = solve_prepared(prepared, on_solution=lambda result: events.put(('solution', result)),
+                                         cache=state.result_cache, metrics=state.solve_metrics)
+            events.put(('error' if 'error' in schedule else 'result', schedule))
+        except Exception as e:
+            events.put(('error', {'error': str(e)}))
+        finally:
+            state.solve_slots.release()
+
+    # started here rather than in generate(), so the slot is given back even if the stream is never read
+    threading.Thread(target=run, daemon=True).start()
+
+    def generate():
+        try:
+            while True:
+                event, data = events.get()
+                yield sse(event, data)
+                if event != 'solution':
+                    break
+        finally:
+            # client went away (or we're done): don't leave the search running
+            scheduler.stop()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/api/batch', methods=['POST'])
+@limit_solves
+def upload_batch():
+    """
+    several course sections at once, each grouped on its own with the same constraints:
+    either several csv files ('files'), one section per file,
+    or one csv ('file') plus partition_column, the column that says which section a student is in (e.g. Section)
+    sections are solved in parallel; a section that fails doesn't stop the others
+    returns {'sections': [{'section', 'status', 'result' (same as /api/upload) or 'error'}], 'solved', 'failed'}
+    """
+    try:
+        form = request.form.to_dict()
+        if form.get('partition_column'):
+            csv_input = get_csv(request)
+            if 'error' in csv_input:
+                return jsonify({'error': csv_input['error']}), csv_input['status']
+            sections, error = split_sections(csv_input['data'], form['partition_column'])
+            if error:
+                return jsonify({'error': error['error']}), error['status']
+        else:
+            csv_input = get_csvs(request)
+            if 'error' in csv_input:
+                return jsonify({'error': csv_input['error']}), csv_input['status']
+            sections = read_sections(csv_input['data'])
+
+        batch = solve_sections(sections, form, metrics=services().solve_metrics)
+        if wants_compact():
+            for section in batch['sections']:
+                if 'result' in section:
+                    section['result'] = compact_result(section['result'])
+        return result_response(batch)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/repair', methods=['POST'])
+@limit_solves
+def repair_groups():
+    """
+    update an earlier grouping after students drop, join or change their availability, moving as few students as possible:
+    previous_result: the earlier result (json, full format)
+    changes: json {"added": [...], "removed": [...], "changed": [...]} (see repair.parse_roster_changes),
+    or the updated csv as 'file' instead
+    plus the same constraint fields as /api/upload
+    returns the same result as /api/upload, plus 'students_moved' and 'repair' (what was kept and what was re-solved)
+    """
+    try:
+        form = request.form.to_dict()
+        try:
+            previous_result = json.loads(form.get('previous_result') or 'null')
+        except ValueError:
+            return jsonify({'error': 'previous_result must be a previous result in json format.'}), 400
+
+        data = None
+        if not form.get('changes') and 'file' in request.files:
+            csv_input = get_csv(request)
+            if 'error' in csv_input:
+                return jsonify({'error': csv_input['error']}), csv_input['status']
+            data = csv_input['data']
+
+        schedule, status = repair_schedule(previous_result, form, data)
+        if wants_compact():
+            schedule = compact_result(schedule)
+        return result_response(schedule, status)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/validate', methods=['POST'])
+def validate_result_sheet():
+    """
+    check a result sheet (the csv the results download as, or one edited by hand) against the constraints:
+    file: the result sheet, plus given_attributes and the same constraint fields as /api/upload
+    returns {'valid', 'violations': [{'constraint', 'group', 'message', 'students'}], 'groups', 'students'}
+    (every /api/upload result has the same check of its own grouping as 'validation')
+    """
+    try:
+        csv_input = get_csv(request)
+        if 'error' in csv_input:
+            return jsonify({'error': csv_input['error']}), csv_input['status']
+        report, status = validate_sheet(csv_input['data'], request.form.to_dict())
+        return jsonify(report), status
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    same input as /api/upload, but the solve runs in the background
+    returns a job id right away; poll GET /api/jobs/<id> for the result
+    """
+    try:
+        csv_input = get_csv(request)
+        if 'error' in csv_input:
+            return jsonify({'error': csv_input['error']}), csv_input['status']
+
+        prepared = prepare_rows(csv_input['data'], request.form.to_dict())
+        if 'error' in prepared:
+            return jsonify({'error': prepared['error']}), prepared['status']
+
+        # answer straight from the cache if we've solved this exact request before
+        state = services() # on_done runs in the job manager's thread, outside the app context
+        cache_key, cached = cached_result(prepared, state.result_cache, metrics=state.solve_metrics)
+        if cached is not None:
+            job_id = state.job_manager.add_finished(*cached)
+            return jsonify({'job_id': job_id, 'status': 'done'}), 202
+
+        # the worker process can't record into solve_metrics, so it always sends the diagnostics back
+        # and they're recorded here (and dropped from the result if they weren't asked for)
+        wants_diagnostics = prepared['diagnostics']
+        prepared['diagnostics'] = True
+
+        def on_done(result, status):
+            diagnostics = result.get('diagnostics') if wants_diagnostics else result.pop('diagnostics', None)
+            state.solve_metrics.observe(diagnostics)
+            if state.result_cache.put(cache_key, result):
+                result['cache_key'] = cache_key
+
+        job_id = state.job_manager.submit(solve_prepared, prepared, on_done=on_done)
+        return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """status, progress, and (once done) the same result /api/upload would return"""
+    job = services().job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found (it may have expired).'}), 404
+    if 'result' in job and wants_compact():
+        job['result'] = compact_result(job['result'])
+    return result_response(job)
+
+@api.route('/api/jobs/<job_id>/export', methods=['GET'])
+def export_job(job_id):
+    """download a finished job's groups as a csv / xlsx file (see export_response)"""
+    job = services().job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found (it may have expired).'}), 404
+    if 'result' not in job:
+        return jsonify({'error': f"Job is {job['status']}, there's nothing to export."}), 409
+    return export_response(job['result'])
+
+@api.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """stop a queued or running job, or forget a finished one"""
+    if not services().job_manager.cancel(job_id):
+        return jsonify({'error': 'Job not found (it may have expired).'}), 404
+    return jsonify({'job_id': job_id, 'status': 'cancelled'})
+
+@api.route('/api/datasets', methods=['POST'])
+def create_dataset():
+    """
+    upload a csv (+ given_attributes) once; it's parsed and kept on the server
+    returns a dataset id to use with POST /api/datasets/<id>/solve
+    """
+    try:
+        csv_input = get_csv(request)
+        if 'error' in csv_input:
+            return jsonify({'error': csv_input['error']}), csv_input['status']
+
+        dataset = parse_dataset(csv_input['data'], parse_given_attributes(request.form))
+        if 'error' in dataset:
+            return jsonify({'error': dataset['error']}), dataset['status']
+
+        dataset_id = services().dataset_store.add(dataset)
+        return jsonify(services().dataset_store.summary(dataset_id)), 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/datasets/<dataset_id>', methods=['GET'])
+def get_dataset(dataset_id):
+    summary = services().dataset_store.summary(dataset_id)
+    if summary is None:
+        return jsonify({'error': 'Dataset not found (it may have expired). Please upload the file again.'}), 404
+    return jsonify(summary)
+
+@api.route('/api/datasets/<dataset_id>', methods=['DELETE'])
+def delete_dataset(dataset_id):
+    if not services().dataset_store.remove(dataset_id):
+        return jsonify({'error': 'Dataset not found (it may have expired).'}), 404
+    return jsonify({'dataset_id': dataset_id, 'deleted': True})
+
+@api.route('/api/datasets/<dataset_id>/solve', methods=['POST'])
+@limit_solves
+def solve_dataset(dataset_id):
+    """
+    solve an uploaded dataset with the constraints in the form (no file needed)
+    returns the same result as /api/upload
+    """
+    try:
+        dataset = services().dataset_store.get(dataset_id)
+        if dataset is None:
+            return jsonify({'error': 'Dataset not found (it may have expired). Please upload the file again.'}), 404
+
+        prepared = prepare_dataset(dataset, request.form.to_dict())
+        if 'error' in prepared:
+            return jsonify({'error': prepared['error']}), prepared['status']
+
+        schedule, status = solve_prepared(prepared, cache=services().result_cache, metrics=services().solve_metrics)
+        if 'error' not in schedule:
+            # remembered so the next solve can warm start from it (warm_start=true)
+            dataset['last_result'] = schedule
+        if wants_compact():
+            schedule = compact_result(schedule)
+        return result_response(schedule, status)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/datasets/<dataset_id>/export', methods=['GET'])
+def export_dataset(dataset_id):
+    """download the groups of a dataset's last solve as a csv / xlsx file (see export_response)"""
+    dataset = services().dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Dataset not found (it may have expired). Please upload the file again.'}), 404
+    if dataset.get('last_result') is None:
+        return jsonify({'error': 'This dataset has no groups yet, solve it first.'}), 409
+    return export_response(dataset['last_result'])
+
+@api.route('/api/cache/<cache_key>/export', methods=['GET'])
+def export_cached(cache_key):
+    """
+    download a cached result's groups as a csv / xlsx file (see export_response)
+    cache_key: the result's 'cache_key', for results that came from /api/upload or /api/stream (no job or dataset id)
+    """
+    result = services().result_cache.peek(cache_key)
+    if result is None:
+        return jsonify({'error': 'Result not found (it may have dropped out of the cache). Please solve again.'}), 404
+    return export_response(result)
+
+def export_response(result):
+    """
+    stream a result as a file, row by row, instead of building it in the browser
+    query parameters: file_type (csv or xlsx, default csv), columns and attributes (see export.parse_export_options)
+    """
+    if 'error' in result or not result.get('groups'):
+        return jsonify({'error': 'There are no groups to export.'}), 409
+
+    file_type = request.args.get('file_type', 'csv').strip().lower()
+    if file_type not in ('csv', 'xlsx'):
+        return jsonify({'error': 'file_type must be csv or xlsx.'}), 400
+    if file_type == 'xlsx' and Workbook is None:
+        return jsonify({'error': 'xlsx export needs openpyxl installed on the server, use csv instead.'}), 501
+
+    options = parse_export_options(request.args, result)
+    if 'error' in options:
+        return jsonify({'error': options['error']}), options['status']
+
+    rows = export_rows(result, options)
+    if file_type == 'csv':
+        body, mimetype = stream_csv(rows), 'text/csv'
+    else:
+        body, mimetype = stream_xlsx(rows), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=smart_groups_results.{file_type}'})
+
+@api.route('/api/cache', methods=['GET'])
+def cache_stats():
+    """hit/miss counters for the result cache"""
+    return jsonify(services().result_cache.stats())
+
+@api.route('/api/cache', methods=['DELETE'])
+def clear_cache():
+    services().result_cache.clear()
+    return jsonify(services().result_cache.stats())
+
+@api.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    aggregated over every solve since startup (or the last reset): solves per engine / solver status,
+    histograms of the seconds spent per phase and of the model sizes
+    """
+    return jsonify(services().solve_metrics.snapshot())
+
+@api.route('/api/metrics', methods=['DELETE'])
+def reset_metrics():
+    services().solve_metrics.reset()
+    return jsonify(services().solve_metrics.snapshot())
+
+@api.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'smart groups is running / works'})
 
@@ -94,9 +475,10 @@ def health_check():
 #     raise RuntimeError("No available ports found")
 
 if __name__ == '__main__':
+    # dev server; for production use wsgi.py (./run.sh --production)
+    app = create_app()
     port = 5013 #find_available_port() # find first available port
     
-    import os
     os.makedirs('../frontend/src/', exist_ok=True)
     
     with open('../frontend/src/backend-port.txt', 'w') as f:
@@ -0,0 +1,211 @@
+import os
+import math
+import time
+import random
+import numpy as np
+from ortools.sat.python import cp_model
+from constraint_parser import SchedulingConstraints
+from validate import result_assignment
+
+# defaults, can be overridden with environment variables
+BALANCE_TIME_LIMIT = float(os.environ.get('SMARTGROUPS_BALANCE_TIME_LIMIT', 20)) # whole schedule() budget with balance on, unless the form sets time_limit
+BALANCE_STEP_TIME = float(os.environ.get('SMARTGROUPS_BALANCE_STEP_TIME', 2)) # solver seconds per neighborhood
+BALANCE_NEIGHBORHOOD = int(os.environ.get('SMARTGROUPS_BALANCE_NEIGHBORHOOD', 4)) # groups re-solved per step, to start with
+
+def balance_terms(scheduler):
+    """
+    what gets balanced: group sizes, plus the student count of every attribute (and combined attribute set)
+    that has a constraint; returns [(name, 0/1 vector over the students, or None for the size)]
+    """
+    terms = [('size', None)]
+    for attr in scheduler.constraints.get_attribute_constraints():
+        terms.append((attr, scheduler.students.attribute_column(attr)))
+    for combined in scheduler.constraints.get_combined_constraints():
+        attrs = combined.get('attributes', [])
+        terms.append((' or '.join(attrs), scheduler.students.any_attribute_column(attrs)))
+    return terms
+
+def _counts(terms, groups):
+    """terms x groups array of counts (groups: student index arrays)"""
+    return np.array([[len(members) if column is None else int(column[members].sum()) for members in groups]
+                     for _, column in terms], dtype=np.int64).reshape(len(terms), len(groups))
+
+def spreads(terms, groups):
+    """largest - smallest count per term, over the groups"""
+    counts = _counts(terms, groups)
+    return {name: int(counts[i].max() - counts[i].min()) if len(groups) else 0 for i, (name, _) in enumerate(terms)}
+
+def deviation(terms, groups):
+    """
+    how far the groups are from even, summed over terms and groups: counts outside [floor, ceil] of the mean
+    (the tie-breaker that lets the search make progress while the largest / smallest counts stay where they are)
+    """
+    counts = _counts(terms, groups)
+    total = counts.sum(axis=1, keepdims=True)
+    low, high = total // max(len(groups), 1), -(-total // max(len(groups), 1))
+    return int((np.maximum(counts - high, 0) + np.maximum(low - counts, 0)).sum())
+
+def lower_bound(scheduler, terms):
+    """
+    a lower bound on the objective: with k groups, a total that k doesn't divide can't be spread evenly, so that
+    term's spread is at least 1; the bound is the smallest such count over every group count k that sizes allow
+    """
+    c = scheduler.constraints
+    n = scheduler.num_students
+    size_min = max(c.group_size_min or 1, 1)
+    k_min = max(c.group_count_min or 1, math.ceil(n / c.group_size_max) if c.group_size_max else 1, 1)
+    k_max = min(c.group_count_max or n, n // size_min)
+    totals = [n if column is None else int(column.sum()) for _, column in terms]
+    return min((sum(total % k != 0 for total in totals) for k in range(k_min, k_max + 1)), default=0)
+
+def _groups(scheduler, result):
+    """slot index and student index array per group of a formatted result"""
+    group_of, slot_of, _ = result_assignment(scheduler.students, result)
+    return slot_of, [np.flatnonzero(group_of == g) for g in range(len(slot_of))]
+
+def _solve_neighborhood(scheduler, terms, slots, groups, free, time_limit):
+    """
+    re-solve the students of the free groups on their own (every other group stays as it is), minimizing the
+    spreads over all groups (the fixed groups' largest / smallest counts are constants in the sub-model), then
+    the deviation of the new groups
+    returns (status, [(slot, student index array), ...] for the new groups)
+    """
+    from scheduler import GroupScheduler # scheduler imports this module
+
+    c = scheduler.constraints
+    fixed = [g for g in range(len(groups)) if g not in free]
+    members = np.concatenate([groups[g] for g in free])
+    count_min, count_max = c.get_group_count_constraints()
+    avoid_pairs, keep_together = c.get_pair_constraints()
+    sub_constraints = SchedulingConstraints(c.attribute_constraints, c.group_size_min, c.group_size_max,
+                                            max(1, (count_min or 1) - len(fixed)), count_max - len(fixed) if count_max else None,
+                                            c.combined_constraints, avoid_pairs, keep_together)
+    # no symmetry breaking: the hint (the current grouping) should be a valid grouping as it is
+    sub = GroupScheduler(scheduler.students.subset(members), sub_constraints, symmetry_breaking=False,
+                         solver_params=scheduler.solver_params, aggregate=False)
+    built = sub.build_cp_model()
+    model, max_groups = built['model'], built['max_groups']
+    student_in_group, group_uses_time, group_active = built['student_in_group'], built['group_uses_time'], built['group_active']
+
+    fixed_counts = _counts(terms, [groups[g] for g in fixed])
+    totals = _counts(terms, groups).sum(axis=1)
+    objective, deviations = [], []
+    for i, (_, column) in enumerate(terms):
+        local = range(len(members)) if column is None else np.flatnonzero(column[members]).tolist()
+        high = model.NewIntVar(0, len(members) + int(fixed_counts[i].max(initial=0)), '')
+        low = model.NewIntVar(0, len(members) + int(fixed_counts[i].max(initial=0)), '')
+        if fixed:
+            model.Add(high >= int(fixed_counts[i].max()))
+            model.Add(low <= int(fixed_counts[i].min()))
+        for g in range(max_groups):
+            count = sum(student_in_group[s][g] for s in local)
+            model.Add(high >= count)
+            model.Add(low <= count).OnlyEnforceIf(group_active[g])
+            over = model.NewIntVar(0, len(members), '')
+            model.Add(over >= count - int(-(-totals[i] // len(groups)))).OnlyEnforceIf(group_active[g])
+            model.Add(over >= int(totals[i] // len(groups)) - count).OnlyEnforceIf(group_active[g])
+            deviations.append(over)
+        objective.append(high - low)
+    # any spread beats all of the deviation
+    model.Minimize((len(members) * len(terms) * max_groups + 1) * sum(objective) + sum(deviations))
+
+    # hint: the free groups as they are now, as groups 0, 1, ...
+    label = np.concatenate([np.full(len(groups[g]), i) for i, g in enumerate(free)])
+    hinted = set() # keep-together students share their variables, hint them once
+    for s in range(len(members)):
+        if id(student_in_group[s]) not in hinted:
+            hinted.add(id(student_in_group[s]))
+            for g in range(max_groups):
+                model.AddHint(student_in_group[s][g], g == label[s])
+    for g in range(max_groups):
+        slot = slots[free[g]] if g < len(free) else -1
+        model.AddHint(group_active[g], g < len(free))
+        for t, uses_time in group_uses_time[g].items():
+            model.AddHint(uses_time, t == slot)
+
+    solver = scheduler.solver = sub._make_solver()
+    solver.parameters.max_time_in_seconds = time_limit
+    status = solver.Solve(model)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return status, None
+    group_of, slot_of = sub._read_assignment(solver, student_in_group, group_uses_time, group_active, max_groups)
+    return status, [(slot, members[group_of == g]) for g, slot in sorted(slot_of.items())]
+
+def balance_schedule(scheduler, result, deadline):
+    """
+    improve a valid grouping towards balanced groups (large neighborhood search), until deadline (time.perf_counter()):
+    the objective is the sum of the spreads (largest - smallest count over the groups) of the group sizes and of every
+    constrained attribute, ties broken by deviation; every step keeps all groups but a few as they are and re-solves those few on their own
+    (see _solve_neighborhood), keeping the result if it's better. the groups picked are the ones at the extremes
+    of the worst spread (random ones among ties), plus random ones (more of them after steps that were solved to optimality without improving,
+    fewer after steps that ran out of time); a step's model only has the students of its groups, so steps stay
+    quick on big sections. stops at the deadline, or once the objective reaches lower_bound
+    returns the better result (or the same one) with result['balance'] =
+        {'objective', 'initial_objective', 'best_bound', 'gap', 'spreads', 'steps', 'improvements', 'seconds'}
+    """
+    start = time.perf_counter()
+    terms = balance_terms(scheduler)
+    slots, groups = _groups(scheduler, result)
+    initial = sum(spreads(terms, groups).values())
+    best = initial
+    best_deviation = deviation(terms, groups)
+    bound = lower_bound(scheduler, terms)
+    representative = np.array(scheduler._pair_structure()[0], dtype=np.int64)
+
+    rng = random.Random(scheduler.solver_params.get('random_seed', 0))
+    size = min(BALANCE_NEIGHBORHOOD, len(groups))
+    steps = improvements = 0
+    while best > bound and len(groups) > 1 and not scheduler.stopped:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0.05:
+            break
+        steps += 1
+
+        # the groups with the most and fewest of the worst-spread term, then random ones
+        counts = _counts(terms, groups)
+        worst = int(np.argmax(counts.max(axis=1) - counts.min(axis=1)))
+        free = {rng.choice(np.flatnonzero(counts[worst] == counts[worst].max()).tolist()),
+                rng.choice(np.flatnonzero(counts[worst] == counts[worst].min()).tolist())}
+        others = [g for g in range(len(groups)) if g not in free]
+        free.update(rng.sample(others, min(len(others), max(size - len(free), 0))))
+        # keep-together sets can't be split between a free and a fixed group
+        grew = True
+        while grew:
+            linked = set(representative[np.concatenate([groups[g] for g in free])].tolist())
+            more = {g for g in range(len(groups)) if g not in free and linked & set(representative[groups[g]].tolist())}
+            grew = bool(more)
+            free |= more
+        free = sorted(free)
+
+        status, new_groups = _solve_neighborhood(scheduler, terms, slots, groups, free, min(BALANCE_STEP_TIME, remaining))
+        if new_groups is not None:
+            kept = [g for g in range(len(groups)) if g not in free]
+            candidate_slots = [slots[g] for g in kept] + [slot for slot, _ in new_groups]
+            candidate_groups = [groups[g] for g in kept] + [members for _, members in new_groups]
+            value = sum(spreads(terms, candidate_groups).values())
+            value_deviation = deviation(terms, candidate_groups)
+            if (value, value_deviation) < (best, best_deviation):
+                slots, groups, best, best_deviation = candidate_slots, candidate_groups, value, value_deviation
+                improvements += 1
+                continue
+        if status == cp_model.OPTIMAL:
+            size = min(size + 1, len(groups)) # this neighborhood was already as good as it gets, look wider
+        elif status == cp_model.UNKNOWN:
+            size = max(size - 1, 2)
+
+    if improvements:
+        # back in slot order, like the solver's groups
+        order = sorted(range(len(groups)), key=lambda g: (slots[g], int(groups[g].min())))
+        balanced = scheduler._grouping_result([slots[g] for g in order], [sorted(groups[g].tolist()) for g in order])
+        result = dict(result, groups=balanced['groups'], total_groups=balanced['total_groups'])
+    result['balance'] = {
+        'objective': best,
+        'initial_objective': initial,
+        'best_bound': bound,
+        'gap': round((best - bound) / best, 4) if best else 0.0,
+        'spreads': spreads(terms, groups),
+        'steps': steps,
+        'improvements': improvements,
+        'seconds': round(time.perf_counter() - start, 4),
+    }
+    return result
@@ -0,0 +1,127 @@
+import os
+import csv
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pipeline import solve_rows
+from csv_parser import parse_bool
+from jobs import START_METHOD
+
+# defaults, can be overridden with environment variables
+BATCH_WORKERS = int(os.environ.get('SMARTGROUPS_BATCH_WORKERS', os.cpu_count() or 1)) # sections solved at once
+SECTION_TIME_LIMIT = float(os.environ.get('SMARTGROUPS_SECTION_TIME_LIMIT', 60)) # solver seconds per section, unless the form sets time_limit
+MAX_SECTIONS = int(os.environ.get('SMARTGROUPS_MAX_SECTIONS', 50))
+
+def _unique_name(name, taken):
+    """name, or the first of name (2), name (3), ... that isn't taken yet"""
+    if name not in taken:
+        return name
+    count = 2
+    while f'{name} ({count})' in taken:
+        count += 1
+    return f'{name} ({count})'
+
+def split_sections(data, column):
+    """
+    split one sheet into sections by the value in column (e.g. 'Section'); that column is dropped,
+    since every column that isn't a name or attribute counts as a time slot
+    students with a blank section get one of their own ('No section', or 'No section (2)' if that name is taken)
+    returns ({section: rows (headers first)} in the order the sections first appear, None)
+    or (None, error dict) if the sheet can't be split
+    """
+    rows = iter(data)
+    try:
+        headers = next(rows, None)
+        if not headers:
+            return None, {'error': 'The CSV file is empty.', 'status': 400}
+        headers_lower = [str(header).strip().lower() for header in headers]
+        if column.strip().lower() not in headers_lower:
+            return None, {'error': f'partition column {column} not found in the csv file.', 'status': 400}
+        i = headers_lower.index(column.strip().lower())
+
+        sections = {}
+        for row in rows:
+            if not row:
+                continue # blank line
+            section = row[i].strip() if i < len(row) else ''
+            if section not in sections:
+                if len(sections) >= MAX_SECTIONS:
+                    return None, {'error': f'Too many sections in the CSV file (the limit is {MAX_SECTIONS}).', 'status': 413}
+                sections[section] = [headers[:i] + headers[i + 1:]]
+            sections[section].append(row[:i] + row[i + 1:])
+    except UnicodeDecodeError:
+        return None, {'error': 'Could not read the file, please save it as a UTF-8 CSV and try again.', 'status': 400}
+    except csv.Error as e:
+        return None, {'error': f'Could not read the CSV file: {e}', 'status': 400}
+
+    if not sections:
+        return None, {'error': 'The CSV file has no students.', 'status': 400}
+    named = {}
+    for name, section_rows in sections.items():
+        named[name or _unique_name('No section', set(sections) | set(named))] = section_rows
+    return named, None
+
+def read_sections(files):
+    """
+    one section per uploaded file, named after the file
+    a file that can't be read becomes an error dict for that section (the others are still solved)
+    returns {section: rows or error dict}
+    """
+    sections = {}
+    for filename, data in files:
+        name = _unique_name(os.path.splitext(filename or '')[0] or f'Section {len(sections) + 1}', sections)
+        try:
+            sections[name] = list(data)
+        except UnicodeDecodeError:
+            sections[name] = {'error': 'Could not read the file, please save it as a UTF-8 CSV and try again.', 'status': 400}
+        except csv.Error as e:
+            sections[name] = {'error': f'Could not read the CSV file: {e}', 'status': 400}
+    return sections
+
+def _solve_section(rows, form):
+    """runs in a pool worker; never raises, so one bad section can't take the batch down"""
+    try:
+        return solve_rows(rows, form)
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+def solve_sections(sections, form, max_workers=BATCH_WORKERS, metrics=None):
+    """
+    solve every section on its own with the same constraint form, in parallel worker processes
+    sections: {section: rows (headers first) or an error dict}
+    every section gets the same solver time limit (the form's time_limit, or SECTION_TIME_LIMIT)
+    metrics: optional SolveMetrics, each section's solve is recorded in it
+    returns the batch response: {'sections': [{'section', 'status', and the result or 'error'}], 'solved', 'failed'}
+    """
+    form = dict(form)
+    if not str(form.get('time_limit', '')).strip():
+        form['time_limit'] = str(SECTION_TIME_LIMIT)
+    # the workers can't record into metrics, so they always send the diagnostics back (dropped below if not asked for)
+    wants_diagnostics = parse_bool(form, 'diagnostics')
+    form['diagnostics'] = 'true'
+
+    todo = {name: rows for name, rows in sections.items() if not isinstance(rows, dict)}
+    workers = min(max_workers, len(todo))
+    if workers > 1:
+        # not forked: this runs in a request thread of a threaded server (see jobs.START_METHOD)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD)) as pool:
+            futures = {name: pool.submit(_solve_section, rows, form) for name, rows in todo.items()}
+            results = {name: future.result() for name, future in futures.items()}
+    else:
+        results = {name: _solve_section(rows, form) for name, rows in todo.items()}
+
+    response = []
+    for name, rows in sections.items():
+        body, status = (rows, rows['status']) if isinstance(rows, dict) else results[name]
+        diagnostics = body.get('diagnostics') if wants_diagnostics else body.pop('diagnostics', None)
+        if metrics is not None:
+            metrics.observe(diagnostics)
+        entry = {'section': name, 'status': status}
+        if 'error' in body:
+            # error, plus solver_status / diagnosis when there is one
+            entry.update({key: value for key, value in body.items() if key != 'status'})
+        else:
+            entry['result'] = body
+        response.append(entry)
+
+    solved = sum(1 for entry in response if 'result' in entry)
+    return {'sections': response, 'solved': solved, 'failed': len(response) - solved}
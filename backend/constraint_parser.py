@@ -1,13 +1,15 @@
 # parse the csv file into list of constraints
 
 class SchedulingConstraints:
-    def __init__(self, attribute_constraints = None, group_size_min = None, group_size_max = None, group_count_min = None, group_count_max = None, combined_constraints = None):
+    def __init__(self, attribute_constraints = None, group_size_min = None, group_size_max = None, group_count_min = None, group_count_max = None, combined_constraints = None, avoid_pairs = None, keep_together = None):
         self.attribute_constraints = attribute_constraints or {}
         self.group_size_min = group_size_min or 1
         self.group_size_max = group_size_max or None
         self.group_count_min = group_count_min or 1
         self.group_count_max = group_count_max or None
         self.combined_constraints = combined_constraints or []
+        self.avoid_pairs = avoid_pairs or [] # [name, name] pairs that can't share a group
+        self.keep_together = keep_together or [] # lists of names that have to be in the same group
 
     def set_attribute_constraints(self, attribute_constraints):
         self.attribute_constraints = attribute_constraints
@@ -23,6 +25,10 @@ class SchedulingConstraints:
     def set_combined_constraints(self, combined_constraints):
         self.combined_constraints = combined_constraints
 
+    def set_pair_constraints(self, avoid_pairs, keep_together):
+        self.avoid_pairs = avoid_pairs
+        self.keep_together = keep_together
+
     def get_attribute_constraints(self):
         return self.attribute_constraints
 
@@ -34,7 +40,33 @@ class SchedulingConstraints:
         
     def get_combined_constraints(self):
         return self.combined_constraints
-        
-    
-    
 
+    def get_pair_constraints(self):
+        return self.avoid_pairs, self.keep_together
+
+    def has_pair_constraints(self):
+        return bool(self.avoid_pairs or self.keep_together)
+
+    def to_dict(self):
+        """
+        plain, normalized copy of every constraint (sorted, so two equal constraint sets give the same dict)
+        """
+        combined = []
+        for c in self.combined_constraints:
+            combined.append({
+                'attributes': sorted(c.get('attributes', [])),
+                'min': c.get('min'),
+                'max': c.get('max'),
+            })
+        combined.sort(key=lambda c: (c['attributes'], str(c['min']), str(c['max'])))
+
+        return {
+            'attribute_constraints': {attr: dict(sorted(cons.items())) for attr, cons in sorted(self.attribute_constraints.items())},
+            'group_size_min': self.group_size_min,
+            'group_size_max': self.group_size_max,
+            'group_count_min': self.group_count_min,
+            'group_count_max': self.group_count_max,
+            'combined_constraints': combined,
+            'avoid_pairs': sorted(sorted(pair) for pair in self.avoid_pairs),
+            'keep_together': sorted(sorted(names) for names in self.keep_together),
+        }
@@ -1,21 +1,67 @@
 import io
+import os
+import math
 import csv
-import pandas as pd
+import numpy as np
 from constraint_parser import SchedulingConstraints
+from student_matrix import StudentMatrix, normalize_cell, attribute_matrix
 import json
 
+# defaults, can be overridden with environment variables
+MAX_UPLOAD_MB = float(os.environ.get('SMARTGROUPS_MAX_UPLOAD_MB', 10)) # bigger uploads are rejected before reading them
+MAX_ROWS = int(os.environ.get('SMARTGROUPS_MAX_ROWS', 20000)) # students per csv
+MAX_SOLUTIONS = int(os.environ.get('SMARTGROUPS_MAX_SOLUTIONS', 10)) # alternative groupings per request (num_solutions)
+
 def get_csv(request):
+    """
+    check the upload and open it as a stream of csv rows
+    the rows aren't read here, parse_student_data reads them one at a time (the headers first)
+    """
+    if request.content_length and request.content_length > MAX_UPLOAD_MB * 1024 * 1024:
+        return {'error': f'File is too large (the limit is {MAX_UPLOAD_MB:g} MB).', 'status': 413}
+
     if 'file' not in request.files:
         return {'error': 'No file part', 'status': 400}
 
-    file = request.files['file'] # get the file user uploads
+    return open_csv(request.files['file']) # get the file user uploads
+
+def get_csvs(request):
+    """
+    like get_csv, for several files at once (sent as 'files', or as several 'file' fields)
+    returns {'data': [(filename, lazy csv rows), ...], 'status': 200} or an error dict
+    """
+    if request.content_length and request.content_length > MAX_UPLOAD_MB * 1024 * 1024:
+        return {'error': f'Upload is too large (the limit is {MAX_UPLOAD_MB:g} MB).', 'status': 413}
+
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return {'error': 'No file part', 'status': 400}
+
+    data = []
+    for file in files:
+        csv_input = open_csv(file)
+        if 'error' in csv_input:
+            return {'error': f'{file.filename}: {csv_input["error"]}' if file.filename else csv_input['error'],
+                    'status': csv_input['status']}
+        data.append((file.filename, csv_input['data']))
+    return {'data': data, 'status': 200}
 
+def open_csv(file):
+    """size check + lazy csv reader for one uploaded file"""
     if file.filename == '':
         return {'error': 'No selected file', 'status': 400}
-    
-    stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-    csv_input = list(csv.reader(stream)) # csv_input is a list of lists, each inner list is a row
-    
+
+    # the upload is already spooled by werkzeug, so its size is known without reading it
+    file.stream.seek(0, io.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    if size > MAX_UPLOAD_MB * 1024 * 1024:
+        return {'error': f'File is too large (the limit is {MAX_UPLOAD_MB:g} MB).', 'status': 413}
+
+    # decoded as it's read; utf-8-sig also drops the byte order mark excel puts in front of the headers
+    stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+    csv_input = csv.reader(stream) # rows come out as lists of cells, lazily
+
     return {'data': csv_input, 'status': 200}
 
 def find_name_indices(headers_lower):
@@ -46,94 +92,101 @@ def find_data_attributes(headers_lower, name_indices, student_attributes):
     return attributes_indices, availabilities_indices
 
 def parse_student_data(data, given_attributes):
-    headers_lower = [str(header).strip().lower() for header in data[0]] # first row of data is headers, make lower case and strip whitespace
+    """
+    parse the csv rows in one pass, straight into a StudentMatrix
+    data: any iterable of rows (a list, or the lazy reader from get_csv); the first row is the headers
+    returns {'students': StudentMatrix of students with availabilities, 'unassigned_students': [...], 'num_rows': int,
+             'rows': which student row (blank lines skipped) each of the students came from}
+    or an error dict with 'status'
+    """
+    rows = iter(data)
+    try:
+        headers = next(rows, None)
+        if not headers:
+            return {'error': 'The CSV file is empty.', 'status': 400}
+        headers_lower = [str(header).strip().lower() for header in headers] # first row of data is headers, make lower case and strip whitespace
 
-    # check that the name column(s) exist, and figure out which ones they are
-    name_indices = find_name_indices(headers_lower)
-    if isinstance(name_indices, dict):
-        return {'error': name_indices['error'], 'status': name_indices['status']}
+        # check that the name column(s) exist, and figure out which ones they are
+        name_indices = find_name_indices(headers_lower)
+        if isinstance(name_indices, dict):
+            return {'error': name_indices['error'], 'status': name_indices['status']}
 
-    # check if there are any student attributes not in headers_lower
-    for attr in given_attributes:
-        if attr not in headers_lower:
-            return {'error': f'student attribute {attr} not found in the csv file. please check the format and try again.', 'status': 400}
-
-    # get attributes and availabilities indices
-    attribute_indices, availability_indices = find_data_attributes(headers_lower, name_indices, given_attributes)
-
-    # now make the csv into a df
-    df = pd.DataFrame(data[1:], columns=headers_lower)  # type: ignore
-
-    # merge multiple name columns into one if needed
-    if len(name_indices) > 1:
-        # merge multiple name columns into one
-        name_values = df.iloc[:, name_indices].apply(lambda row: ' '.join(row.astype(str)), axis=1)
-        df['name'] = name_values
-        # drop the original name columns
-        df = df.drop(columns=[headers_lower[i] for i in name_indices])
-        name_column = 'name'
-    else:
-        # single name column
-        name_column = headers_lower[name_indices[0]]
+        # check if there are any student attributes not in headers_lower
+        for attr in given_attributes:
+            if attr not in headers_lower:
+                return {'error': f'student attribute {attr} not found in the csv file. please check the format and try again.', 'status': 400}
 
-    # reorder columns: Name, Attributes, Availabilities
-    attribute_columns = [headers_lower[i] for i in attribute_indices]
-    availability_columns = [headers_lower[i] for i in availability_indices]
-    
-    # create the new column order
-    new_column_order = [name_column] + attribute_columns + availability_columns
-    df = df[new_column_order]
-
-    # handle empty values: replace NaN, None, and empty strings with '0' for attributes and availabilities
-    # this ensures that missing data is treated as "not available" or "doesn't have attribute"
-    for col in attribute_columns + availability_columns:
-        df.loc[:, col] = df.loc[:, col].fillna('0')  
-        df.loc[:, col] = df.loc[:, col].replace('', '0')
-        # convert Yes/yes/True/true to 1 and No/no/False/false to 0
-        df.loc[:, col] = df.loc[:, col].replace({'Yes': '1', 'yes': '1', 'No': '0', 'no': '0', 'True': '1', 'False': '0', 'true': '1', 'false': '0'})
-        df.loc[:, col] = df.loc[:, col].astype(str)  
-
-    # get the student data, attributes, availabilities
-    student_names = df[name_column].tolist()  
-    student_attributes = df[attribute_columns].to_dict(orient='records') if attribute_columns else []  # type: ignore
-    student_availabilities = df[availability_columns].to_dict(orient='records') if availability_columns else []  # type: ignore
+        # get attributes and availabilities indices
+        attribute_indices, availability_indices = find_data_attributes(headers_lower, name_indices, given_attributes)
+        attribute_columns = [headers_lower[i] for i in attribute_indices]
+        availability_columns = [headers_lower[i] for i in availability_indices]
+
+        # the headers are fine, now read the students
+        # empty values become '0' for attributes and availabilities (missing data is "not available" or "doesn't have attribute"),
+        # Yes/yes/True/true become '1' and No/no/False/false become '0'
+        names = []
+        attribute_values = [[] for _ in attribute_indices] # per column, attribute columns may hold text (e.g. emails)
+        availability_rows = bytearray() # students x slots, one byte per cell
+        num_columns = len(headers_lower)
+        for row in rows:
+            if not row:
+                continue # blank line
+            if len(names) >= MAX_ROWS:
+                return {'error': f'Too many students in the CSV file (the limit is {MAX_ROWS}).', 'status': 413}
+            if len(row) < num_columns:
+                row = row + [''] * (num_columns - len(row))
+
+            # merge multiple name columns into one if needed
+            names.append(' '.join(row[i] for i in name_indices) if len(name_indices) > 1 else row[name_indices[0]])
+            for values, i in zip(attribute_values, attribute_indices):
+                values.append(normalize_cell(row[i]))
+            availability_rows.extend(normalize_cell(row[i]) == '1' for i in availability_indices)
+    except UnicodeDecodeError:
+        return {'error': 'Could not read the file, please save it as a UTF-8 CSV and try again.', 'status': 400}
+    except csv.Error as e:
+        return {'error': f'Could not read the CSV file: {e}', 'status': 400}
+
+    # build the compact students x attributes / students x slots matrices once, here
+    attributes, raw_attributes = attribute_matrix(attribute_columns, attribute_values, len(names))
+    availabilities = np.frombuffer(bytes(availability_rows), dtype=np.uint8).reshape(len(names), len(availability_columns))
+    students = StudentMatrix(names, attribute_columns, availability_columns, attributes, availabilities, raw_attributes)
 
     # filter out students with no availability and track them separately
-    filtered_names = []
-    filtered_attributes = []
-    filtered_availabilities = []
-    unassigned_students = []
-    
-    for i, avail in enumerate(student_availabilities):
-        if all(str(v).strip() == '0' for v in avail.values()):
-            # student has no availability - add to unassigned list
-            unassigned_students.append({
-                'name': student_names[i],
-                'attributes': student_attributes[i] if student_attributes else {},
-                'availabilities': avail
-            })
-        else:
-            # student has availability - include in filtered data
-            filtered_names.append(student_names[i])
-            if student_attributes:
-                filtered_attributes.append(student_attributes[i])
-            filtered_availabilities.append(avail)
-    
+    has_availability = students.availabilities.any(axis=1)
+    unassigned_students = [students.student_record(i) for i in np.flatnonzero(~has_availability)]
+
     # if no students have availability, return error
-    if not filtered_names:
+    if not has_availability.any():
         return {'error': 'No students have any available times. Please ensure at least one student has available time slots.', 'status': 400}
 
     return {
-        'df': df,
-        'student_names': filtered_names,
-        'student_attributes': filtered_attributes,
-        'student_availabilities': filtered_availabilities,
+        'students': students.subset(np.flatnonzero(has_availability)),
         'unassigned_students': unassigned_students,
+        'num_rows': len(names),
+        'rows': np.flatnonzero(has_availability),
     }
 
-def parse_attribute_constraints(request, given_attributes):
+def parse_given_attributes(form):
+    """
+    the attribute column names the user typed in (comma-separated), lower case
+    """
+    given_attributes = []
+    if form.get('given_attributes'):
+        given_attributes = [attr.strip().lower() for attr in form['given_attributes'].split(',')]
+    # columns that name students to avoid (see parse_pair_constraints) are read like attributes,
+    # otherwise they'd be taken for time slots
+    for column in parse_avoid_columns(form):
+        if column not in given_attributes:
+            given_attributes.append(column)
+    return given_attributes
+
+def parse_avoid_columns(form):
+    """the avoid_columns form field: comma-separated column names, lower case"""
+    return [column.strip().lower() for column in form.get('avoid_columns', '').split(',') if column.strip()]
+
+def parse_attribute_constraints(form, given_attributes):
     # Create a case-insensitive lookup for form keys
-    form_dict_lower = {k.lower(): v for k, v in request.form.items()}
+    form_dict_lower = {k.lower(): v for k, v in form.items()}
     
     # get the constraints for each of the student attributes
     attribute_constraints = {}
@@ -157,38 +210,189 @@ def parse_attribute_constraints(request, given_attributes):
     
     return attribute_constraints
 
-def parse_all_constraints(request, num_students, num_availabilities, given_attributes):
+def _name_lists(form, key):
+    """a json list of lists of student names from the form, or an error dict"""
+    try:
+        value = json.loads(form[key]) if str(form.get(key, '')).strip() else []
+    except ValueError:
+        return {'error': f'{key} must be a json list of lists of student names.', 'status': 400}
+    if not isinstance(value, list) or not all(isinstance(names, list) and all(isinstance(name, str) for name in names) for names in value):
+        return {'error': f'{key} must be a json list of lists of student names.', 'status': 400}
+    return value
+
+def parse_pair_constraints(form, students, unassigned_students=()):
+    """
+    which students can't share a group, and which have to be in the same one:
+    avoid_pairs: json list of lists of names, no two students in a list may share a group (e.g. [["Ann Lee", "Bo Park"]])
+    keep_together: json list of lists of names, the students in a list are all in the same group
+    avoid_columns: comma-separated columns (e.g. Hate1,Hate2) whose cells name a student (or several, separated by ;)
+                   the student in that row can't share a group with
+    names are matched case-insensitively against the name column(s); students: the StudentMatrix,
+    unassigned_students: the students with no availabilities (they can be named, but there's nothing to constrain)
+    returns {'avoid_pairs': [[name, name], ...], 'keep_together': [[name, ...], ...]} with the names as spelled
+    in the csv, or an error dict
+    """
+    known = {}
+    for name in list(students.names) + [student['name'] for student in unassigned_students]:
+        key = name.strip().lower()
+        known[key] = name if key not in known else None # None: more than one student has this name
+
+    def resolve(names, key):
+        resolved = []
+        for name in names:
+            match = known.get(name.strip().lower(), False)
+            if match is False:
+                return {'error': f'{key}: no student named {name} in the csv file.', 'status': 400}
+            if match is None:
+                return {'error': f'{key}: more than one student is named {name}, please make the names unique.', 'status': 400}
+            if match not in resolved:
+                resolved.append(match)
+        return resolved
+
+    avoid_lists = _name_lists(form, 'avoid_pairs')
+    if 'error' in avoid_lists:
+        return avoid_lists
+    for column in parse_avoid_columns(form):
+        if column not in students.attribute_index:
+            return {'error': f'avoid column {column} not found in the csv file.', 'status': 400}
+        values = students.raw_attributes.get(column)
+        for s, cell in enumerate(values or []):
+            # blanks and yes / no (normalized to 0 / 1, like the cells) don't name anyone
+            avoid_lists.extend([students.names[s], name.strip()] for name in cell.split(';') if normalize_cell(name) not in ('0', '1'))
+
+    avoid_pairs = set()
+    for names in avoid_lists:
+        resolved = resolve(names, 'avoid_pairs')
+        if 'error' in resolved:
+            return resolved
+        avoid_pairs.update((a, b) if a < b else (b, a) for i, a in enumerate(resolved) for b in resolved[i + 1:])
+
+    keep_lists = _name_lists(form, 'keep_together')
+    if 'error' in keep_lists:
+        return keep_lists
+    keep_together = []
+    for names in keep_lists:
+        resolved = resolve(names, 'keep_together')
+        if 'error' in resolved:
+            return resolved
+        if len(resolved) > 1:
+            keep_together.append(resolved)
+
+    return {'avoid_pairs': [list(pair) for pair in sorted(avoid_pairs)], 'keep_together': keep_together}
+
+def parse_all_constraints(form, num_students, num_availabilities, given_attributes, students=None, unassigned_students=()):
     """
-    parse the different kinds of constraints: group sizes, number of groups, counts per attribute (individual and combined)
+    parse the different kinds of constraints: group sizes, number of groups, counts per attribute (individual and combined),
+    and with students (the StudentMatrix) the pair constraints too, see parse_pair_constraints
+    form: the submitted form fields (request.form, or a plain dict of them)
+    returns SchedulingConstraints, or an error dict if the pair constraints can't be read
     """
-    if 'group_size_max' in request.form:
-        group_size_max = int(request.form['group_size_max'])
+    if 'group_size_max' in form:
+        group_size_max = int(form['group_size_max'])
     else:
         group_size_max = num_students
 
-    if 'group_size_min' in request.form:
-        group_size_min = int(request.form['group_size_min'])
+    if 'group_size_min' in form:
+        group_size_min = int(form['group_size_min'])
     else:
         group_size_min = 1
 
-    if 'group_count_min' in request.form:
-        group_count_min = int(request.form['group_count_min'])
+    if 'group_count_min' in form:
+        group_count_min = int(form['group_count_min'])
     else:
         group_count_min = 1
 
-    if 'group_count_max' in request.form:
-        group_count_max = int(request.form['group_count_max'])
+    if 'group_count_max' in form:
+        group_count_max = int(form['group_count_max'])
     else:
         group_count_max = num_availabilities
 
-    attribute_constraints = parse_attribute_constraints(request, given_attributes)
+    attribute_constraints = parse_attribute_constraints(form, given_attributes)
 
     combined_constraints = []
-    if 'combined_constraints' in request.form:
+    if 'combined_constraints' in form:
         try:
-            combined_constraints = json.loads(request.form['combined_constraints'])
+            combined_constraints = json.loads(form['combined_constraints'])
         except Exception:
             combined_constraints = []
 
-    constraints = SchedulingConstraints(attribute_constraints, group_size_min, group_size_max, group_count_min, group_count_max, combined_constraints)
+    pairs = {'avoid_pairs': [], 'keep_together': []}
+    if students is not None:
+        pairs = parse_pair_constraints(form, students, unassigned_students)
+        if 'error' in pairs:
+            return pairs
+
+    constraints = SchedulingConstraints(attribute_constraints, group_size_min, group_size_max, group_count_min, group_count_max, combined_constraints,
+                                        pairs['avoid_pairs'], pairs['keep_together'])
     return constraints
+
+# solver settings the user can pass with the form: form key -> (type, smallest allowed value)
+SOLVER_PARAMS = {
+    'time_limit': (float, 0.1), # seconds before the solver gives up and returns the best grouping so far
+    'num_workers': (int, 1), # parallel search workers
+    'random_seed': (int, 0),
+    'relative_gap': (float, 0.0), # stop once the objective is within this fraction of the best bound
+}
+
+def parse_solver_params(form):
+    """
+    parse the optional solver settings (time limit, worker count, random seed, relative gap)
+    returns a dict with only the settings that were given, or an error dict
+    """
+    solver_params = {}
+    for key, (cast, minimum) in SOLVER_PARAMS.items():
+        if form.get(key) in (None, ''):
+            continue
+        try:
+            value = cast(form[key])
+        except ValueError:
+            return {'error': f'{key} must be a number.', 'status': 400}
+        if not math.isfinite(value): # nan / inf get past the comparison below
+            return {'error': f'{key} must be a finite number.', 'status': 400}
+        if value < minimum:
+            return {'error': f'{key} must be at least {minimum}.', 'status': 400}
+        solver_params[key] = value
+    return solver_params
+
+def parse_num_solutions(form):
+    """
+    how many different groupings to return and how different they have to be:
+    num_solutions: 1 (default) to MAX_SOLUTIONS
+    min_difference: students that must have different groupmates between any two of them (default: 10% of the students)
+    returns {'num_solutions': int, 'min_difference': int or None}, or an error dict
+    """
+    parsed = {'num_solutions': 1, 'min_difference': None}
+    for key, minimum in (('num_solutions', 1), ('min_difference', 1)):
+        if form.get(key) in (None, ''):
+            continue
+        try:
+            parsed[key] = int(form[key])
+        except ValueError:
+            return {'error': f'{key} must be a whole number.', 'status': 400}
+        if parsed[key] < minimum:
+            return {'error': f'{key} must be at least {minimum}.', 'status': 400}
+    if parsed['num_solutions'] > MAX_SOLUTIONS:
+        return {'error': f'num_solutions can be at most {MAX_SOLUTIONS}.', 'status': 400}
+    return parsed
+
+def parse_bool(form, key):
+    """checkbox-style form value: 1/true/yes/on count as True"""
+    return str(form.get(key, '')).strip().lower() in ('1', 'true', 'yes', 'on')
+
+def parse_warm_start(form):
+    """
+    optional warm start for re-solving after a small constraint change:
+    previous_result: a previous response from this api (json), its grouping is used as the starting point
+    minimize_changes: if true, prefer keeping students in their previous groups
+    returns {'previous_result': dict or None, 'minimize_changes': bool}, or an error dict
+    """
+    previous_result = None
+    if form.get('previous_result'):
+        try:
+            previous_result = json.loads(form['previous_result'])
+        except ValueError:
+            return {'error': 'previous_result must be a previous result in json format.', 'status': 400}
+        if not isinstance(previous_result, dict) or not isinstance(previous_result.get('groups'), list):
+            return {'error': 'previous_result must contain a list of groups.', 'status': 400}
+
+    return {'previous_result': previous_result, 'minimize_changes': parse_bool(form, 'minimize_changes')}
@@ -0,0 +1,72 @@
+import os
+import time
+import uuid
+import threading
+
+# defaults, can be overridden with environment variables
+DATASET_TTL = float(os.environ.get('SMARTGROUPS_DATASET_TTL', 3600)) # seconds a dataset is kept after it was last used
+DATASET_MAX = int(os.environ.get('SMARTGROUPS_DATASET_MAX', 64)) # the least recently used dataset is dropped past this
+
+class DatasetStore:
+    def __init__(self, ttl=DATASET_TTL, max_datasets=DATASET_MAX):
+        """
+        keeps parsed datasets (see pipeline.parse_dataset) in memory so they can be solved many times
+        a dataset expires ttl seconds after it was last used
+        """
+        self.ttl = ttl
+        self.max_datasets = max_datasets
+        self.datasets = {}
+        self.last_used = {}
+        self.lock = threading.Lock()
+
+    def add(self, dataset):
+        """store a parsed dataset, returns its id"""
+        dataset_id = uuid.uuid4().hex
+        with self.lock:
+            self._evict_expired()
+            self.datasets[dataset_id] = dataset
+            self.last_used[dataset_id] = time.time()
+            while len(self.datasets) > self.max_datasets:
+                oldest = min(self.last_used, key=self.last_used.get)
+                self._remove(oldest)
+        return dataset_id
+
+    def get(self, dataset_id):
+        """the dataset (and refresh its expiry), or None if it doesn't exist or expired"""
+        with self.lock:
+            self._evict_expired()
+            if dataset_id not in self.datasets:
+                return None
+            self.last_used[dataset_id] = time.time()
+            return self.datasets[dataset_id]
+
+    def remove(self, dataset_id):
+        with self.lock:
+            if dataset_id not in self.datasets:
+                return False
+            self._remove(dataset_id)
+            return True
+
+    def summary(self, dataset_id):
+        """what the api returns about a dataset (no student data)"""
+        dataset = self.get(dataset_id)
+        if dataset is None:
+            return None
+        students = dataset['students']
+        return {
+            'dataset_id': dataset_id,
+            'num_students': len(students),
+            'num_unassigned': len(dataset['unassigned_students']),
+            'attributes': students.attribute_names,
+            'time_slots': students.time_slots,
+            'expires_in': self.ttl,
+        }
+
+    def _evict_expired(self):
+        now = time.time()
+        for dataset_id in [d for d, used in self.last_used.items() if now - used > self.ttl]:
+            self._remove(dataset_id)
+
+    def _remove(self, dataset_id):
+        del self.datasets[dataset_id]
+        del self.last_used[dataset_id]
@@ -0,0 +1,242 @@
+import os
+import math
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from constraint_parser import SchedulingConstraints
+from jobs import START_METHOD
+
+# defaults, can be overridden with environment variables
+DECOMPOSE_MIN_STUDENTS = int(os.environ.get('SMARTGROUPS_DECOMPOSE_MIN_STUDENTS', 300)) # auto-decompose from this many students
+BLOCK_SIZE = int(os.environ.get('SMARTGROUPS_BLOCK_SIZE', 50)) # target number of students per block
+DECOMPOSE_WORKERS = int(os.environ.get('SMARTGROUPS_DECOMPOSE_WORKERS', os.cpu_count() or 1))
+
+def slot_components(availabilities):
+    """
+    connected components of the students x slots availability graph
+    (two students are connected if they share an available slot)
+    returns a list of (student indices, slot indices)
+    """
+    num_students, num_slots = availabilities.shape
+    parent = list(range(num_slots))
+
+    def find(t):
+        while parent[t] != t:
+            parent[t] = parent[parent[t]]
+            t = parent[t]
+        return t
+
+    # every student joins all the slots they're available in into one component
+    for s in range(num_students):
+        slots = np.flatnonzero(availabilities[s])
+        for t in slots[1:]:
+            a, b = find(slots[0]), find(t)
+            if a != b:
+                parent[b] = a
+
+    roots = np.array([find(t) for t in range(num_slots)])
+    first_slot = availabilities.argmax(axis=1) # every student has at least one slot
+    student_roots = roots[first_slot]
+
+    components = []
+    for root in np.unique(student_roots):
+        students = np.flatnonzero(student_roots == root)
+        slots = np.flatnonzero(roots == root)
+        components.append((students, slots))
+    return components
+
+def split_component(availabilities, students, slots, block_size):
+    """
+    split one big component into blocks of about block_size students:
+    each student gets a home slot (least flexible students first, preferring the slots most students can make),
+    then slots are packed into blocks together with their home students
+    a block may use every slot in it, so students keep some freedom inside their block
+    """
+    sub = availabilities[np.ix_(students, slots)]
+    popularity = sub.sum(axis=0)
+    home = np.empty(len(students), dtype=np.int64)
+    for i in np.argsort(sub.sum(axis=1), kind='stable'):
+        options = np.flatnonzero(sub[i])
+        home[i] = options[np.argmax(popularity[options])]
+
+    # first-fit decreasing: biggest slots first, a slot with more than block_size students is chunked
+    blocks = [] # [students list, slots list]
+    for t in np.argsort(-np.bincount(home, minlength=len(slots)), kind='stable'):
+        members = students[home == t].tolist()
+        if not members:
+            continue
+        while len(members) > block_size:
+            blocks.append([members[:block_size], [slots[t]]])
+            members = members[block_size:]
+        target = next((block for block in blocks if len(block[0]) + len(members) <= block_size), None)
+        if target is None:
+            blocks.append([members, [slots[t]]])
+        else:
+            target[0].extend(members)
+            if slots[t] not in target[1]:
+                target[1].append(slots[t])
+    return [(np.array(sorted(b_students)), np.array(sorted(b_slots))) for b_students, b_slots in blocks]
+
+def make_blocks(students, block_size, min_block=1):
+    """
+    independent components first, then any component that's still too big is split by home slot
+    blocks under min_block students (too small to form groups on their own) are merged into the smallest other block
+    """
+    blocks = []
+    for component_students, component_slots in slot_components(students.availabilities):
+        if len(component_students) <= block_size:
+            blocks.append((component_students, component_slots))
+        else:
+            blocks.extend(split_component(students.availabilities, component_students, component_slots, block_size))
+
+    blocks.sort(key=lambda block: len(block[0]))
+    while len(blocks) > 1 and len(blocks[0][0]) < min_block:
+        (small_students, small_slots), (other_students, other_slots) = blocks[0], blocks[1]
+        merged = (np.union1d(small_students, other_students), np.union1d(small_slots, other_slots))
+        blocks = sorted(blocks[2:] + [merged], key=lambda block: len(block[0]))
+    # back to row order, so the groups come out in roughly the order of the sheet
+    blocks.sort(key=lambda block: block[0][0])
+    return blocks
+
+def allocate_group_counts(block_sizes, constraints):
+    """
+    split the overall group count range over the blocks
+    returns a list of (min groups, max groups) per block, or None if the sizes can't be made to fit
+    """
+    size_min = constraints.group_size_min or 1
+    size_max = constraints.group_size_max
+    lows = [math.ceil(n / size_max) if size_max else 1 for n in block_sizes]
+    highs = [n // size_min for n in block_sizes]
+    if any(lo > hi for lo, hi in zip(lows, highs)):
+        return None
+
+    count_min = constraints.group_count_min or 1
+    count_max = constraints.group_count_max or sum(highs)
+    if sum(lows) > count_max or sum(highs) < count_min:
+        return None
+
+    # too many groups possible: hand the spare count out in proportion to each block's slack
+    if sum(highs) > count_max:
+        spare = count_max - sum(lows)
+        slack = sum(hi - lo for lo, hi in zip(lows, highs))
+        highs = [lo + (spare * (hi - lo)) // slack for lo, hi in zip(lows, highs)]
+
+    # too few groups required: raise the blocks' minimums where there's room
+    missing = count_min - sum(lows)
+    while missing > 0:
+        b = max(range(len(lows)), key=lambda i: highs[i] - lows[i])
+        if highs[b] == lows[b]:
+            return None
+        lows[b] += 1
+        missing -= 1
+    return list(zip(lows, highs))
+
+_stop_event = None # a pool worker's copy of the stop event of decomposed_schedule
+
+def _init_worker(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+def _solve_block(scheduler, stop_event=None):
+    """
+    runs in a pool worker (or in-process, with stop_event given); stops the block's solve once the stop event
+    is set, which GroupScheduler.stop does for the scheduler that decomposed
+    """
+    stop_event = stop_event or _stop_event
+    if stop_event is None:
+        return scheduler.schedule()
+    if stop_event.is_set():
+        return {'error': 'The solve was stopped.', 'solver_status': 'UNKNOWN'}
+    done = threading.Event()
+
+    def watch():
+        # the block's solver may not exist yet when the event is set, so keep stopping until it's done
+        while not done.is_set():
+            if stop_event.wait(0.2):
+                scheduler.stop()
+                done.wait(0.2)
+
+    threading.Thread(target=watch, daemon=True).start()
+    try:
+        return scheduler.schedule()
+    finally:
+        done.set()
+
+def decomposed_schedule(scheduler, block_size=BLOCK_SIZE, max_workers=DECOMPOSE_WORKERS):
+    """
+    solve a big cohort as independent blocks (in parallel) and merge the groups
+    returns the merged result (same format as GroupScheduler.schedule), or None if the split didn't work out
+    (some block has no valid grouping) and the full model should be solved instead
+    """
+    # imported here since scheduler.py imports this module
+    from scheduler import GroupScheduler
+
+    students = scheduler.students
+    constraints = scheduler.constraints
+    blocks = make_blocks(students, block_size, min_block=max(constraints.group_size_min or 1, block_size // 4))
+    if len(blocks) < 2:
+        return None
+
+    counts = allocate_group_counts([len(block_students) for block_students, _ in blocks], constraints)
+    if counts is None:
+        return None
+
+    # with fewer workers than blocks, blocks run one after another, so split the time limit between them
+    # already in a worker process (a batch section or a background job, which run side by side): no pool of its own
+    workers = 1 if multiprocessing.parent_process() is not None else min(max_workers, len(blocks))
+    solver_params = dict(scheduler.solver_params)
+    if solver_params.get('time_limit'):
+        solver_params['time_limit'] = solver_params['time_limit'] / math.ceil(len(blocks) / workers)
+
+    sub_schedulers = []
+    for (block_students, block_slots), (count_min, count_max) in zip(blocks, counts):
+        sub_students = students.subset(block_students)
+        sub_students = sub_students.slot_subset(block_slots)
+        sub_constraints = SchedulingConstraints(constraints.attribute_constraints, constraints.group_size_min,
+                                                constraints.group_size_max, count_min, count_max,
+                                                constraints.combined_constraints)
+        sub_schedulers.append(GroupScheduler(sub_students, sub_constraints, symmetry_breaking=scheduler.symmetry_breaking,
+                                             solver_params=solver_params, decompose=False, aggregate=scheduler.aggregate))
+
+    # scheduler.stop() sets the event, which stops the blocks wherever they run
+    # (the pool starts its workers like the job manager does, not by forking a threaded server process)
+    if workers > 1:
+        context = multiprocessing.get_context(START_METHOD)
+        scheduler.stop_event = context.Event()
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                     initargs=(scheduler.stop_event,)) as pool:
+                results = list(pool.map(_solve_block, sub_schedulers))
+        finally:
+            scheduler.stop_event = None
+    else:
+        scheduler.stop_event = threading.Event()
+        try:
+            results = [_solve_block(sub, scheduler.stop_event) for sub in sub_schedulers]
+        finally:
+            scheduler.stop_event = None
+
+    if any('error' in result for result in results):
+        return None
+
+    # merge: renumber the groups and give every student their full availability row back
+    groups = []
+    for result, (block_students, _) in zip(results, blocks):
+        names_to_rows = {}
+        for s in block_students.tolist():
+            names_to_rows.setdefault(students.names[s], []).append(s)
+        for group in result['groups']:
+            group['group_id'] = len(groups) + 1
+            group['students'] = [students.student_record(names_to_rows[student['name']].pop(0))
+                                 for student in group['students']]
+            groups.append(group)
+
+    statuses = [result['solver_status'] for result in results]
+    merged = scheduler._result(groups)
+    merged['solver_status'] = 'OPTIMAL' if all(status == 'OPTIMAL' for status in statuses) else 'FEASIBLE'
+    merged['decomposition'] = {
+        'blocks': len(blocks),
+        'block_sizes': [len(block_students) for block_students, _ in blocks],
+    }
+    return merged
@@ -0,0 +1,121 @@
+import io
+import os
+import csv
+import tempfile
+
+# openpyxl is optional, only needed for xlsx exports
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+# defaults, can be overridden with environment variables
+EXPORT_CHUNK_ROWS = int(os.environ.get('SMARTGROUPS_EXPORT_CHUNK_ROWS', 500)) # csv rows per streamed chunk
+
+# column kinds that can be picked with columns=..., in the order they come out
+EXPORT_COLUMNS = ('name', 'group', 'slot', 'attributes', 'availabilities')
+UNASSIGNED_GROUP = 'Unassigned - no availabilities'
+
+def parse_export_options(args, result):
+    """
+    which columns to export, from the query parameters:
+    columns: comma-separated kinds out of name, group, slot, attributes, availabilities (default all of them)
+    attributes: comma-separated attribute names to include (default every attribute)
+    returns {'columns': [...], 'attributes': [...], 'time_slots': [...]} or an error dict
+    """
+    columns = [column.strip().lower() for column in args.get('columns', '').split(',') if column.strip()] or list(EXPORT_COLUMNS)
+    unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+    if unknown:
+        return {'error': f'unknown export column(s): {", ".join(unknown)}. choose from {", ".join(EXPORT_COLUMNS)}.', 'status': 400}
+
+    # the column names come from the first student, like the frontend export
+    first = next((group['students'][0] for group in result.get('groups', []) if group['students']), None)
+    all_attributes = list(first['attributes']) if first else []
+    time_slots = list(first['availabilities']) if first else []
+
+    attributes = all_attributes
+    if args.get('attributes'):
+        attributes = [attr.strip().lower() for attr in args['attributes'].split(',') if attr.strip()]
+        missing = [attr for attr in attributes if attr not in all_attributes]
+        if missing:
+            return {'error': f'attribute(s) not in the result: {", ".join(missing)}.', 'status': 400}
+        if 'attributes' not in columns:
+            columns.append('attributes')
+
+    return {
+        'columns': [column for column in EXPORT_COLUMNS if column in columns],
+        'attributes': attributes if 'attributes' in columns else [],
+        'time_slots': time_slots if 'availabilities' in columns else [],
+    }
+
+def export_rows(result, options):
+    """
+    the export as rows (headers first), one row per student, generated lazily
+    same layout as the frontend's csv download: name, assigned group, assigned time slot, attributes, availabilities
+    """
+    headers = []
+    for column in options['columns']:
+        if column == 'name':
+            headers.append('Student Name')
+        elif column == 'group':
+            headers.append('Assigned Group')
+        elif column == 'slot':
+            headers.append('Assigned Time Slot')
+        elif column == 'attributes':
+            headers.extend(options['attributes'])
+        elif column == 'availabilities':
+            headers.extend(options['time_slots'])
+    yield headers
+
+    group_number = 0
+    for group in result.get('groups', []):
+        if group.get('is_unassigned'):
+            group_name = UNASSIGNED_GROUP
+        else:
+            group_number += 1
+            group_name = f'Group {group_number}'
+        for student in group['students']:
+            row = []
+            for column in options['columns']:
+                if column == 'name':
+                    row.append(student['name'])
+                elif column == 'group':
+                    row.append(group_name)
+                elif column == 'slot':
+                    row.append(group.get('time_slot', ''))
+                elif column == 'attributes':
+                    row.extend(student['attributes'].get(attr, '0') for attr in options['attributes'])
+                elif column == 'availabilities':
+                    row.extend(student['availabilities'].get(slot, '0') for slot in options['time_slots'])
+            yield row
+
+def stream_csv(rows):
+    """csv text in chunks of EXPORT_CHUNK_ROWS rows, so the whole file is never in memory at once"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def stream_xlsx(rows, chunk_size=64 * 1024):
+    """
+    xlsx bytes in chunks; openpyxl's write-only mode keeps only one row in memory while writing,
+    the finished file (a zip, so it can't be sent before it's complete) is spooled to a temporary file
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Groups')
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,146 @@
+import math
+import numpy as np
+
+def fast_path_applies(constraints):
+    """
+    true if the only constraints are group sizes / counts (and availabilities), no attribute or pair constraints,
+    then grouping is just splitting each time slot's students into groups and cp-sat isn't needed
+    """
+    for cons in constraints.get_attribute_constraints().values():
+        if cons.get('min_per_group') or 'max_per_group' in cons:
+            return False
+    for combined in constraints.get_combined_constraints():
+        if combined.get('min') or combined.get('max') is not None:
+            return False
+    if constraints.has_pair_constraints():
+        return False
+    return True
+
+class _SlotCounts:
+    """how many students are in each slot, and whether that many can be split into groups"""
+    def __init__(self, slot_of, num_slots, size_min, size_max):
+        self.counts = np.bincount(slot_of, minlength=num_slots)
+        self.size_min = size_min
+        self.size_max = size_max
+
+    def fillable(self, n):
+        # n students fit in k groups of size_min..size_max for some k
+        return n == 0 or math.ceil(n / self.size_max) <= n // self.size_min
+
+    def nearest_fillable(self, n):
+        """closest fillable counts below and above n"""
+        lower = n - 1
+        while lower > 0 and not self.fillable(lower):
+            lower -= 1
+        upper = n + 1
+        while not self.fillable(upper):
+            upper += 1
+        return max(lower, 0), upper
+
+def _repair_slot(avail, slot_of, slot_counts, t):
+    """
+    make slot t's student count splittable into groups, by moving students out to other slots they can make,
+    or pulling students in from other slots; each move keeps the other slot splittable
+    returns False if neither works
+    """
+    counts = slot_counts.counts
+    lower, upper = slot_counts.nearest_fillable(counts[t])
+
+    # move students out, down to the next splittable count
+    moves = []
+    for s in np.flatnonzero(slot_of == t):
+        if len(moves) == counts[t] - lower:
+            break
+        for u in np.flatnonzero(avail[s]):
+            if u != t and counts[u] > 0 and slot_counts.fillable(counts[u] + 1):
+                moves.append((s, u))
+                counts[u] += 1
+                break
+    if len(moves) == counts[t] - lower:
+        for s, u in moves:
+            slot_of[s] = u
+        counts[t] = lower
+        return True
+    for _, u in moves:
+        counts[u] -= 1
+
+    # or pull students in, up to the next splittable count
+    moves = []
+    for s in np.flatnonzero(avail[:, t]):
+        if len(moves) == upper - counts[t]:
+            break
+        u = slot_of[s]
+        if u != t and slot_counts.fillable(counts[u] - 1):
+            moves.append(s)
+            counts[u] -= 1
+    if len(moves) == upper - counts[t]:
+        for s in moves:
+            slot_of[s] = t
+        counts[t] = upper
+        return True
+    for s in moves:
+        counts[slot_of[s]] += 1
+    return False
+
+def greedy_schedule(students, constraints):
+    """
+    group students with only size / count limits, without a solver:
+    1. every student gets a slot (least flexible students first, preferring the slots most students can make,
+       so students end up together in as few slots as possible)
+    2. slots whose student count can't be split into groups of the allowed sizes are repaired by moving students
+    3. each slot's students are split evenly into groups, with the group count nudged into the allowed range
+    returns {'slots': [...], 'groups': [[student indices], ...]} (one slot index per group), or None if this didn't work out
+    (cp-sat might still find a grouping then)
+    """
+    avail = students.availabilities.astype(bool)
+    num_students, num_slots = avail.shape
+    if num_students == 0:
+        return None
+    size_min = constraints.group_size_min or 1
+    size_max = constraints.group_size_max or num_students
+    count_min = constraints.group_count_min or 1
+    count_max = constraints.group_count_max or num_students
+    if size_min > size_max:
+        return None
+
+    # 1. a slot for every student
+    popularity = avail.sum(axis=0)
+    slot_of = np.empty(num_students, dtype=np.int64)
+    for s in np.argsort(avail.sum(axis=1), kind='stable'):
+        options = np.flatnonzero(avail[s])
+        slot_of[s] = options[np.argmax(popularity[options])]
+
+    # 2. repair slots with a count that can't be split into groups (e.g. 3 students with a minimum size of 4)
+    slot_counts = _SlotCounts(slot_of, num_slots, size_min, size_max)
+    for _ in range(num_students + num_slots):
+        bad = [t for t in range(num_slots) if not slot_counts.fillable(slot_counts.counts[t])]
+        if not bad:
+            break
+        if not _repair_slot(avail, slot_of, slot_counts, bad[0]):
+            return None
+    else:
+        return None
+
+    # 3. how many groups per slot: as few as possible, then more until there are enough
+    counts = slot_counts.counts
+    fewest = [math.ceil(n / size_max) for n in counts]
+    most = [n // size_min for n in counts]
+    num_groups = list(fewest)
+    if sum(num_groups) > count_max:
+        return None
+    for t in np.argsort(-counts, kind='stable'):
+        extra = min(most[t] - num_groups[t], count_min - sum(num_groups))
+        if extra <= 0:
+            continue
+        num_groups[t] += extra
+    if sum(num_groups) < count_min:
+        return None
+
+    # even split: sizes differ by at most one, which stays within the limits since fewest <= k <= most
+    slots, groups = [], []
+    for t in range(num_slots):
+        members = np.flatnonzero(slot_of == t)
+        for chunk in np.array_split(members, num_groups[t]) if num_groups[t] else []:
+            slots.append(t)
+            groups.append(chunk.tolist())
+    return {'slots': slots, 'groups': groups}
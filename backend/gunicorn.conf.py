@@ -0,0 +1,29 @@
+# gunicorn settings for ./run.sh --production, all overridable with environment variables
+import os
+
+# import the solver stack (ortools, numpy) once here, in the master process, before the workers are forked:
+# workers start without re-importing it and share its memory.
+# the app itself (wsgi.py) is still created in each worker, since its job manager, caches and worker pipes
+# mustn't be shared between processes
+import scheduler # noqa: F401
+
+bind = f"{os.environ.get('SMARTGROUPS_HOST', '0.0.0.0')}:{os.environ.get('SMARTGROUPS_PORT', 5013)}"
+
+# jobs (/api/jobs), datasets (/api/datasets) and cached results (/api/cache) live in the worker's memory,
+# so a second worker would answer "not found" for whatever its sibling made: only one worker is allowed.
+# threads share them, and cp-sat releases the gil while it searches, so one worker with several threads
+# already solves in parallel (and solver processes are capped by SMARTGROUPS_MAX_CONCURRENT_SOLVES anyway)
+workers = 1
+threads = int(os.environ.get('SMARTGROUPS_THREADS', 8))
+worker_class = 'gthread'
+
+def on_starting(server):
+    # also catches `gunicorn -w N` on the command line, which overrides the setting above
+    if server.cfg.workers != 1:
+        raise SystemExit(f'SmartGroups runs with one gunicorn worker (got {server.cfg.workers}): jobs, datasets and '
+                         'cached results are kept in its memory. Use SMARTGROUPS_THREADS to serve more requests at once.')
+
+# a request may wait for a solve slot and then solve for the whole time limit
+timeout = int(os.environ.get('SMARTGROUPS_REQUEST_TIMEOUT', 660))
+graceful_timeout = 30
+accesslog = '-'
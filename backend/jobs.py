@@ -0,0 +1,283 @@
+import os
+import time
+import uuid
+import atexit
+import signal
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+# defaults, can be overridden with environment variables
+JOB_WORKERS = int(os.environ.get('SMARTGROUPS_JOB_WORKERS', 2)) # how many solves can run at once
+JOB_RESULT_TTL = float(os.environ.get('SMARTGROUPS_JOB_TTL', 600)) # seconds to keep a finished job around
+JOB_TIMEOUT = float(os.environ.get('SMARTGROUPS_JOB_TIMEOUT', 600)) # a running job is stopped after this many seconds
+
+# job statuses
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed_out'
+FINISHED = (DONE, FAILED, CANCELLED, TIMED_OUT)
+
+# workers start from a fresh interpreter, not a fork: the app has threads (the dispatcher, the server's),
+# and a fork copies their locks in whatever state they're in
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+def _run_job(conn, func, args):
+    """
+    runs in the worker process: call func(*args, progress=...) and send progress + the result back over conn
+    func must return (response dict, http status)
+    """
+    # own process group, so cancelling also stops any processes the solve starts (see decomposition.py)
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+
+    def progress(phase, **info):
+        conn.send(('progress', dict(info, phase=phase)))
+
+    try:
+        body, status = func(*args, progress=progress)
+        conn.send(('result', (body, status)))
+    except Exception as e:
+        traceback.print_exc()
+        conn.send(('result', ({'error': str(e)}, 500)))
+    finally:
+        conn.close()
+
+class Job:
+    def __init__(self, job_id, func, args, on_done=None):
+        self.job_id = job_id
+        self.func = func
+        self.args = args
+        self.on_done = on_done
+        self.status = QUEUED
+        self.progress = {'phase': 'queued'}
+        self.result = None
+        self.result_status = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.conn = None
+
+    def to_dict(self):
+        """what GET /api/jobs/<id> returns"""
+        now = self.finished_at or time.time()
+        info = {
+            'job_id': self.job_id,
+            'status': self.status,
+            'progress': dict(self.progress, elapsed=round(now - (self.started_at or now), 3)),
+            'created_at': self.created_at,
+        }
+        if self.status == DONE:
+            info['result'] = self.result
+        elif self.status == FAILED:
+            info['error'] = (self.result or {}).get('error', 'job failed')
+        elif self.status == TIMED_OUT:
+            info['error'] = 'The solver ran out of time. Try loosening the constraints or submitting again.'
+        return info
+
+class JobManager:
+    def __init__(self, max_workers=JOB_WORKERS, result_ttl=JOB_RESULT_TTL, timeout=JOB_TIMEOUT):
+        """
+        runs solves in at most max_workers worker processes; anything else waits in a queue
+        finished jobs are kept for result_ttl seconds, running jobs are stopped after timeout seconds
+        """
+        self.max_workers = max_workers
+        self.result_ttl = result_ttl
+        self.timeout = timeout
+        self.jobs = {}
+        self.pending = deque()
+        self.stopping = [] # worker processes signalled to stop, joined outside the lock (see _reap)
+        self.lock = threading.Lock()
+        self.context = multiprocessing.get_context(START_METHOD)
+        self.wakeup_recv, self.wakeup_send = multiprocessing.Pipe(duplex=False)
+        self.thread = None
+        # workers aren't daemon processes (a solve may start its own pool), so stop them on exit
+        atexit.register(self.shutdown)
+
+    def submit(self, func, *args, on_done=None):
+        """
+        queue func(*args, progress=...) to run in a worker process, returns the job id
+        on_done: optional callable(result, status), called in this process once the job finishes
+        """
+        job = Job(uuid.uuid4().hex, func, args, on_done)
+        with self.lock:
+            self.jobs[job.job_id] = job
+            self.pending.append(job)
+            self._ensure_thread()
+        self._wakeup()
+        return job.job_id
+
+    def add_finished(self, result, status=200):
+        """record a job whose result is already known (e.g. from the result cache), returns the job id"""
+        job = Job(uuid.uuid4().hex, None, ())
+        job.result, job.result_status = result, status
+        with self.lock:
+            self.jobs[job.job_id] = job
+            self._finish(job, DONE if status == 200 and 'error' not in result else FAILED)
+            self._ensure_thread() # so it gets evicted once the ttl runs out
+        return job.job_id
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def cancel(self, job_id):
+        """
+        stop a queued or running job (the worker process is killed, which stops the search and frees the slot)
+        a finished job is just removed; returns False if the job doesn't exist
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if job.status in FINISHED:
+                del self.jobs[job_id]
+                return True
+            if job.status == QUEUED:
+                self.pending.remove(job)
+            else:
+                self._stop(job)
+            self._finish(job, CANCELLED)
+        self._wakeup() # the dispatcher joins the worker
+        return True
+
+    def shutdown(self):
+        """stop every running job"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.status == RUNNING:
+                    self._stop(job)
+                    self._finish(job, CANCELLED)
+        self._reap()
+
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._loop, name='smartgroups-jobs', daemon=True)
+            self.thread.start()
+
+    def _wakeup(self):
+        self.wakeup_send.send(None)
+
+    def _loop(self):
+        """dispatcher: start queued jobs, read messages from workers, enforce timeouts, evict old results"""
+        while True:
+            with self.lock:
+                self._start_pending()
+                self._check_timeouts()
+                self._evict_expired()
+                readers = [job.conn for job in self.jobs.values() if job.status == RUNNING and job.conn is not None]
+            self._reap()
+
+            try:
+                ready = wait(readers + [self.wakeup_recv], timeout=1.0)
+            except OSError:
+                # a job was cancelled (and its pipe closed) while we were waiting on it
+                continue
+
+            for conn in ready:
+                if conn is self.wakeup_recv:
+                    self.wakeup_recv.recv()
+                    continue
+                with self.lock:
+                    done = self._receive(conn)
+                # on_done is the caller's code, it doesn't get to hold up the other jobs
+                if done is not None:
+                    on_done, result, status = done
+                    try:
+                        on_done(result, status)
+                    except Exception:
+                        traceback.print_exc()
+
+    def _start_pending(self):
+        running = sum(1 for job in self.jobs.values() if job.status == RUNNING)
+        while self.pending and running < self.max_workers:
+            job = self.pending.popleft()
+            recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+            job.process = self.context.Process(target=_run_job, args=(send_conn, job.func, job.args))
+            job.process.start()
+            send_conn.close() # only the worker writes to it
+            job.conn = recv_conn
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.progress = {'phase': 'starting'}
+            running += 1
+
+    def _receive(self, conn):
+        """handle a message from a worker; returns (on_done, result, status) to call once the lock is released, or None"""
+        job = next((j for j in self.jobs.values() if j.conn is conn), None)
+        if job is None or job.status != RUNNING:
+            return
+        try:
+            kind, payload = conn.recv()
+        except (EOFError, OSError):
+            # worker died without sending a result
+            self._stop(job)
+            job.result = {'error': 'The solver process stopped unexpectedly.'}
+            self._finish(job, FAILED)
+            return None
+
+        if kind == 'progress':
+            job.progress = payload
+        elif kind == 'result':
+            job.result, job.result_status = payload
+            self._stop(job)
+            self._finish(job, DONE if job.result_status == 200 and 'error' not in job.result else FAILED)
+            if job.on_done:
+                return job.on_done, job.result, job.result_status
+        return None
+
+    def _check_timeouts(self):
+        now = time.time()
+        for job in self.jobs.values():
+            if job.status == RUNNING and self.timeout and now - job.started_at > self.timeout:
+                self._stop(job)
+                self._finish(job, TIMED_OUT)
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.status in FINISHED and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _stop(self, job):
+        """signal the job's worker to stop (called with the lock held, the worker is joined later by _reap)"""
+        if job.process is not None:
+            if job.process.is_alive():
+                if hasattr(os, 'killpg'):
+                    try:
+                        os.killpg(job.process.pid, signal.SIGTERM)
+                    except OSError:
+                        job.process.terminate() # hasn't made its own group yet
+                else:
+                    job.process.terminate()
+            self.stopping.append(job.process)
+            job.process = None
+        if job.conn is not None:
+            job.conn.close()
+            job.conn = None
+
+    def _reap(self):
+        """join the workers _stop signalled, without the lock: one can take a few seconds to exit"""
+        with self.lock:
+            stopping, self.stopping = self.stopping, []
+        for process in stopping:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        job.progress = dict(job.progress, phase=status)
+        # the inputs aren't needed anymore, don't hold on to them until the ttl runs out
+        job.args = ()
+        job.func = None
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# defaults, can be overridden with environment variables
+# SMARTGROUPS_METRICS_LOG: unset = no logs, 'stderr' = one json line per solve on stderr, anything else = a file to append to
+METRICS_LOG = os.environ.get('SMARTGROUPS_METRICS_LOG') or None
+
+# histogram bucket upper bounds
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+class PhaseTimer:
+    """wall time per named phase, in seconds (a phase entered twice adds up)"""
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(self.phases.get(name, 0) + time.perf_counter() - start, 4)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is everything above the biggest bucket
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        # cumulative counts per upper bound, like prometheus (a list, since json objects lose the order)
+        cumulative, buckets = 0, []
+        for bound, count in zip(list(self.buckets) + ['+inf'], self.counts):
+            cumulative += count
+            buckets.append({'le': bound, 'count': cumulative})
+        return {
+            'count': self.count,
+            'sum': round(self.total, 4),
+            'mean': round(self.total / self.count, 4) if self.count else 0.0,
+            'max': round(self.max, 4),
+            'buckets': buckets,
+        }
+
+def _make_logger(target):
+    logger = logging.getLogger('smartgroups.metrics')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.StreamHandler() if target == 'stderr' else logging.FileHandler(target)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+class SolveMetrics:
+    def __init__(self, log_target=METRICS_LOG):
+        """
+        aggregates the diagnostics of every solve (see pipeline.solve_prepared) for GET /api/metrics:
+        a histogram per phase and of the model sizes, plus counts per engine and solver status
+        log_target: optionally also log every solve's diagnostics as one json line ('stderr' or a file path)
+        """
+        self.lock = threading.Lock()
+        self.logger = _make_logger(log_target) if log_target else None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.solves = 0
+            self.cache_hits = 0
+            self.engines = {}
+            self.statuses = {}
+            self.phases = {}
+            self.model_sizes = {'variables': Histogram(SIZE_BUCKETS), 'constraints': Histogram(SIZE_BUCKETS)}
+
+    def observe(self, diagnostics):
+        if not diagnostics:
+            return
+        with self.lock:
+            self.solves += 1
+            if diagnostics.get('cache_hit'):
+                self.cache_hits += 1
+            engine = diagnostics.get('engine') or 'none'
+            self.engines[engine] = self.engines.get(engine, 0) + 1
+            status = diagnostics.get('solver_status') or 'none'
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            for phase, seconds in diagnostics.get('phases', {}).items():
+                self.phases.setdefault(phase, Histogram(SECONDS_BUCKETS)).observe(seconds)
+            for key, histogram in self.model_sizes.items():
+                if key in diagnostics.get('model', {}):
+                    histogram.observe(diagnostics['model'][key])
+        if self.logger:
+            self.logger.info(json.dumps(dict(diagnostics, event='solve', timestamp=round(time.time(), 3))))
+
+    def snapshot(self):
+        """what GET /api/metrics returns"""
+        with self.lock:
+            return {
+                'solves': self.solves,
+                'cache_hits': self.cache_hits,
+                'engines': dict(self.engines),
+                'solver_statuses': dict(self.statuses),
+                'phase_seconds': {phase: histogram.to_dict() for phase, histogram in self.phases.items()},
+                'model_size': {key: histogram.to_dict() for key, histogram in self.model_sizes.items()},
+            }
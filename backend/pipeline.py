@@ -0,0 +1,231 @@
+import time
+from scheduler import GroupScheduler
+from metrics import PhaseTimer
+from result_cache import make_key
+from snapshots import SnapshotWatch, SNAPSHOT_DIR
+from csv_parser import parse_student_data, parse_all_constraints, parse_given_attributes, parse_solver_params, parse_warm_start, parse_num_solutions, parse_bool
+
+def add_unassigned_group(schedule, unassigned_students):
+    """
+    add the students with no availabilities to the response as their own (unassigned) group
+    """
+    if 'error' in schedule or not unassigned_students:
+        return schedule
+
+    groups_list = list(schedule.get('groups', []))  # type: ignore
+
+    # add unassigned group
+    groups_list.append({  # type: ignore
+        'group_id': len(groups_list) + 1,
+        'time_slot': 'Unassigned - no availabilities',
+        'students': unassigned_students,
+        'size': len(unassigned_students),
+        'is_unassigned': True
+    })
+
+    schedule['groups'] = groups_list  # type: ignore
+
+    # alternative groupings list students by their index in the groups above, the unassigned ones come last
+    total_students = int(schedule.get('total_students', 0))
+    for alternative in schedule.get('alternatives', []):
+        alternative['groups'].append({
+            'group_id': len(alternative['groups']) + 1,
+            'time_slot': 'Unassigned - no availabilities',
+            'students': list(range(total_students, total_students + len(unassigned_students))),
+            'size': len(unassigned_students),
+            'is_unassigned': True
+        })
+        alternative['total_groups'] = len(alternative['groups'])
+
+    # update total students count
+    schedule['total_students'] = total_students + len(unassigned_students)  # type: ignore
+    return schedule
+
+def parse_dataset(data, given_attributes):
+    """
+    parse the csv rows once into what every solve needs
+    returns {'students': StudentMatrix, 'unassigned_students': [...], 'num_rows': int, 'given_attributes': [...]}
+    or an error dict with 'status'
+    """
+    results = parse_student_data(data, given_attributes)
+    if 'error' in results:
+        return results
+
+    return {
+        'students': results['students'], # StudentMatrix of everyone with at least one availability
+        'unassigned_students': results['unassigned_students'],
+        'num_rows': results['num_rows'],
+        'given_attributes': given_attributes,
+    }
+
+def prepare_dataset(dataset, form):
+    """
+    turn a parsed dataset (from parse_dataset) + the constraint form into a ready-to-run scheduler
+    if the form asks for warm_start without sending a previous_result, the dataset's last result is used
+    returns {'scheduler': GroupScheduler, 'unassigned_students': [...], 'phases': {phase: seconds},
+             'diagnostics': whether the response should include the diagnostics} or an error dict with 'status'
+    """
+    solver_params = parse_solver_params(form)
+    if 'error' in solver_params:
+        return solver_params
+
+    warm_start = parse_warm_start(form)
+    if 'error' in warm_start:
+        return warm_start
+    alternatives = parse_num_solutions(form)
+    if 'error' in alternatives:
+        return alternatives
+    previous_result = warm_start['previous_result']
+    if previous_result is None and parse_bool(form, 'warm_start'):
+        previous_result = dataset.get('last_result')
+
+    # decompose: unset means decide by cohort size, otherwise force it on/off
+    decompose = parse_bool(form, 'decompose') if str(form.get('decompose', '')).strip() else None
+    # aggregate: unset means bucket interchangeable students whenever that shrinks the model enough
+    aggregate = parse_bool(form, 'aggregate') if str(form.get('aggregate', '')).strip() else None
+    # balance: even out group sizes and attribute counts within the time limit
+    balance = parse_bool(form, 'balance')
+    # fast_path is on unless turned off
+    fast_path = parse_bool(form, 'fast_path') if str(form.get('fast_path', '')).strip() else True
+    # diagnose: explain which constraints conflict when there's no valid grouping
+    diagnose = parse_bool(form, 'diagnose')
+
+    students = dataset['students']
+    timer = PhaseTimer()
+    with timer.phase('constraints'):
+        constraints = parse_all_constraints(form, dataset['num_rows'], len(students.time_slots), dataset['given_attributes'],
+                                            students, dataset['unassigned_students'])
+    if isinstance(constraints, dict):
+        return constraints
+
+    return {
+        'scheduler': GroupScheduler(students, constraints, solver_params=solver_params,
+                                    warm_start=previous_result, minimize_changes=warm_start['minimize_changes'], decompose=decompose, fast_path=fast_path, diagnose=diagnose,
+                                    num_solutions=alternatives['num_solutions'], min_difference=alternatives['min_difference'],
+                                    aggregate=aggregate, balance=balance, capture=SNAPSHOT_DIR is not None),
+        'unassigned_students': dataset['unassigned_students'],
+        'phases': timer.phases,
+        'diagnostics': parse_bool(form, 'diagnostics'),
+    }
+
+def prepare_rows(data, form):
+    """
+    parse the csv rows and the constraint form into a ready-to-run scheduler
+    returns the same as prepare_dataset, with the parse time in 'phases' too
+    """
+    timer = PhaseTimer()
+    # data is read lazily from the upload, so this includes decoding it
+    with timer.phase('parse'):
+        dataset = parse_dataset(data, parse_given_attributes(form))
+    if 'error' in dataset:
+        return dataset
+    prepared = prepare_dataset(dataset, form)
+    if 'error' not in prepared:
+        prepared['phases'] = dict(timer.phases, **prepared['phases'])
+    return prepared
+
+def solve_rows(data, form, progress=None, on_solution=None, cache=None, metrics=None):
+    """
+    the whole upload flow without flask: parse the csv rows, parse the constraint form, run the scheduler
+    data: list of csv rows (first row is the headers)
+    form: dict of the submitted form fields
+    progress, on_solution, cache, metrics: see solve_prepared
+    returns (response dict, http status)
+    """
+    if progress:
+        progress('parsing')
+    prepared = prepare_rows(data, form)
+    if 'error' in prepared:
+        return {'error': prepared['error']}, prepared['status']
+    return solve_prepared(prepared, progress=progress, on_solution=on_solution, cache=cache, metrics=metrics)
+
+def solve_diagnostics(prepared, schedule, start, cache_hit=False):
+    """
+    the diagnostics block for one solve: seconds per phase (parse, constraints, build, solve, format, ... and total),
+    model size, cp-sat stats and which engine ran
+    """
+    scheduler = prepared['scheduler']
+    diagnostics = {} if cache_hit else dict(scheduler.diagnostics)
+    phases = dict(prepared.get('phases', {}))
+    phases.update(diagnostics.get('phases', {}))
+    phases['total'] = round(sum(prepared.get('phases', {}).values()) + time.perf_counter() - start, 4)
+    diagnostics.update({
+        'phases': phases,
+        'cache_hit': cache_hit,
+        'solver_status': schedule.get('solver_status'),
+        'students': scheduler.num_students,
+        'time_slots': scheduler.num_time_slots,
+    })
+    if cache_hit:
+        diagnostics['engine'] = 'cache'
+    return diagnostics
+
+def _finish(prepared, schedule, start, metrics, cache_hit=False):
+    """record the diagnostics in metrics and add them to the response if the form asked for them"""
+    if metrics is not None or prepared.get('diagnostics'):
+        diagnostics = solve_diagnostics(prepared, schedule, start, cache_hit)
+        if metrics is not None:
+            metrics.observe(diagnostics)
+        if prepared.get('diagnostics'):
+            schedule['diagnostics'] = diagnostics
+    return schedule, 200
+
+def cached_result(prepared, cache, metrics=None):
+    """
+    the response for an identical earlier request from the cache (see solve_prepared), or None
+    returns (cache key, (response dict, http status) or None)
+    """
+    start = time.perf_counter()
+    cache_key = make_key(prepared['scheduler'], prepared['unassigned_students'])
+    cached = cache.get(cache_key)
+    if cached is None:
+        return cache_key, None
+    cached['cache_key'] = cache_key
+    return cache_key, _finish(prepared, cached, start, metrics, cache_hit=True)
+
+def solve_prepared(prepared, progress=None, on_solution=None, cache=None, metrics=None):
+    """
+    run the scheduler from prepare_rows and add the unassigned students to the result
+    progress: optional callable(phase, **info) told which step we're on (and how many groupings were found so far)
+    on_solution: optional callable, given each improving grouping (same format as the final result) as it's found
+    cache: optional ResultCache; an identical earlier request is answered from it without solving,
+           and a cached result has its 'cache_key' (GET /api/cache/<key>/export downloads it)
+    metrics: optional SolveMetrics the diagnostics (see solve_diagnostics) are recorded in;
+             they're also added to the response as 'diagnostics' if the form asked for them
+    returns (response dict, http status)
+    """
+    start = time.perf_counter()
+    scheduler = prepared['scheduler']
+    unassigned_students = prepared['unassigned_students']
+
+    if cache is not None:
+        cache_key, cached = cached_result(prepared, cache, metrics)
+        if cached is not None:
+            return cached
+
+    if progress:
+        progress('solving')
+    solutions_found = 0
+
+    def handle_solution(result):
+        nonlocal solutions_found
+        solutions_found += 1
+        if progress:
+            progress('solving', solutions_found=solutions_found)
+        if on_solution:
+            on_solution(add_unassigned_group(result, unassigned_students))
+
+    # with SMARTGROUPS_SNAPSHOT_DIR set, slow solves are saved so they can be replayed offline (benchmarks/replay.py)
+    watch = SnapshotWatch(scheduler, unassigned_students) if SNAPSHOT_DIR else None
+    schedule = scheduler.schedule(on_solution=handle_solution if (progress or on_solution) else None)
+    if watch is not None:
+        snapshot_id = watch.finish()
+        if snapshot_id:
+            scheduler.diagnostics['snapshot'] = snapshot_id
+
+    # add unassigned students to the response if any exist
+    schedule = add_unassigned_group(schedule, unassigned_students)
+    # a stopped solve (e.g. the stream's client went away) is only as good as it got so far, don't serve it again
+    if cache is not None and not scheduler.stopped and cache.put(cache_key, schedule):
+        schedule['cache_key'] = cache_key
+    return _finish(prepared, schedule, start, metrics)
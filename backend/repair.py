@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import numpy as np
+from scheduler import GroupScheduler, _matched_overlap
+from constraint_parser import SchedulingConstraints
+from student_matrix import StudentMatrix, normalize_cell
+from csv_parser import parse_student_data, parse_given_attributes, parse_all_constraints, parse_solver_params
+from pipeline import add_unassigned_group
+from validate import check_grouping
+
+# defaults, can be overridden with environment variables
+REPAIR_TIME_LIMIT = float(os.environ.get('SMARTGROUPS_REPAIR_TIME_LIMIT', 10)) # solver seconds per neighborhood, unless the form sets time_limit
+REPAIR_CANDIDATE_GROUPS = int(os.environ.get('SMARTGROUPS_REPAIR_CANDIDATE_GROUPS', 3)) # groups opened up for each student without one
+
+def previous_roster(previous_result):
+    """
+    the students and groups of an earlier result (the full format, as /api/upload returns it)
+    returns {'records': [student record, ...], 'groups': [{'time_slot', 'members': [record index, ...]}, ...],
+             'time_slots': [...], 'attributes': [...]} or an error dict
+    students in the unassigned group are in records but in no group
+    """
+    if not isinstance(previous_result, dict) or not isinstance(previous_result.get('groups'), list):
+        return {'error': 'previous_result must contain a list of groups.', 'status': 400}
+    if previous_result.get('format') == 'compact':
+        return {'error': 'previous_result must be a result in the full format (not format=compact).', 'status': 400}
+
+    records, groups = [], []
+    for group in previous_result['groups']:
+        members = []
+        for student in group.get('students', []):
+            if not isinstance(student, dict) or 'name' not in student:
+                return {'error': 'previous_result must list every student with their name, attributes and availabilities.', 'status': 400}
+            members.append(len(records))
+            records.append(student)
+        if not group.get('is_unassigned'):
+            groups.append({'time_slot': group.get('time_slot'), 'members': members})
+    if not records:
+        return {'error': 'previous_result has no students.', 'status': 400}
+
+    return {
+        'records': records,
+        'groups': groups,
+        'time_slots': list(records[0].get('availabilities', {})),
+        'attributes': list(records[0].get('attributes', {})),
+    }
+
+def parse_roster_changes(form, roster, data=None):
+    """
+    the roster diff, either as a changes form field (json):
+        {"added": [{"name", "attributes": {...}, "availabilities": {...}}, ...],
+         "removed": [name, ...],
+         "changed": [{"name", "attributes": {...}, "availabilities": {...}}, ...]}  (only the values that changed)
+    or worked out from the rows of an updated csv (data, read with the form's given_attributes), matching students by name
+    roster: from previous_roster
+    returns {'added', 'removed', 'changed'} or an error dict
+    """
+    if form.get('changes'):
+        try:
+            changes = json.loads(form['changes'])
+        except ValueError:
+            return {'error': 'changes must be json with added, removed and changed students.', 'status': 400}
+        if not isinstance(changes, dict):
+            return {'error': 'changes must be json with added, removed and changed students.', 'status': 400}
+        changes = {key: changes.get(key) or [] for key in ('added', 'removed', 'changed')}
+        if not all(isinstance(value, list) for value in changes.values()):
+            return {'error': 'added, removed and changed must be lists.', 'status': 400}
+        for key in ('added', 'changed'):
+            if not all(isinstance(student, dict) and 'name' in student for student in changes[key]):
+                return {'error': f'every {key} student needs a name.', 'status': 400}
+        return changes
+
+    if data is None:
+        return {'error': 'Send the roster changes (changes) or the updated csv file.', 'status': 400}
+    parsed = parse_student_data(data, parse_given_attributes(form))
+    if 'error' in parsed:
+        return parsed
+    students = parsed['students']
+    updated = [students.student_record(s) for s in range(len(students))] + parsed['unassigned_students']
+    return roster_diff(roster['records'], updated)
+
+def roster_diff(old_records, new_records):
+    """added / removed / changed students between two lists of student records, matched by name"""
+    old_by_name = {record['name']: record for record in old_records}
+    new_by_name = {record['name']: record for record in new_records}
+    return {
+        'added': [record for name, record in new_by_name.items() if name not in old_by_name],
+        'removed': [name for name in old_by_name if name not in new_by_name],
+        'changed': [record for name, record in new_by_name.items()
+                    if name in old_by_name and (record.get('attributes') != old_by_name[name].get('attributes')
+                                                or record.get('availabilities') != old_by_name[name].get('availabilities'))],
+    }
+
+def apply_changes(roster, changes):
+    """
+    the roster after the changes: {'records': [...], 'previous_index': [index in roster['records'] or -1 if added]}
+    or an error dict (removing / changing a student who isn't there, adding one who is, unknown time slots)
+    """
+    index_by_name = {record['name']: i for i, record in enumerate(roster['records'])}
+    slots = set(roster['time_slots'])
+
+    for name in changes['removed']:
+        if name not in index_by_name:
+            return {'error': f'removed: no student named {name} in previous_result.', 'status': 400}
+    for student in changes['changed']:
+        if student['name'] not in index_by_name:
+            return {'error': f'changed: no student named {student["name"]} in previous_result.', 'status': 400}
+    for student in changes['added']:
+        if student['name'] in index_by_name and student['name'] not in changes['removed']:
+            return {'error': f'added: {student["name"]} is already in previous_result.', 'status': 400}
+    for student in changes['added'] + changes['changed']:
+        unknown = [slot for slot in student.get('availabilities', {}) if slot not in slots]
+        if unknown:
+            return {'error': f'{student["name"]}: unknown time slot(s) {", ".join(unknown)}.', 'status': 400}
+
+    def normalized(record, base=None):
+        base = base or {'attributes': {}, 'availabilities': {}}
+        attributes = dict(base['attributes'], **record.get('attributes', {}))
+        availabilities = dict(base['availabilities'], **record.get('availabilities', {}))
+        return {
+            'name': record['name'],
+            'attributes': {attr: normalize_cell(attributes.get(attr)) for attr in roster['attributes']},
+            'availabilities': {slot: normalize_cell(availabilities.get(slot)) for slot in roster['time_slots']},
+        }
+
+    removed = set(changes['removed'])
+    changed = {student['name']: student for student in changes['changed']}
+    records, previous_index = [], []
+    for i, record in enumerate(roster['records']):
+        if record['name'] in removed:
+            continue
+        records.append(normalized(changed[record['name']], record) if record['name'] in changed else normalized(record))
+        previous_index.append(i)
+    for student in changes['added']:
+        records.append(normalized(student))
+        previous_index.append(-1)
+    return {'records': records, 'previous_index': previous_index}
+
+def _group_is_valid(students, members, slot, constraints, avoid):
+    """whether a group (student indices + slot index) meets every constraint on its own"""
+    size_min, size_max = constraints.get_group_size_constraints()
+    if len(members) < (size_min or 1) or (size_max and len(members) > size_max):
+        return False
+    if slot < 0 or not students.availabilities[members, slot].all():
+        return False
+    for attr, cons in constraints.get_attribute_constraints().items():
+        count = int(students.attribute_column(attr)[members].sum())
+        if count < cons.get('min_per_group', 0) or ('max_per_group' in cons and count > cons['max_per_group']):
+            return False
+    for combined in constraints.get_combined_constraints():
+        count = int(students.any_attribute_column(combined.get('attributes', []))[members].sum())
+        if (combined.get('min') is not None and count < combined['min']) or (combined.get('max') is not None and count > combined['max']):
+            return False
+    names = {students.names[s].strip().lower() for s in members}
+    return not any(a.strip().lower() in names and b.strip().lower() in names for a, b in avoid)
+
+def students_moved(old_group, new_group):
+    """
+    how many students (in a group before and after) ended up with different groupmates; groups are matched by overlap
+    first (see scheduler._matched_overlap), like GroupScheduler._count_moved, so a group that just got a new number doesn't count as moving
+    """
+    both = (old_group >= 0) & (new_group >= 0)
+    return int(both.sum()) - _matched_overlap(old_group[both], new_group[both])
+
+def repair_schedule(previous_result, form, data=None):
+    """
+    update an existing grouping after roster changes without re-solving everyone (large neighborhood search):
+    1. groups that still meet every constraint after the changes are kept as they are
+    2. the neighborhood is the groups that don't (broken groups), plus up to REPAIR_CANDIDATE_GROUPS kept groups
+       (with room, at a slot they can make) for each broken group and each student without a group
+       (added, or with no availability before), plus the groups of the keep-together partners of everyone in it
+    3. only the neighborhood is solved again, warm started from the previous grouping and keeping as many of its
+       students in place as possible; if it has no valid grouping on its own, the neighborhood grows to every group meeting
+       at a slot the free students can make, and then to everything
+    form: the same constraint form as /api/upload (plus time_limit etc.), and the changes (see parse_roster_changes)
+    data: optional rows of the updated csv, instead of the changes field
+    returns (response dict, http status); the response is a normal result plus 'students_moved' and 'repair'
+    """
+    start = time.perf_counter()
+    roster = previous_roster(previous_result)
+    if 'error' in roster:
+        return {'error': roster['error']}, roster['status']
+    changes = parse_roster_changes(form, roster, data)
+    if 'error' in changes:
+        return {'error': changes['error']}, changes['status']
+    updated = apply_changes(roster, changes)
+    if 'error' in updated:
+        return {'error': updated['error']}, updated['status']
+
+    solver_params = parse_solver_params(form)
+    if 'error' in solver_params:
+        return {'error': solver_params['error']}, solver_params['status']
+    solver_params.setdefault('time_limit', REPAIR_TIME_LIMIT)
+
+    # everyone with at least one availability gets a group, the rest stay unassigned
+    records = updated['records']
+    available = [i for i, record in enumerate(records) if '1' in record['availabilities'].values()]
+    unassigned_students = [record for record in records if '1' not in record['availabilities'].values()]
+    if not available:
+        return {'error': 'No students have any available times. Please ensure at least one student has available time slots.'}, 400
+    students = StudentMatrix.from_records({
+        'names': [records[i]['name'] for i in available],
+        'attributes': [records[i]['attributes'] for i in available],
+        'availabilities': [records[i]['availabilities'] for i in available],
+    })
+    constraints = parse_all_constraints(form, len(records), len(students.time_slots), roster['attributes'],
+                                        students, unassigned_students)
+    if isinstance(constraints, dict):
+        return {'error': constraints['error']}, constraints['status']
+    avoid_pairs, keep_together = constraints.get_pair_constraints()
+
+    # the previous group of every student (-1: added, or unassigned before)
+    group_of_record = np.full(len(roster['records']), -1, dtype=np.int64)
+    for g, group in enumerate(roster['groups']):
+        group_of_record[group['members']] = g
+    previous_group = np.array([group_of_record[updated['previous_index'][i]] if updated['previous_index'][i] >= 0 else -1
+                               for i in available], dtype=np.int64)
+    groups = [{'slot': students.slot_index.get(group['time_slot'], -1), 'members': np.flatnonzero(previous_group == g)}
+              for g, group in enumerate(roster['groups'])]
+
+    # 1. + 2. the first neighborhood
+    affected = {g for g, group in enumerate(groups)
+                if len(group['members']) and not _group_is_valid(students, group['members'], group['slot'], constraints, avoid_pairs)}
+    homeless = np.flatnonzero(previous_group < 0)
+    size_max = constraints.group_size_max
+    def open_up(who, exclude):
+        # the smallest kept groups at a slot all of who can make (that still have room)
+        candidates = [g for g, group in enumerate(groups) if g not in exclude and len(group['members'])
+                      and group['slot'] >= 0 and students.availabilities[who, group['slot']].all()
+                      and (not size_max or len(group['members']) < size_max)]
+        candidates.sort(key=lambda g: len(groups[g]['members']))
+        return candidates[:REPAIR_CANDIDATE_GROUPS]
+    invalid = set(affected)
+    for g in invalid:
+        # somewhere for the students of a broken group to go (e.g. one that got too small)
+        affected.update(open_up(groups[g]['members'], affected))
+    for s in homeless:
+        affected.update(open_up([s], affected))
+    name_group = {students.names[s].strip().lower(): int(previous_group[s]) for s in range(len(students))}
+    grew = True
+    while grew:
+        free_names = {students.names[s].strip().lower() for s in homeless}
+        free_names.update(students.names[s].strip().lower() for g in affected for s in groups[g]['members'])
+        partners = {name_group.get(name.strip().lower(), -1) for names in keep_together
+                    if any(name.strip().lower() in free_names for name in names) for name in names}
+        partners.discard(-1)
+        grew = not partners <= affected
+        affected |= partners
+
+    # 3. solve the neighborhood, growing it until it has a valid grouping
+    rounds, result, members = 0, None, homeless
+    while True:
+        rounds += 1
+        members = np.concatenate([homeless] + [groups[g]['members'] for g in sorted(affected)]).astype(np.int64)
+        neighborhood = sorted(affected)
+        if not len(members):
+            result = {'groups': []}
+            break
+        fixed_groups = sum(1 for g, group in enumerate(groups) if g not in affected and len(group['members']))
+        count_min, count_max = constraints.get_group_count_constraints()
+        sub_constraints = SchedulingConstraints(constraints.attribute_constraints, constraints.group_size_min, constraints.group_size_max,
+                                                max(1, (count_min or 1) - fixed_groups),
+                                                count_max - fixed_groups if count_max else None,
+                                                constraints.combined_constraints, avoid_pairs, keep_together)
+        warm_start = {'groups': [{'group_id': i + 1, 'time_slot': students.time_slots[groups[g]['slot']] if groups[g]['slot'] >= 0 else None,
+                                  'students': [students.names[s] for s in groups[g]['members']]}
+                                 for i, g in enumerate(neighborhood)]}
+        if not count_max or count_max - fixed_groups >= 1:
+            scheduler = GroupScheduler(students.subset(members), sub_constraints, solver_params=solver_params,
+                                       warm_start=warm_start, minimize_changes=True)
+            result = scheduler.schedule()
+            if 'error' not in result:
+                break
+        if len(affected) == len(groups):
+            break # the whole grouping was re-solved, there's no valid grouping at all
+        # grow: every group meeting at a slot one of the free students can make, then everything
+        free_slots = students.availabilities[members].any(axis=0)
+        wider = {g for g, group in enumerate(groups) if group['slot'] >= 0 and free_slots[group['slot']]} | affected
+        affected = wider if wider != affected and rounds == 1 else set(range(len(groups)))
+
+    if result is None:
+        return {'error': f'There can be at most {constraints.group_count_max} groups, and the kept groups already use them all.'}, 200
+    if 'error' in result:
+        return result, 200
+
+    # merge: kept groups stay where they were, re-optimized ones take the neighborhood's places, extra ones go last
+    by_name = {}
+    for s in members:
+        by_name.setdefault(students.names[s], []).append(int(s))
+    new_group = np.full(len(students), -1, dtype=np.int64)
+    merged = []
+    def add(time_slot, records, indices):
+        new_group[indices] = len(merged)
+        merged.append({'time_slot': time_slot, 'students': records})
+
+    # every re-optimized group takes the place of the neighborhood group it shares the most students with (biggest
+    # overlaps first), so groups keep their numbers; a neighborhood group nothing matched was dissolved, and only
+    # then do the groups after it move up one
+    sub_groups = [(sub_group, [by_name[student['name']].pop(0) for student in sub_group['students']]) for sub_group in result['groups']]
+    overlaps = sorted(((int((previous_group[indices] == g).sum()), i, g) for i, (_, indices) in enumerate(sub_groups) for g in sorted(affected)),
+                      key=lambda overlap: -overlap[0])
+    place = {}
+    for count, i, g in overlaps:
+        if count and i not in place and g not in place.values():
+            place[i] = g
+    at = {g: i for i, g in place.items()}
+    for g, group in enumerate(groups):
+        if g in at:
+            add(sub_groups[at[g]][0]['time_slot'], sub_groups[at[g]][0]['students'], sub_groups[at[g]][1])
+        elif g not in affected and len(group['members']):
+            add(students.time_slots[group['slot']], [students.student_record(s) for s in group['members']], group['members'])
+    for i, (sub_group, indices) in enumerate(sub_groups):
+        if i not in place:
+            add(sub_group['time_slot'], sub_group['students'], indices)
+
+    response = {
+        'groups': [{'group_id': i + 1, 'time_slot': group['time_slot'], 'students': group['students'], 'size': len(group['students'])}
+                   for i, group in enumerate(merged)],
+        'constraints_applied': constraints.get_attribute_constraints(),
+        'total_students': len(students),
+        'total_groups': len(merged),
+        'group_size_range': constraints.get_group_size_constraints(),
+        'group_count_range': constraints.get_group_count_constraints(),
+        'solver_status': result.get('solver_status', 'FEASIBLE'),
+        'engine': 'repair',
+        'students_moved': students_moved(previous_group, new_group),
+        'validation': check_grouping(students, constraints, new_group, [students.slot_index.get(group['time_slot'], -1) for group in merged]),
+        'repair': {
+            'added': len(changes['added']),
+            'removed': len(changes['removed']),
+            'changed': len(changes['changed']),
+            'groups_kept': sum(1 for g, group in enumerate(groups) if g not in affected and len(group['members'])),
+            'groups_reoptimized': len(affected),
+            'students_reoptimized': int(len(members)),
+            'rounds': rounds,
+            'seconds': round(time.perf_counter() - start, 4),
+        },
+    }
+    return add_unassigned_group(response, unassigned_students), 200
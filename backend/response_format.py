@@ -0,0 +1,87 @@
+import os
+import json
+import gzip
+import base64
+import numpy as np
+from flask import Response
+
+# orjson is optional: a lot faster at dumping big results, the standard json module is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# defaults, can be overridden with environment variables
+GZIP_MIN_BYTES = int(os.environ.get('SMARTGROUPS_GZIP_MIN_BYTES', 1024)) # smaller responses aren't worth compressing
+GZIP_LEVEL = int(os.environ.get('SMARTGROUPS_GZIP_LEVEL', 5))
+
+def _pack_bits(rows):
+    """0/1 rows (students x columns) bit-packed along each row, as one base64 string"""
+    return base64.b64encode(np.packbits(np.asarray(rows, dtype=np.uint8).reshape(len(rows), -1), axis=1).tobytes()).decode('ascii')
+
+def compact_result(result):
+    """
+    the compact version of a result (opt-in with format=compact): the same keys, except that
+    - every student is stored once, in a 'students' table, and groups list student indices into it
+    - the column names are stored once, in 'columns'
+    - availabilities are bit-packed (8 per byte, most significant bit first) and base64 encoded,
+      one row of ceil(time slots / 8) bytes per student
+    - binary attribute columns are bit-packed the same way, one bit per student; other columns (e.g. emails) are kept as text
+    alternative groupings (num_solutions) already list student indices, which point into the same students table
+    a result with an error (no groups) is returned as it is
+    """
+    if 'groups' not in result:
+        return result
+
+    records = [student for group in result['groups'] for student in group['students']]
+    first = records[0] if records else {'attributes': {}, 'availabilities': {}}
+    attribute_names = list(first['attributes'])
+    time_slots = list(first['availabilities'])
+
+    # availabilities are always 0/1, attribute columns only if every value is (otherwise e.g. emails, kept as text)
+    attributes = []
+    for attr in attribute_names:
+        values = [record['attributes'].get(attr, '0') for record in records]
+        if all(value in ('0', '1') for value in values):
+            attributes.append({'packed': _pack_bits([[value == '1' for value in values]])})
+        else:
+            attributes.append({'values': values})
+
+    groups, index = [], 0
+    for group in result['groups']:
+        indices = list(range(index, index + len(group['students'])))
+        index += len(group['students'])
+        groups.append({key: indices if key == 'students' else value for key, value in group.items()})
+
+    compact = dict(result)
+    compact.update({
+        'format': 'compact',
+        'columns': {'attributes': attribute_names, 'time_slots': time_slots},
+        'students': {
+            'count': len(records),
+            'names': [record['name'] for record in records],
+            'attributes': attributes,
+            'availabilities': _pack_bits([[record['availabilities'].get(slot) == '1' for slot in time_slots]
+                                          for record in records]) if time_slots else '',
+        },
+        'groups': groups,
+    })
+    return compact
+
+def dumps(body):
+    """json bytes, with orjson if it's installed"""
+    if orjson is not None:
+        return orjson.dumps(body)
+    return json.dumps(body, separators=(',', ':')).encode('utf8')
+
+def json_response(body, status=200, accept_encoding=''):
+    """
+    flask response for a (possibly big) json body: dumped with dumps,
+    and gzipped if the client accepts it and it's big enough to be worth it
+    """
+    data = dumps(body)
+    headers = {'Vary': 'Accept-Encoding'}
+    if len(data) >= GZIP_MIN_BYTES and 'gzip' in (accept_encoding or '').lower():
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(data, status=status, mimetype='application/json', headers=headers)
@@ -0,0 +1,149 @@
+import os
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# defaults, can be overridden with environment variables
+CACHE_SIZE = int(os.environ.get('SMARTGROUPS_CACHE_SIZE', 128)) # how many results to keep
+CACHE_DIR = os.environ.get('SMARTGROUPS_CACHE_DIR') or None # if set, results are also saved here and survive restarts
+
+# solver statuses whose results are worth keeping; a time-out (UNKNOWN) might go differently next time
+CACHEABLE_STATUSES = ('OPTIMAL', 'FEASIBLE', 'INFEASIBLE', 'MODEL_INVALID')
+
+def make_key(scheduler, unassigned_students=()):
+    """
+    cache key for a GroupScheduler: hash of the normalized student matrix + normalized constraints + solver settings
+    (plus the students with no availabilities, since they're part of the response too)
+    """
+    settings = {
+        'constraints': scheduler.constraints.to_dict(),
+        'solver_params': dict(sorted(scheduler.solver_params.items())),
+        'symmetry_breaking': scheduler.symmetry_breaking,
+        'warm_start': scheduler.warm_start,
+        'minimize_changes': scheduler.minimize_changes,
+        'decompose': scheduler.decompose,
+        'fast_path': scheduler.fast_path,
+        'diagnose': scheduler.diagnose_infeasible,
+        'num_solutions': scheduler.num_solutions,
+        'min_difference': scheduler.min_difference,
+        'aggregate': scheduler.aggregate,
+        'balance': scheduler.balance,
+        'unassigned_students': list(unassigned_students),
+    }
+    digest = hashlib.sha256()
+    digest.update(scheduler.students.fingerprint().encode('utf8'))
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf8'))
+    return digest.hexdigest()
+
+def is_cacheable(result):
+    return result.get('solver_status') in CACHEABLE_STATUSES
+
+class ResultCache:
+    def __init__(self, max_entries=CACHE_SIZE, persist_dir=CACHE_DIR):
+        """
+        lru cache of scheduler results (including "no valid solution" ones)
+        max_entries: the least recently used result is dropped past this many
+        persist_dir: optional directory to also keep results in, one json file per key
+        """
+        self.max_entries = max_entries
+        self.persist_dir = persist_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if self.persist_dir:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            self._load()
+
+    def get(self, key):
+        """a copy of the cached result, or None"""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            if self.persist_dir:
+                self._touch(key)
+            return copy.deepcopy(self.entries[key])
+
+    def peek(self, key):
+        """a copy of the cached result, or None, without counting it as a hit / miss (e.g. for exports)"""
+        with self.lock:
+            result = self.entries.get(key)
+            return copy.deepcopy(result) if result is not None else None
+
+    def put(self, key, result):
+        """returns whether the result was kept (see CACHEABLE_STATUSES)"""
+        if not is_cacheable(result):
+            return False
+        # timings belong to the request that solved it, not to later cache hits
+        result = {key: value for key, value in result.items() if key != 'diagnostics'}
+        with self.lock:
+            self.entries[key] = copy.deepcopy(result)
+            self.entries.move_to_end(key)
+            if self.persist_dir:
+                self._write(key, result)
+            while len(self.entries) > self.max_entries:
+                old_key, _ = self.entries.popitem(last=False)
+                if self.persist_dir:
+                    self._remove(old_key)
+        return True
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                if self.persist_dir:
+                    self._remove(key)
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'persistent': bool(self.persist_dir),
+            }
+
+    def _path(self, key):
+        return os.path.join(self.persist_dir, f'{key}.json')
+
+    def _write(self, key, result):
+        # write to a temp file first so a crash never leaves half a result behind
+        tmp_path = self._path(key) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, self._path(key))
+
+    def _touch(self, key):
+        # the file's mtime is the lru order after a restart
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _load(self):
+        """read back saved results, oldest first so the lru order survives the restart"""
+        files = [name for name in os.listdir(self.persist_dir) if name.endswith('.json')]
+        files.sort(key=lambda name: os.path.getmtime(os.path.join(self.persist_dir, name)))
+        for name in files:
+            try:
+                with open(os.path.join(self.persist_dir, name)) as f:
+                    self.entries[name[:-len('.json')]] = json.load(f)
+            except (OSError, ValueError):
+                continue # unreadable file, just skip it
+        while len(self.entries) > self.max_entries:
+            old_key, _ = self.entries.popitem(last=False)
+            self._remove(old_key)
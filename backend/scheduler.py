@@ -1,211 +1,1086 @@
 from typing import List, Dict, Set, Tuple, Optional, Any
+import os
+import time
+from collections import deque
+import numpy as np
 from constraint_parser import SchedulingConstraints
+from student_matrix import StudentMatrix
+from decomposition import decomposed_schedule, DECOMPOSE_MIN_STUDENTS
+from fast_path import fast_path_applies, greedy_schedule
+from balance import balance_schedule, BALANCE_TIME_LIMIT
+from validate import check_result, result_assignment
+from metrics import PhaseTimer
 from ortools.sat.python import cp_model
 
+# default time budget for explaining an infeasible input (see GroupScheduler.diagnose)
+DIAGNOSE_TIME_LIMIT = float(os.environ.get('SMARTGROUPS_DIAGNOSE_TIME_LIMIT', 15))
+DIAGNOSE_MAX_STUDENTS = int(os.environ.get('SMARTGROUPS_DIAGNOSE_MAX_STUDENTS', 400)) # no diagnosis above this many students, the model gets too big
+# with aggregate=None, students are bucketed by signature when there are at most this many buckets per student
+AGGREGATE_MAX_RATIO = float(os.environ.get('SMARTGROUPS_AGGREGATE_MAX_RATIO', 0.5))
+
 class GroupScheduler:
-    def __init__(self, student_data, constraints):
+    def __init__(self, student_data, constraints, symmetry_breaking=True, solver_params=None,
+                 warm_start=None, minimize_changes=False, decompose=None, fast_path=True, diagnose=False,
+                 num_solutions=1, min_difference=None, aggregate=None, balance=False, capture=False):
         """
         initialize the scheduler with student data and constraints
-        student_data: dict with 'names', 'attributes', 'availabilities' 
+        student_data: StudentMatrix (or the older dict with 'names', 'attributes', 'availabilities')
         constraints: SchedulingConstraints object
+        symmetry_breaking: if True, rule out most relabellings of the same grouping (on by default)
+        solver_params: optional dict with time_limit, num_workers, random_seed, relative_gap,
+                       and sat_parameters ({cp-sat parameter name: value}, e.g. when replaying a snapshot)
+        warm_start: optional previous result (same format schedule() returns), used as a hint for the solver
+        minimize_changes: with warm_start, keep as many students as possible in their previous group
+        decompose: solve independent blocks of students in parallel and merge them (see decomposition.py);
+                   None means only for cohorts of at least DECOMPOSE_MIN_STUDENTS
+        fast_path: if True, group without cp-sat when only group sizes / counts are constrained (see fast_path.py)
+        diagnose: if True (or a time budget in seconds), an infeasible result also explains which constraints conflict
+        num_solutions: how many different groupings to return (the first one as usual, the rest in result['alternatives'])
+        min_difference: how many students must have different groupmates between any two of those groupings;
+                        None means 10% of the students (at least 1)
+        aggregate: model students with the same signature (usable time slots + constrained attributes) as one bucket,
+                   with a count per bucket and group instead of a bool per student and group (see _buckets);
+                   None means whenever that shrinks the model enough (AGGREGATE_MAX_RATIO)
+        balance: after finding a grouping, even out the group sizes and the counts of every constrained attribute
+                 across groups (see balance.py); the time limit (or BALANCE_TIME_LIMIT) is then for schedule() as a whole
+        capture: keep the serialized cp-sat model of the last solve in self.captured_model (see snapshots.py)
         """
-        self.student_data = student_data
+        if isinstance(student_data, dict):
+            student_data = StudentMatrix.from_records(student_data)
+        self.students = student_data
         self.constraints = constraints
-        self.num_students = len(student_data['names'])
-        self.time_slots = self._extract_time_slots()
-        self.num_time_slots = len(self.time_slots)
+        self.symmetry_breaking = symmetry_breaking
+        self.solver_params = solver_params or {}
+        self.warm_start = warm_start
+        self.minimize_changes = minimize_changes and warm_start is not None
+        self.decompose = decompose
+        self.fast_path = fast_path
+        self.diagnose_infeasible = diagnose
+        self.num_solutions = num_solutions
+        self.min_difference = min_difference
+        self.aggregate = aggregate
+        self.balance = balance
+        self.capture = capture
+        self.captured_model = None
+        self.solver = None
+        self.stop_event = None # set while decomposed blocks are solving (see decomposition.py)
+        self._indices = None # see _var_indices
+        self.stopped = False
+        self.timer = PhaseTimer()
+        self.diagnostics = {} # phase timings, model size and solver stats of the last schedule() (see _solve_cp_sat)
+        self.num_students = len(self.students)
+        self.time_slots = self.students.time_slots
         self.num_time_slots = len(self.time_slots)
         
-    def _extract_time_slots(self):
-        return list(self.student_data['availabilities'][0].keys())
-    
     def _get_student_availability(self, student_idx, time_slot):
         """
         check if student student_idx is available at time_slot
         """
-        if student_idx >= len(self.student_data['availabilities']):
+        if student_idx >= self.num_students or time_slot not in self.students.slot_index:
             return False
-        
-        avail_data = self.student_data['availabilities'][student_idx]
-        return str(avail_data.get(time_slot, 0)) == '1'
+        return bool(self.students.availabilities[student_idx, self.students.slot_index[time_slot]])
     
     def _get_student_attribute(self, student_idx, attribute):
         """
         check if student student_idx has 1 for attribute
         """
-        if student_idx >= len(self.student_data['attributes']):
+        if student_idx >= self.num_students:
             return False
-        
-        attr_data = self.student_data['attributes'][student_idx]
-        value = attr_data.get(attribute, 0)
-        return str(int(value)) == '1'
+        return bool(self.students.attribute_column(attribute)[student_idx])
     
-    def schedule(self):
+    def _make_solver(self):
+        """cp-sat solver with the user's time limit / workers / seed / gap applied"""
+        solver = cp_model.CpSolver()
+        if self.solver_params.get('time_limit'):
+            solver.parameters.max_time_in_seconds = self.solver_params['time_limit']
+        if self.solver_params.get('num_workers'):
+            solver.parameters.num_workers = self.solver_params['num_workers']
+        if 'random_seed' in self.solver_params:
+            solver.parameters.random_seed = self.solver_params['random_seed']
+        if 'relative_gap' in self.solver_params:
+            solver.parameters.relative_gap_limit = self.solver_params['relative_gap']
+        for name, value in self.solver_params.get('sat_parameters', {}).items():
+            setattr(solver.parameters, name, value)
+        return solver
+
+    def stop(self):
+        """stop a running solve early (e.g. from another thread); schedule() then returns the best grouping found"""
+        self.stopped = True
+        if self.solver is not None:
+            self.solver.StopSearch()
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    def schedule(self, on_solution=None):
         """
-        generate groups based on constraints using ortools sat solver
+        generate groups based on constraints
+        the engine is picked here: the greedy fast path when only group sizes / counts are constrained,
+        decomposition for big cohorts, otherwise the full cp-sat model; result['engine'] says which one was used
+        on_solution: optional callable, called with the formatted result every time the solver finds a better grouping
+        with num_solutions > 1 it's always cp-sat, the greedy split and decomposition only come up with one grouping
+        with balance, the grouping from whichever engine ran is then improved (result['balance'] has the objective and gap),
+        unless minimize_changes is on (then students_moved is what counts)
+        """
+        start = time.perf_counter()
+        self.timer = PhaseTimer()
+        self.diagnostics = {'phases': self.timer.phases}
+        self.stopped = False
+        result = None
+
+        # an avoid pair inside a keep-together set can't hold, whichever engine runs
+        conflicts = self._pair_structure()[2]
+        if conflicts:
+            result = {
+                'error': 'No valid solution found with the given constraints. Possible reasons: ' +
+                         ' '.join(f'{a} and {b} have to be kept apart, but are also in the same keep-together set.' for a, b in conflicts),
+                'solver_status': 'INFEASIBLE',
+                'engine': 'pairs',
+            }
+            self.diagnostics['engine'] = 'pairs'
+            if self.diagnose_infeasible:
+                time_limit = DIAGNOSE_TIME_LIMIT if self.diagnose_infeasible is True else self.diagnose_infeasible
+                with self.timer.phase('diagnose'):
+                    result['diagnosis'] = self.diagnose(time_limit)
+            return result
+
+        if self.fast_path and not self.warm_start and self.num_solutions <= 1 and fast_path_applies(self.constraints):
+            with self.timer.phase('greedy'):
+                grouping = greedy_schedule(self.students, self.constraints)
+            if grouping is not None:
+                result = self._grouping_result(grouping['slots'], grouping['groups'])
+                result['solver_status'] = 'FEASIBLE'
+                result['engine'] = 'greedy'
+            # otherwise the greedy split got stuck, cp-sat may still find a grouping
+
+        decomposed = result is None and self._should_decompose()
+        if decomposed:
+            with self.timer.phase('decomposed'):
+                result = decomposed_schedule(self)
+            if result is not None:
+                result['engine'] = 'decomposed'
+            # otherwise some block had no valid grouping on its own, the full model might still have one
+
+        reported = False # whether on_solution has seen the result already
+        # after a failed decomposition, only what's left of the time limit
+        deadline = start + self.solver_params['time_limit'] if decomposed and self.solver_params.get('time_limit') else None
+        if result is not None:
+            self.diagnostics['engine'] = result['engine']
+        elif self.stopped or (deadline is not None and time.perf_counter() >= deadline):
+            # stopped (or out of time) during the decomposition, no use building the full model
+            result = {'error': 'No grouping was found within the time limit. Try a longer time limit or looser constraints.',
+                      'solver_status': 'UNKNOWN', 'engine': 'decomposed'}
+            self.diagnostics['engine'] = 'decomposed'
+        else:
+            result = self._solve_cp_sat(on_solution, deadline)
+            result['engine'] = self.diagnostics['engine'] = 'cp-sat'
+            reported = True
+            if self.diagnose_infeasible and result.get('solver_status') == 'INFEASIBLE':
+                time_limit = DIAGNOSE_TIME_LIMIT if self.diagnose_infeasible is True else self.diagnose_infeasible
+                with self.timer.phase('diagnose'):
+                    result['diagnosis'] = self.diagnose(time_limit)
+
+        # (not with alternatives, which point into the first grouping's order of students)
+        if self.balance and self.num_solutions <= 1 and 'error' not in result and result.get('groups'):
+            if self.minimize_changes:
+                # balancing would move students the solve just kept in their previous group
+                result['balance'] = {'skipped': 'minimize_changes is on, so students stay in their previous groups instead.'}
+            else:
+                deadline = start + (self.solver_params.get('time_limit') or BALANCE_TIME_LIMIT)
+                with self.timer.phase('balance'):
+                    result = balance_schedule(self, result, deadline)
+                reported = not result['balance']['improvements']
+                if 'students_moved' in result and result['balance']['improvements']:
+                    result['students_moved'] = self._moved_since_warm_start(result)
+
+        # check the final grouping against every constraint, independently of the model (see validate.py)
+        if 'groups' in result:
+            with self.timer.phase('validate'):
+                result['validation'] = check_result(self, result)
+        if on_solution and not reported:
+            on_solution(result)
+        return result
+
+    def build_cp_model(self):
+        """
+        presolve and build the full cp-sat model (without solving it)
+        returns {'model', 'student_in_group', 'group_uses_time', 'group_active', 'max_groups', 'presolve', 'previous_group',
+                 'buckets'}; with buckets (a list of student index arrays, see _buckets) student_in_group holds
+                 how many students of bucket b are in group g, instead of a bool per student
         """
         model = cp_model.CpModel()
         
-        # Variables
-        max_groups = min(self.constraints.group_count_max, self.num_students) if self.constraints.group_count_max else self.num_students
+        # presolve: fewer groups, fewer slots, and per student only the slots they can make
+        presolve = self._presolve()
+        max_groups = presolve['max_groups']
+        usable_slots = presolve['usable_slots']
+
+        buckets = self._buckets(usable_slots)
+        if buckets is not None:
+            presolve['report']['buckets'] = len(buckets)
+            student_in_group, group_uses_time, group_active = self._build_bucket_model(
+                model, max_groups, usable_slots, presolve['student_slots'], buckets)
+        else:
+            student_in_group, group_uses_time, group_active = self._build_model(
+                model, max_groups, usable_slots, presolve['student_slots'])
+
+        # 9. symmetry breaking: groups are interchangeable, so without this the solver
+        # explores every permutation of group labels (this hurts most on infeasible inputs).
+        # the redundant totals over all groups let it rule out infeasible inputs by counting
+        # (when minimizing changes the objective already tells the labels apart, and ordering them
+        # could force a previous group onto a new label, which would count as students moving)
+        if self.symmetry_breaking:
+            if not self.minimize_changes:
+                self._add_symmetry_breaking(model, student_in_group, group_uses_time, group_active, max_groups,
+                                            buckets is not None)
+            self._add_aggregate_bounds(model, group_active, max_groups)
+
+        # 10. warm start from a previous grouping
+        previous_group = None
+        if self.warm_start:
+            previous_group, previous_slot = self._previous_assignment(max_groups)
+            self._add_warm_start(model, student_in_group, group_uses_time, group_active, max_groups,
+                                 previous_group, previous_slot)
+
+        return {
+            'model': model,
+            'student_in_group': student_in_group,
+            'group_uses_time': group_uses_time,
+            'group_active': group_active,
+            'max_groups': max_groups,
+            'presolve': presolve,
+            'previous_group': previous_group,
+            'buckets': buckets,
+        }
+
+    def _solve_cp_sat(self, on_solution=None, deadline=None):
+        """
+        generate groups based on constraints using ortools sat solver
+        deadline: time.perf_counter() the search has to end by (building the model counts), instead of the user's time limit
+        """
+        with self.timer.phase('build'):
+            built = self.build_cp_model()
+        model = built['model']
+        proto = model.Proto()
+        if self.capture:
+            # serialized now, before the search (and any alternatives' cuts) starts
+            self.captured_model = proto.SerializeToString()
+        self.diagnostics['model'] = {'variables': len(proto.variables), 'constraints': len(proto.constraints)}
+        if built['buckets'] is not None:
+            self.diagnostics['model']['buckets'] = len(built['buckets'])
+        student_in_group, group_uses_time, group_active = built['student_in_group'], built['group_uses_time'], built['group_active']
+        max_groups, presolve, previous_group, buckets = built['max_groups'], built['presolve'], built['previous_group'], built['buckets']
+        
+        # solve for best solution
+        solver = self.solver = self._make_solver()
+        callback = None
+        found = [] # every grouping seen during the search, candidates for the alternatives
+        if on_solution or self.num_solutions > 1:
+            def handler(values):
+                if self.num_solutions > 1:
+                    found.append(self._read_assignment(values, student_in_group, group_uses_time, group_active, max_groups))
+                if on_solution:
+                    on_solution(self._format_solution(values, student_in_group, group_uses_time, group_active, max_groups, buckets))
+            callback = _SolutionCallback(handler)
+        start = time.perf_counter()
+        if deadline is not None:
+            solver.parameters.max_time_in_seconds = max(deadline - start, 0.0)
+        with self.timer.phase('solve'):
+            status = solver.Solve(model, callback)
+        self.diagnostics['solver'] = self._solver_stats(solver, status, model)
         
+        if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+            with self.timer.phase('format'):
+                result = self._format_solution(solver, student_in_group, group_uses_time, group_active, max_groups, buckets)
+            result['solver_status'] = solver.StatusName(status)
+            result['presolve'] = presolve['report']
+            if previous_group is not None:
+                result['students_moved'] = self._count_moved(solver, student_in_group, group_uses_time, group_active, max_groups, previous_group)
+            if self.num_solutions > 1:
+                with self.timer.phase('alternatives'):
+                    result['alternatives'] = self._alternatives(built, solver, found, start)
+            return result
+        elif status == cp_model.UNKNOWN:
+            # hit the time limit (or was stopped) before finding any grouping
+            return {
+                'error': 'No grouping was found within the time limit. Try a longer time limit or looser constraints.',
+                'solver_status': solver.StatusName(status)
+            }
+        else:
+            # detailed error reporting to help user adjust their constraints
+            reasons = []
+            if presolve['report']['students_without_usable_slot']:
+                reasons.append(f"{presolve['report']['students_without_usable_slot']} student(s) are only available at time slots where fewer than {self.constraints.group_size_min} students are available.")
+            if self.constraints.group_size_min > self.num_students:
+                reasons.append(f"Minimum group size ({self.constraints.group_size_min}) is greater than the number of students ({self.num_students}).")
+            if self.constraints.group_count_max and self.constraints.group_count_max < self.constraints.group_count_min:
+                reasons.append(f"Maximum group count ({self.constraints.group_count_max}) is less than the minimum group count ({self.constraints.group_count_min}).")
+            # attribute constraints issues
+            for attr, cons in self.constraints.get_attribute_constraints().items():
+                count_with_attr = int(self.students.attribute_column(attr).sum())
+                if 'min_per_group' in cons and count_with_attr < cons['min_per_group'] * self.constraints.group_count_min:
+                    reasons.append(f"Not enough students with attribute '{attr}' to satisfy the minimum per group ({cons['min_per_group']}).")
+                if 'max_per_group' in cons and cons['max_per_group'] < 1:
+                    reasons.append(f"Maximum per group for attribute '{attr}' is less than 1.")
+            for a, b in self._pair_structure()[2]:
+                reasons.append(f"{a} and {b} have to be kept apart, but are also in the same keep-together set.")
+            if not reasons:
+                reasons.append("The combination of constraints may be too strict or incompatible with the data.")
+            return {
+                'error': 'No valid solution found with the given constraints. Possible reasons: ' + ' '.join(reasons),
+                'solver_status': solver.StatusName(status)
+            }
+    
+    def _solver_stats(self, solver, status, model):
+        """cp-sat response stats for the diagnostics"""
+        stats = {
+            'status': solver.StatusName(status),
+            'wall_time': round(solver.WallTime(), 4),
+            'user_time': round(solver.UserTime(), 4),
+            'branches': solver.NumBranches(),
+            'conflicts': solver.NumConflicts(),
+        }
+        if model.HasObjective() and status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            stats['objective'] = solver.ObjectiveValue()
+            stats['best_bound'] = solver.BestObjectiveBound()
+        return stats
+
+    def _build_model(self, model, max_groups, usable_slots, student_slots, guards=None):
+        """
+        add the variables and constraints 1-8 to model
+        student_slots: per student, the slots (of usable_slots) they can make
+        guards: optional {family key: bool var} (see _constraint_families); a family's constraints only hold while
+                its var is true, so they can be switched on/off with assumptions (used by diagnose)
+        returns student_in_group, group_uses_time, group_active
+        """
+        def when(family, *literals):
+            # enforcement literals for a constraint in family
+            if guards is None:
+                return list(literals)
+            return list(literals) + [guards[family]]
+
+        # Variables (unnamed, names only cost memory and time in big models)
+
+        # keep-together sets are contracted: the students of a set share their representative's variables
+        # (with guards they get their own, tied to the representative's, so diagnose can switch that off)
+        representative, avoid_cliques, conflicts = self._pair_structure()
+
         # student_in_group[s][g] = 1 if student s is in group g
         student_in_group = {}
         for s in range(self.num_students):
+            if representative[s] != s and guards is None:
+                student_in_group[s] = student_in_group[representative[s]]
+                continue
             student_in_group[s] = {}
             for g in range(max_groups):
-                student_in_group[s][g] = model.NewBoolVar(f'student_{s}_in_group_{g}')
+                student_in_group[s][g] = model.NewBoolVar('')
+        nodes = [s for s in range(self.num_students) if representative[s] == s or guards is not None]
         
-        # group_uses_time[g][t] = 1 if group g uses time slot t
+        # group_uses_time[g][t] = 1 if group g uses time slot t (only slots a group can actually use)
         group_uses_time = {}
         for g in range(max_groups):
             group_uses_time[g] = {}
-            for t in range(self.num_time_slots):
-                group_uses_time[g][t] = model.NewBoolVar(f'group_{g}_uses_time_{t}')
+            for t in usable_slots:
+                group_uses_time[g][t] = model.NewBoolVar('')
         
         # group_active[g] = 1 if group g is used (b.c. can have up to max_groups number of groups)
         group_active = {}
         for g in range(max_groups):
-            group_active[g] = model.NewBoolVar(f'group_{g}_active')
+            group_active[g] = model.NewBoolVar('')
+
+        # group sizes are used by several constraints below, build each sum once
+        group_size = {g: cp_model.LinearExpr.Sum([student_in_group[s][g] for s in range(self.num_students)])
+                      for g in range(max_groups)}
         
         # Constraints
         
         # 1. each student is in exactly one group
-        for s in range(self.num_students):
-            model.Add(sum(student_in_group[s][g] for g in range(max_groups)) == 1) # i.e. sum of indicators for specific student should be 1
+        for s in nodes:
+            model.AddExactlyOne(student_in_group[s][g] for g in range(max_groups)) # i.e. sum of indicators for specific student should be 1
         
         # 2. each group uses exactly one time slot
         for g in range(max_groups):
-            model.Add(sum(group_uses_time[g][t] for t in range(self.num_time_slots)) == group_active[g])
+            model.Add(sum(group_uses_time[g].values()) == group_active[g])
         
         # 3. group size constraints
         for g in range(max_groups):
-            group_size = sum(student_in_group[s][g] for s in range(self.num_students))
-            
             # if group is active, enforce size constraints
-            model.Add(group_size >= self.constraints.group_size_min).OnlyEnforceIf(group_active[g])
+            model.Add(group_size[g] >= self.constraints.group_size_min).OnlyEnforceIf(when('group_size_min', group_active[g]))
             if self.constraints.group_size_max:
-                model.Add(group_size <= self.constraints.group_size_max).OnlyEnforceIf(group_active[g])
+                model.Add(group_size[g] <= self.constraints.group_size_max).OnlyEnforceIf(when('group_size_max', group_active[g]))
             
             # if group is not active, it has size 0
-            model.Add(group_size == 0).OnlyEnforceIf(group_active[g].Not())
+            model.Add(group_size[g] == 0).OnlyEnforceIf(group_active[g].Not())
             
         
         # 4. group count constraints
         total_groups = sum(group_active[g] for g in range(max_groups))
-        model.Add(total_groups >= self.constraints.group_count_min)
+        model.Add(total_groups >= self.constraints.group_count_min).OnlyEnforceIf(when('group_count_min'))
         if self.constraints.group_count_max:
-            model.Add(total_groups <= self.constraints.group_count_max)
+            model.Add(total_groups <= self.constraints.group_count_max).OnlyEnforceIf(when('group_count_max'))
         
-        # 5. availability constraints
-        for s in range(self.num_students):
+        # 5. availability constraints: if student s is in group g, group g uses one of the slots s can make
+        # (one clause per student and group, instead of one constraint per slot they can't make)
+        if guards is None:
+            # a contracted set meets at a slot all of its students can make
+            student_slots = list(student_slots)
+            for s in range(self.num_students):
+                if representative[s] != s:
+                    member_slots = set(student_slots[s])
+                    student_slots[representative[s]] = [t for t in student_slots[representative[s]] if t in member_slots]
+        for s in nodes:
+            slots = student_slots[s]
+            if len(slots) == len(usable_slots):
+                continue # can make every slot, nothing to forbid
             for g in range(max_groups):
-                for t in range(self.num_time_slots):
-                    # if student s is in group g and group g uses time t,
-                    # then student s must be available at time t
-                    if not self._get_student_availability(s, self.time_slots[t]):
-                        model.Add(student_in_group[s][g] + group_uses_time[g][t] <= 1)
+                model.AddBoolOr([student_in_group[s][g].Not()] + [group_uses_time[g][t] for t in slots]).OnlyEnforceIf(when('availability'))
         
         # 6. attribute constraints
         attribute_constraints = self.constraints.get_attribute_constraints()
         for attr, constraints in attribute_constraints.items():
+            holders = np.flatnonzero(self.students.attribute_column(attr)).tolist()
             for g in range(max_groups):
-                group_attr_count = sum(student_in_group[s][g] for s in range(self.num_students) 
-                            if self._get_student_attribute(s, attr))
+                group_attr_count = sum(student_in_group[s][g] for s in holders)
                 
                 if 'min_per_group' in constraints:
                     # Only enforce minimum if group is active
-                    model.Add(group_attr_count >= constraints['min_per_group']).OnlyEnforceIf(group_active[g])
+                    model.Add(group_attr_count >= constraints['min_per_group']).OnlyEnforceIf(when(f'attribute:{attr}:min', group_active[g]))
                 if 'max_per_group' in constraints:
                     # Only enforce maximum if group is active
-                    model.Add(group_attr_count <= constraints['max_per_group']).OnlyEnforceIf(group_active[g])
+                    model.Add(group_attr_count <= constraints['max_per_group']).OnlyEnforceIf(when(f'attribute:{attr}:max', group_active[g]))
 
         # 7. combined attribute constraints! added this in case individual constraints are not expressive enough
         combined_constraints = self.constraints.get_combined_constraints()
-        for combined in combined_constraints:
+        for i, combined in enumerate(combined_constraints):
             attrs = combined.get('attributes', [])
             min_val = combined.get('min')
             max_val = combined.get('max')
+            holders = np.flatnonzero(self.students.any_attribute_column(attrs)).tolist()
             for g in range(max_groups):
-                group_combined_count = sum(
-                    student_in_group[s][g]
-                    for s in range(self.num_students)
-                    if any(self._get_student_attribute(s, attr) for attr in attrs)
-                )
-                group_size = sum(student_in_group[s][g] for s in range(self.num_students))
+                group_combined_count = sum(student_in_group[s][g] for s in holders)
                 
+                # a group has students exactly when it's active (inactive groups have size 0, active ones at least group_size_min)
                 if min_val is not None:
-                    # Enforce minimum constraint: if group has any students, it must meet the minimum
-                    group_has_students = model.NewBoolVar(f'group_{g}_has_students_combined')
-                    model.Add(group_size >= 1).OnlyEnforceIf(group_has_students)
-                    model.Add(group_size == 0).OnlyEnforceIf(group_has_students.Not())
-                    model.Add(group_combined_count >= min_val).OnlyEnforceIf(group_has_students)
+                    model.Add(group_combined_count >= min_val).OnlyEnforceIf(when(f'combined:{i}:min', group_active[g]))
                 if max_val is not None:
-                    model.Add(group_combined_count <= max_val).OnlyEnforceIf(group_active[g])
-        
-        # solve for best solution
-        solver = cp_model.CpSolver()
-        status = solver.Solve(model)
-        
-        if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
-            return self._format_solution(solver, student_in_group, group_uses_time, group_active, max_groups)
-        else:
-            # detailed error reporting to help user adjust their constraints
-            reasons = []
-            if self.constraints.group_size_min > self.num_students:
-                reasons.append(f"Minimum group size ({self.constraints.group_size_min}) is greater than the number of students ({self.num_students}).")
-            if self.constraints.group_count_max and self.constraints.group_count_max < self.constraints.group_count_min:
-                reasons.append(f"Maximum group count ({self.constraints.group_count_max}) is less than the minimum group count ({self.constraints.group_count_min}).")
-            # attribute constraints issues
-            for attr, cons in self.constraints.get_attribute_constraints().items():
-                count_with_attr = sum(1 for s in self.student_data['attributes'] if str(s.get(attr, 0)) == '1')
-                if 'min_per_group' in cons and count_with_attr < cons['min_per_group'] * self.constraints.group_count_min:
-                    reasons.append(f"Not enough students with attribute '{attr}' to satisfy the minimum per group ({cons['min_per_group']}).")
-                if 'max_per_group' in cons and cons['max_per_group'] < 1:
-                    reasons.append(f"Maximum per group for attribute '{attr}' is less than 1.")
-            if not reasons:
-                reasons.append("The combination of constraints may be too strict or incompatible with the data.")
-            return {'error': 'No valid solution found with the given constraints. Possible reasons: ' + ' '.join(reasons)}
-    
-    def _format_solution(self, solver, student_in_group, group_uses_time, group_active, max_groups):
-        """format the solution into group ids, time slots they're assigned to, students in each group"""
-        groups = []
-        
+                    model.Add(group_combined_count <= max_val).OnlyEnforceIf(when(f'combined:{i}:max', group_active[g]))
+
+        # 8. pair constraints
+        # students that avoid each other: one at-most-one per clique of them and group, rather than a clause per pair
+        for clique in avoid_cliques:
+            for g in range(max_groups):
+                if guards is None:
+                    model.AddAtMostOne(student_in_group[s][g] for s in clique)
+                else:
+                    model.Add(sum(student_in_group[s][g] for s in clique) <= 1).OnlyEnforceIf(when('avoid_pairs'))
+        if guards is not None:
+            for s in range(self.num_students):
+                if representative[s] != s:
+                    for g in range(max_groups):
+                        model.Add(student_in_group[s][g] == student_in_group[representative[s]][g]).OnlyEnforceIf(when('keep_together'))
+        # an avoid pair inside a keep-together set shares its variables, so the clique above can't hold it: it never holds
+        if conflicts:
+            model.AddBoolOr([]).OnlyEnforceIf(when('avoid_pairs', *when('keep_together')))
+
+        return student_in_group, group_uses_time, group_active
+
+    def _buckets(self, usable_slots):
+        """
+        students grouped by signature: which usable slots they can make plus the attributes that some constraint
+        looks at; students with the same signature are interchangeable, so the model only needs to know how many
+        of each bucket go in each group
+        returns a list of student index arrays (in input order), or None when the per-student model is used:
+        aggregate is off, something needs individual students (a warm start, pair constraints, alternatives),
+        or (with aggregate=None) there are more than AGGREGATE_MAX_RATIO buckets per student
+        """
+        if self.aggregate is False or self.num_students == 0:
+            return None
+        if self.warm_start or self.num_solutions > 1 or self.constraints.has_pair_constraints():
+            return None
+
+        columns = [self.students.availabilities[:, usable_slots]]
+        for attr in self.constraints.get_attribute_constraints():
+            columns.append(self.students.attribute_column(attr)[:, None])
+        for combined in self.constraints.get_combined_constraints():
+            columns.append(self.students.any_attribute_column(combined.get('attributes', []))[:, None])
+        signatures = np.hstack(columns).astype(np.uint8)
+        _, first, inverse = np.unique(signatures, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        if self.aggregate is None and len(first) > AGGREGATE_MAX_RATIO * self.num_students:
+            return None
+
+        # buckets in order of their first student, each bucket's students in input order
+        order = np.argsort(first, kind='stable')
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[order] = np.arange(len(first))
+        students = np.argsort(rank[inverse], kind='stable')
+        return np.split(students, np.cumsum(np.bincount(rank[inverse], minlength=len(first)))[:-1])
+
+    def _build_bucket_model(self, model, max_groups, usable_slots, student_slots, buckets):
+        """
+        the same constraints as _build_model (without guards), over buckets of interchangeable students:
+        bucket_in_group[b][g] = how many students of bucket b are in group g
+        returns bucket_in_group, group_uses_time, group_active
+        """
+        size_max = self.constraints.group_size_max
+        bucket_in_group = {}
+        for b, bucket in enumerate(buckets):
+            bucket_in_group[b] = {}
+            upper = min(len(bucket), size_max) if size_max else len(bucket)
+            for g in range(max_groups):
+                bucket_in_group[b][g] = model.NewIntVar(0, upper, '')
+
+        group_uses_time = {}
         for g in range(max_groups):
-            if solver.Value(group_active[g]):
-                # Find students in this group
-                group_students = []
-                for s in range(self.num_students):
-                    if solver.Value(student_in_group[s][g]):
-                        student_name = self.student_data['names'][s]
-                        student_attrs = (self.student_data['attributes'][s] 
-                                       if s < len(self.student_data['attributes']) else {})
-                        student_avail = (self.student_data['availabilities'][s] 
-                                       if s < len(self.student_data['availabilities']) else {})
-                        
-                        group_students.append({
-                            'name': student_name,
-                            'attributes': student_attrs,
-                            'availabilities': student_avail
-                        })
-                
-                # Find time slot for this group
-                time_slot = 'Not assigned'
-                for t in range(self.num_time_slots):
-                    if solver.Value(group_uses_time[g][t]):
-                        time_slot = self.time_slots[t]
-                        break
-                
-                groups.append({
-                    'group_id': g + 1,  # 1-indexed for display
-                    'time_slot': time_slot,
-                    'students': group_students,
-                    'size': len(group_students)
-                })
-        
-        # Sort groups by ID for consistent output
-        groups.sort(key=lambda x: x['group_id'])
-        
+            group_uses_time[g] = {}
+            for t in usable_slots:
+                group_uses_time[g][t] = model.NewBoolVar('')
+
+        group_active = {}
+        for g in range(max_groups):
+            group_active[g] = model.NewBoolVar('')
+
+        group_size = {g: cp_model.LinearExpr.Sum([bucket_in_group[b][g] for b in range(len(buckets))])
+                      for g in range(max_groups)}
+
+        # 1. every student of a bucket is in exactly one group
+        for b, bucket in enumerate(buckets):
+            model.Add(sum(bucket_in_group[b][g] for g in range(max_groups)) == len(bucket))
+
+        # 2. each group uses exactly one time slot
+        for g in range(max_groups):
+            model.Add(sum(group_uses_time[g].values()) == group_active[g])
+
+        # 3. group sizes
+        for g in range(max_groups):
+            model.Add(group_size[g] >= self.constraints.group_size_min).OnlyEnforceIf(group_active[g])
+            if size_max:
+                model.Add(group_size[g] <= size_max).OnlyEnforceIf(group_active[g])
+            model.Add(group_size[g] == 0).OnlyEnforceIf(group_active[g].Not())
+
+        # 4. group count
+        total_groups = sum(group_active[g] for g in range(max_groups))
+        model.Add(total_groups >= self.constraints.group_count_min)
+        if self.constraints.group_count_max:
+            model.Add(total_groups <= self.constraints.group_count_max)
+
+        # 5. availability: a bucket only has students in a group if the group meets at one of the bucket's slots
+        # (a group uses exactly one slot, so the sum over the bucket's slots is 0 or 1)
+        for b, bucket in enumerate(buckets):
+            slots = student_slots[bucket[0]]
+            if len(slots) == len(usable_slots):
+                continue
+            upper = min(len(bucket), size_max) if size_max else len(bucket)
+            for g in range(max_groups):
+                model.Add(bucket_in_group[b][g] <= upper * sum(group_uses_time[g][t] for t in slots))
+
+        # 6. and 7. attribute constraints, individual and combined, count the buckets that have the attribute(s)
+        families = [(self.students.attribute_column(attr), cons.get('min_per_group'), cons.get('max_per_group'))
+                    for attr, cons in self.constraints.get_attribute_constraints().items()]
+        families += [(self.students.any_attribute_column(combined.get('attributes', [])), combined.get('min'), combined.get('max'))
+                     for combined in self.constraints.get_combined_constraints()]
+        for column, min_val, max_val in families:
+            holders = [b for b, bucket in enumerate(buckets) if column[bucket[0]]]
+            for g in range(max_groups):
+                count = sum(bucket_in_group[b][g] for b in holders)
+                if min_val is not None:
+                    model.Add(count >= min_val).OnlyEnforceIf(group_active[g])
+                if max_val is not None:
+                    model.Add(count <= max_val).OnlyEnforceIf(group_active[g])
+
+        return bucket_in_group, group_uses_time, group_active
+
+    def _pair_structure(self):
+        """
+        the pair constraints as student indices: (representative per student, avoid cliques, conflicts)
+        representative: the lowest-index student of each keep-together set (sets sharing a student are merged),
+        every other student is its own representative
+        avoid cliques: sets of representatives that all have to be in different groups, covering every avoid pair
+        conflicts: avoid pairs inside one keep-together set, as (name, name); these can never be satisfied
+        names that aren't in self.students (e.g. students with no availabilities) are skipped
+        """
+        avoid_pairs, keep_together = self.constraints.get_pair_constraints()
+        index = {}
+        for s, name in enumerate(self.students.names):
+            index.setdefault(name.strip().lower(), s)
+
+        representative = list(range(self.num_students))
+        def find(s):
+            while representative[s] != s:
+                representative[s] = representative[representative[s]]
+                s = representative[s]
+            return s
+        for names in keep_together:
+            members = sorted(index[name.strip().lower()] for name in names if name.strip().lower() in index)
+            for s in members[1:]:
+                a, b = find(members[0]), find(s)
+                representative[max(a, b)] = min(a, b)
+        representative = [find(s) for s in range(self.num_students)]
+
+        pairs, conflicts = set(), []
+        for a, b in avoid_pairs:
+            if a.strip().lower() not in index or b.strip().lower() not in index:
+                continue
+            ra, rb = representative[index[a.strip().lower()]], representative[index[b.strip().lower()]]
+            if ra == rb:
+                conflicts.append((a, b))
+            else:
+                pairs.add((min(ra, rb), max(ra, rb)))
+        return representative, _avoid_cliques(sorted(pairs)), conflicts
+
+    def _constraint_families(self):
+        """
+        the user's constraints grouped into families that diagnose can switch on and off
+        returns a list of (key, description)
+        """
+        c = self.constraints
+        families = [('group_size_min', f'groups of at least {c.group_size_min} students')]
+        if c.group_size_max:
+            families.append(('group_size_max', f'groups of at most {c.group_size_max} students'))
+        families.append(('group_count_min', f'at least {c.group_count_min} groups'))
+        if c.group_count_max:
+            families.append(('group_count_max', f'at most {c.group_count_max} groups'))
+        families.append(('availability', 'students are only placed in groups meeting at a time they are available'))
+        for attr, cons in c.get_attribute_constraints().items():
+            if 'min_per_group' in cons:
+                families.append((f'attribute:{attr}:min', f"at least {cons['min_per_group']} student(s) with '{attr}' per group"))
+            if 'max_per_group' in cons:
+                families.append((f'attribute:{attr}:max', f"at most {cons['max_per_group']} student(s) with '{attr}' per group"))
+        for i, combined in enumerate(c.get_combined_constraints()):
+            attrs = ' or '.join(f"'{attr}'" for attr in combined.get('attributes', []))
+            if combined.get('min') is not None:
+                families.append((f'combined:{i}:min', f"at least {combined['min']} student(s) with {attrs} per group"))
+            if combined.get('max') is not None:
+                families.append((f'combined:{i}:max', f"at most {combined['max']} student(s) with {attrs} per group"))
+        avoid_pairs, keep_together = c.get_pair_constraints()
+        if avoid_pairs:
+            families.append(('avoid_pairs', f'{len(avoid_pairs)} pair(s) of students kept in different groups'))
+        if keep_together:
+            families.append(('keep_together', f'{len(keep_together)} set(s) of students kept in the same group'))
+        return families
+
+    def diagnose(self, time_limit=DIAGNOSE_TIME_LIMIT):
+        """
+        explain why there's no valid grouping: every constraint family gets an assumption literal, and cp-sat
+        reports a set of families that can't all hold together, which is then shrunk to a minimal one
+        (dropping any one family from it makes the rest consistent) as long as the time budget lasts
+        also tries which single family from that set, dropped on its own, makes the whole problem feasible
+        returns {'conflict': [...], 'minimal': bool, 'relaxations': [...], 'relaxations_complete': bool}
+        with descriptions of the families (the bools are False if the time budget ran out first),
+        or {'conflict': None, 'solver_status': ...} if no conflict could be found in time,
+        or {'conflict': None, 'skipped': message} above DIAGNOSE_MAX_STUDENTS students
+        """
+        # the time budget includes building the model, which is most of it on big sections
+        deadline = time.monotonic() + time_limit
+        if self.num_students > DIAGNOSE_MAX_STUDENTS:
+            return {'conflict': None, 'skipped': f'Too many students ({self.num_students}) to look for the conflicting constraints, '
+                                                 f'at most {DIAGNOSE_MAX_STUDENTS}. Try loosening one constraint at a time instead.'}
+        families = self._constraint_families()
+        descriptions = dict(families)
+
+        # no presolve here: it relies on the size and count limits, which may be switched off
+        # the number of groups is still bounded by whichever count / size limit allows the most, so every set of
+        # families with one of them on keeps all of its groupings (and without any of them, a grouping that
+        # needs more groups than that is out of reach anyway)
+        c = self.constraints
+        max_groups = min(self.num_students, max(c.group_count_max or 0, c.group_count_min or 0,
+                                                self.num_students // max(c.group_size_min or 1, 1)))
+        model = cp_model.CpModel()
+        guards = {key: model.NewBoolVar('') for key, _ in families}
+        all_slots = list(range(self.num_time_slots))
+        student_slots = [np.flatnonzero(row).tolist() for row in self.students.availabilities]
+        student_in_group, group_uses_time, group_active = self._build_model(
+            model, max_groups, all_slots, student_slots, guards)
+        # relabelling groups never matters, so this is safe whichever families are on
+        self._add_symmetry_breaking(model, student_in_group, group_uses_time, group_active, max_groups)
+        self._add_aggregate_bounds(model, group_active, max_groups, guards)
+        by_index = {guards[key].Index(): key for key in guards}
+
+        def solve(keys):
+            """solve with only the families in keys switched on"""
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, None
+            model.ClearAssumptions()
+            model.AddAssumptions([guards[key] for key in keys])
+            solver = cp_model.CpSolver()
+            solver.parameters.num_workers = 1 # the infeasible core is only reported by a single worker
+            solver.parameters.cp_model_probing_level = 0 # probing the big unpresolved model costs more than it saves here
+            solver.parameters.max_time_in_seconds = remaining
+            return solver.Solve(model), solver
+
+        status, solver = solve([key for key, _ in families])
+        if status != cp_model.INFEASIBLE:
+            return {'conflict': None, 'solver_status': solver.StatusName(status) if solver else 'UNKNOWN'}
+        core = [by_index[i] for i in solver.SufficientAssumptionsForInfeasibility() if i in by_index]
+
+        # shrink: drop each family in turn, and keep it out if the rest is still infeasible
+        minimal = True
+        for key in list(core):
+            status, _ = solve([k for k in core if k != key])
+            if status is None or status == cp_model.UNKNOWN:
+                minimal = False
+                break
+            if status == cp_model.INFEASIBLE:
+                core.remove(key)
+
+        # nearest relaxation: which family in the conflict, dropped alone, makes everything else fit
+        relaxations = []
+        relaxations_complete = True
+        for key in core:
+            status, _ = solve([k for k, _ in families if k != key])
+            if status is None or status == cp_model.UNKNOWN:
+                relaxations_complete = False
+                break
+            if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                relaxations.append(descriptions[key])
+
+        return {
+            'conflict': [descriptions[key] for key in core],
+            'minimal': minimal,
+            'relaxations': relaxations,
+            'relaxations_complete': relaxations_complete,
+        }
+
+    def _presolve(self):
+        """
+        shrink the model before building it:
+        - slots where fewer than group_size_min students are available can't host a group, they're dropped
+        - there can't be more groups than group_size_min-sized groups fit in the students, or in the usable slots
+          (groups in the same slot don't share students)
+        returns {'max_groups', 'usable_slots', 'student_slots' (usable slots per student), 'report'}
+        """
+        size_min = max(self.constraints.group_size_min or 1, 1)
+        available = self.students.availabilities.astype(bool)
+        per_slot = available.sum(axis=0)
+        usable_slots = np.flatnonzero(per_slot >= size_min).tolist()
+
+        initial_groups = min(self.constraints.group_count_max, self.num_students) if self.constraints.group_count_max else self.num_students
+        max_groups = min(initial_groups, self.num_students // size_min, int((per_slot[usable_slots] // size_min).sum()))
+
+        usable = available[:, usable_slots]
+        student_slots = [[usable_slots[i] for i in np.flatnonzero(row)] for row in usable]
+        restricted = int((usable.sum(axis=1) < len(usable_slots)).sum())
+
+        report = {
+            'max_groups': {'before': initial_groups, 'after': max_groups},
+            'slots_dropped': [self.time_slots[t] for t in sorted(set(range(self.num_time_slots)) - set(usable_slots))],
+            'boolean_variables': {
+                'before': initial_groups * (self.num_students + self.num_time_slots + 1),
+                'after': max_groups * (self.num_students + len(usable_slots) + 1),
+            },
+            'availability_constraints': {
+                'before': initial_groups * int((~available).sum()), # one per student, group and slot they can't make
+                'after': max_groups * restricted, # one clause per restricted student and group
+            },
+            'students_without_usable_slot': int((usable.sum(axis=1) == 0).sum()),
+        }
+        return {'max_groups': max_groups, 'usable_slots': usable_slots, 'student_slots': student_slots, 'report': report}
+
+    def _should_decompose(self):
+        # a warm start refers to the previous groups as a whole, so it always uses the full model
+        # (and so do alternative groupings, the diversity cuts are over the whole grouping)
+        if self.decompose is False or self.warm_start or self.num_solutions > 1:
+            return False
+        # pair constraints can link students in different blocks
+        if self.constraints.has_pair_constraints():
+            return False
+        return bool(self.decompose) or self.num_students >= DECOMPOSE_MIN_STUDENTS
+
+    def _add_symmetry_breaking(self, model, student_in_group, group_uses_time, group_active, max_groups, bucketed=False):
+        """
+        cut down the interchangeable group labels:
+        active groups come first, groups are sorted by time slot,
+        and the lowest-index student goes in the lowest group that uses its time slot
+        (not with bucketed=True: student_in_group holds bucket counts then, and student 0 has no variables of its own)
+        """
+        if max_groups == 0 or self.num_students == 0:
+            return
+        slots = list(group_uses_time[0]) # the slots in the model, in order
+
+        for g in range(max_groups - 1):
+            # a. active groups are a prefix: group g+1 can only be used if group g is
+            model.AddImplication(group_active[g + 1], group_active[g])
+
+            # b. lexicographic order of time slots: if group g+1 uses slot t, group g uses a slot <= t
+            # (written as clauses, which propagate much better than comparing weighted slot sums)
+            for i, t in enumerate(slots):
+                model.AddBoolOr([group_uses_time[g + 1][t].Not()] + [group_uses_time[g][u] for u in slots[:i + 1]])
+
+            # c. student 0 can't be in group g+1 if group g uses the same time slot
+            # same_slot is forced on when both groups use the same slot (it may stay off otherwise)
+            if bucketed:
+                continue
+            same_slot = model.NewBoolVar('')
+            for t in slots:
+                model.AddBoolOr([group_uses_time[g][t].Not(), group_uses_time[g + 1][t].Not(), same_slot])
+            model.AddBoolOr([student_in_group[0][g + 1].Not(), same_slot.Not()])
+
+    def _add_aggregate_bounds(self, model, group_active, max_groups, guards=None):
+        """
+        redundant totals over all groups; the per-group limits only hold when a group is active,
+        which the solver's linear relaxation sees very weakly, so counting arguments like
+        "12 students with F can't fill 10 groups with 2 each" are otherwise found by brute force
+        guards: see _build_model
+        """
+        def when(family):
+            return [guards[family]] if guards is not None else []
+
+        total_groups = sum(group_active[g] for g in range(max_groups))
+        model.Add(self.num_students >= self.constraints.group_size_min * total_groups).OnlyEnforceIf(when('group_size_min'))
+        if self.constraints.group_size_max:
+            model.Add(self.num_students <= self.constraints.group_size_max * total_groups).OnlyEnforceIf(when('group_size_max'))
+
+        for attr, constraints in self.constraints.get_attribute_constraints().items():
+            holders = int(self.students.attribute_column(attr).sum())
+            if 'min_per_group' in constraints:
+                model.Add(holders >= constraints['min_per_group'] * total_groups).OnlyEnforceIf(when(f'attribute:{attr}:min'))
+            if 'max_per_group' in constraints:
+                model.Add(holders <= constraints['max_per_group'] * total_groups).OnlyEnforceIf(when(f'attribute:{attr}:max'))
+
+    def _previous_assignment(self, max_groups):
+        """
+        line the warm start result up with this model:
+        previous_group[s] = index of the group student s was in (-1 if new or it doesn't fit in max_groups)
+        previous_slot[g] = index of the time slot group g used (-1 if unknown)
+        students are matched by name (repeated names are matched in order)
+        """
+        previous_group = np.full(self.num_students, -1, dtype=np.int64)
+        previous_slot = np.full(max_groups, -1, dtype=np.int64)
+
+        students_by_name = {}
+        for s, name in enumerate(self.students.names):
+            students_by_name.setdefault(name, deque()).append(s)
+
+        groups = [group for group in self.warm_start.get('groups', []) if not group.get('is_unassigned')]
+        groups.sort(key=lambda group: group.get('group_id', 0))
+        for g, group in enumerate(groups[:max_groups]):
+            previous_slot[g] = self.students.slot_index.get(group.get('time_slot'), -1)
+            for student in group.get('students', []):
+                name = student.get('name') if isinstance(student, dict) else student
+                if students_by_name.get(name):
+                    previous_group[students_by_name[name].popleft()] = g
+        return previous_group, previous_slot
+
+    def _moved_since_warm_start(self, result):
+        """students_moved (see _count_moved) for a formatted result, against the warm start"""
+        previous_group, _ = self._previous_assignment(len(self.warm_start.get('groups', [])))
+        group_of, _, _ = result_assignment(self.students, result)
+        was_grouped = previous_group >= 0
+        return int(was_grouped.sum()) - _matched_overlap(group_of[was_grouped], previous_group[was_grouped])
+
+    def _add_warm_start(self, model, student_in_group, group_uses_time, group_active, max_groups,
+                        previous_group, previous_slot):
+        """hint the previous grouping to the solver (and optionally make keeping it the objective)"""
+        hinted = set() # the students of a keep-together set share their variables, hint them once
+        for s in range(self.num_students):
+            if previous_group[s] < 0 or id(student_in_group[s]) in hinted:
+                continue
+            hinted.add(id(student_in_group[s]))
+            for g in range(max_groups):
+                model.AddHint(student_in_group[s][g], g == previous_group[s])
+
+        used_groups = set(previous_group[previous_group >= 0].tolist())
+        for g in range(max_groups):
+            model.AddHint(group_active[g], g in used_groups)
+            if previous_slot[g] >= 0:
+                for t, uses_time in group_uses_time[g].items():
+                    model.AddHint(uses_time, t == previous_slot[g])
+
+        if self.minimize_changes:
+            model.Maximize(sum(student_in_group[s][int(previous_group[s])]
+                               for s in range(self.num_students) if previous_group[s] >= 0))
+
+    def _count_moved(self, solver, student_in_group, group_uses_time, group_active, max_groups, previous_group):
+        """
+        how many students (that were in the previous grouping) ended up with different groupmates;
+        new groups are matched to previous groups by overlap first, so relabelled groups don't count as moves
+        """
+        group_of, _ = self._read_assignment(solver, student_in_group, group_uses_time, group_active, max_groups)
+        was_grouped = previous_group >= 0
+        return int(was_grouped.sum()) - _matched_overlap(group_of[was_grouped], previous_group[was_grouped])
+
+    def _var_indices(self, student_in_group, group_uses_time, group_active, max_groups):
+        """
+        the model's variables as index arrays, so a whole solution is read with index operations (see _solution):
+        (rows x groups for student_in_group, one per group for group_active,
+         groups x time slots for group_uses_time with -1 where a group can't use the slot)
+        kept for the model they were last made for, callbacks read the same model over and over
+        """
+        if self._indices is not None and self._indices[0] is student_in_group:
+            return self._indices[1]
+        rows = len(student_in_group)
+        in_group = np.array([[student_in_group[r][g].Index() for g in range(max_groups)] for r in range(rows)],
+                            dtype=np.int64).reshape(rows, max_groups)
+        active = np.array([group_active[g].Index() for g in range(max_groups)], dtype=np.int64)
+        uses_time = np.full((max_groups, self.num_time_slots), -1, dtype=np.int64)
+        for g in range(max_groups):
+            for t, var in group_uses_time[g].items():
+                uses_time[g, t] = var.Index()
+        self._indices = (student_in_group, (in_group, active, uses_time))
+        return self._indices[1]
+
+    def _solution(self, solver, student_in_group, group_uses_time, group_active, max_groups):
+        """
+        the current solution as arrays, read out of the response in one go instead of a Value() call per variable:
+        (student_in_group values, rows x groups; which groups are active; slot index per group, -1 for none)
+        solver: the solver, or a solution callback mid-search
+        """
+        in_group, active, uses_time = self._var_indices(student_in_group, group_uses_time, group_active, max_groups)
+        response = solver.Response() if isinstance(solver, cp_model.CpSolverSolutionCallback) else solver.ResponseProto()
+        values = np.asarray(response.solution, dtype=np.int64)
+        uses = (uses_time >= 0) & (values[np.maximum(uses_time, 0)] == 1)
+        slot_of = np.where(uses.any(axis=1), uses.argmax(axis=1), -1)
+        return values[in_group], values[active] == 1, slot_of
+
+    def _group_of(self, assigned, buckets=None):
+        """
+        group index per student (-1 for none) from the student_in_group values of _solution
+        buckets: with the bucket model, assigned holds how many of each bucket's students are in each group,
+                 and each group gets that many of the bucket's students (in input order, the rest go to later groups)
+        """
+        if assigned.shape[1] == 0:
+            return np.full(self.num_students, -1, dtype=np.int64)
+        if buckets is None:
+            return np.where(assigned.any(axis=1), assigned.argmax(axis=1), -1)
+        group_of = np.full(self.num_students, -1, dtype=np.int64)
+        for b, bucket in enumerate(buckets):
+            labels = np.repeat(np.arange(assigned.shape[1]), assigned[b])
+            group_of[bucket[:len(labels)]] = labels
+        return group_of
+
+    def _read_assignment(self, solver, student_in_group, group_uses_time, group_active, max_groups):
+        """
+        a solution as (group index per student, slot index per group in use), to compare and format it later
+        solver: the solver or a solution callback, like in _format_solution
+        """
+        assigned, _, slot_of = self._solution(solver, student_in_group, group_uses_time, group_active, max_groups)
+        group_of = self._group_of(assigned)
+        return group_of, {g: int(slot_of[g]) for g in np.unique(group_of[group_of >= 0]).tolist()}
+
+    def _students_apart(self, group_of, other_group_of):
+        """
+        how many students have different groupmates in two groupings (group index per student);
+        groups are matched by overlap first like in _count_moved, so relabelled groups don't count
+        """
+        return self.num_students - _matched_overlap(group_of, other_group_of)
+
+    def _alternatives(self, built, solver, found, start):
+        """
+        up to num_solutions - 1 more groupings, each at least min_difference students apart from every other one
+        found: the groupings the solution callback saw during the main solve (tried first, they cost nothing)
+        after that the same model is solved again with a diversity cut per grouping so far,
+        i.e. a minimum hamming distance over the student / group indicators:
+        at most n - min_difference students may be in the group they had there
+        (symmetry breaking keeps the group labels mostly canonical; a relabelled grouping that slips through
+        is still caught by _students_apart, and gets its own cut)
+        the main solve and the alternatives share the time limit
+        returns the alternatives, see _alternative_result
+        """
+        model, student_in_group = built['model'], built['student_in_group']
+        group_uses_time, group_active, max_groups = built['group_uses_time'], built['group_active'], built['max_groups']
+        min_difference = self.min_difference or max(1, self.num_students // 10)
+        if self.num_students == 0 or min_difference > self.num_students:
+            return []
+
+        def add_cut(group_of):
+            model.Add(sum(student_in_group[s][int(group_of[s])] for s in range(self.num_students))
+                      <= self.num_students - min_difference)
+
+        first = self._read_assignment(solver, student_in_group, group_uses_time, group_active, max_groups)
+        kept = [first]
+        add_cut(first[0])
+        candidates = found
+        time_limit = self.solver_params.get('time_limit')
+        # every extra search either adds an alternative or rules one relabelling out, give up after a few of the latter
+        for _ in range(3 * self.num_solutions):
+            for group_of, slot_of in candidates:
+                if len(kept) < self.num_solutions and all(
+                        self._students_apart(group_of, other) >= min_difference for other, _ in kept):
+                    kept.append((group_of, slot_of))
+                    add_cut(group_of)
+            if len(kept) >= self.num_solutions or self.stopped:
+                break
+
+            solver = self.solver = self._make_solver()
+            if time_limit:
+                remaining = time_limit - (time.perf_counter() - start)
+                if remaining <= 0:
+                    break
+                solver.parameters.max_time_in_seconds = remaining
+            collected = []
+            status = solver.Solve(model, _SolutionCallback(lambda values: collected.append(
+                self._read_assignment(values, student_in_group, group_uses_time, group_active, max_groups))))
+            if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                break # no grouping far enough from the ones so far (or out of time)
+            candidates = collected
+            final = self._read_assignment(solver, student_in_group, group_uses_time, group_active, max_groups)
+            if all(self._students_apart(final[0], other) > 0 for other, _ in kept):
+                candidates.append(final)
+            else:
+                add_cut(final[0]) # a relabelling of a grouping we already have
+
+        return [self._alternative_result(first[0], group_of, slot_of) for group_of, slot_of in kept[1:]]
+
+    def _alternative_result(self, first_group_of, group_of, slot_of):
+        """
+        an alternative grouping, sharing the student table with the main result:
+        the students of a group are indices into the students of result['groups'] in order (flattened),
+        which is also the order of the compact format's students table
+        """
+        # position of each student in the main result: groups in label order, students in input order
+        order = np.lexsort((np.arange(self.num_students), first_group_of))
+        position = np.empty(self.num_students, dtype=np.int64)
+        position[order] = np.arange(self.num_students)
+
+        groups = []
+        for g in sorted(slot_of):
+            members = position[group_of == g].tolist()
+            groups.append({
+                'group_id': len(groups) + 1,
+                'time_slot': self.time_slots[slot_of[g]] if slot_of[g] >= 0 else 'Not assigned',
+                'students': members,
+                'size': len(members)
+            })
+        return {
+            'groups': groups,
+            'total_groups': len(groups),
+            'students_apart': self._students_apart(first_group_of, group_of), # compared to the main result
+        }
+
+    def _format_solution(self, solver, student_in_group, group_uses_time, group_active, max_groups, buckets=None):
+        """
+        format the solution into group ids, time slots they're assigned to, students in each group
+        solver: the solver, or a solution callback mid-search (read in one go, see _solution)
+        buckets: with the bucket model, the students of each bucket; student_in_group then holds counts (see _group_of)
+        """
+        assigned, active, slot_of = self._solution(solver, student_in_group, group_uses_time, group_active, max_groups)
+        group_of = self._group_of(assigned, buckets)
+
+        # students grouped by group index, in input order within a group
+        order = np.lexsort((np.arange(self.num_students), group_of))
+        bounds = np.searchsorted(group_of[order], np.arange(max_groups + 1))
+        groups = []
+        for g in np.flatnonzero(active).tolist():
+            group_students = [self.students.student_record(s) for s in order[bounds[g]:bounds[g + 1]].tolist()]
+            groups.append({
+                'group_id': g + 1,  # 1-indexed for display
+                'time_slot': self.time_slots[slot_of[g]] if slot_of[g] >= 0 else 'Not assigned',
+                'students': group_students,
+                'size': len(group_students)
+            })
+        return self._result(groups)
+
+    def _grouping_result(self, slots, groups):
+        """result for a grouping given as one slot index + a list of student indices per group"""
+        return self._result([{
+            'group_id': g + 1,
+            'time_slot': self.time_slots[t],
+            'students': [self.students.student_record(s) for s in members],
+            'size': len(members)
+        } for g, (t, members) in enumerate(zip(slots, groups))])
+
+    def _result(self, groups):
+        """the response for a list of formatted groups"""
         return {
             'groups': groups,
             'constraints_applied': self.constraints.get_attribute_constraints(),
@@ -213,4 +1088,57 @@ class GroupScheduler:
             'total_groups': len(groups),
             'group_size_range': self.constraints.get_group_size_constraints(),
             'group_count_range': self.constraints.get_group_count_constraints()
-        }
\ No newline at end of file
+        }
+
+def _matched_overlap(group_of, other_group_of):
+    """
+    how many students can keep their groupmates between two groupings (group index per student): groups are
+    matched one to one by overlap, biggest overlaps first, and the overlaps of matched groups are summed
+    """
+    if len(group_of) == 0:
+        return 0
+    pairs, counts = np.unique(np.stack([group_of, other_group_of]), axis=1, return_counts=True)
+    kept = 0
+    matched_a, matched_b = set(), set()
+    for i in np.argsort(-counts, kind='stable'):
+        a, b = int(pairs[0, i]), int(pairs[1, i])
+        if a not in matched_a and b not in matched_b:
+            matched_a.add(a)
+            matched_b.add(b)
+            kept += int(counts[i])
+    return kept
+
+def _avoid_cliques(pairs):
+    """
+    cover the avoid pairs (sorted (a, b) with a < b) with cliques, greedily: every pair is in some clique,
+    and the students of a clique all avoid each other; an at-most-one over a clique propagates like all of its pairs
+    at once (e.g. a column of students who all avoid one another is one constraint per group instead of one per pair)
+    """
+    neighbours = {}
+    for a, b in pairs:
+        neighbours.setdefault(a, set()).add(b)
+        neighbours.setdefault(b, set()).add(a)
+
+    uncovered = set(pairs)
+    cliques = []
+    for a, b in pairs:
+        if (a, b) not in uncovered:
+            continue
+        clique = [a, b]
+        for c in sorted(neighbours[a] & neighbours[b]):
+            if all(c in neighbours[member] for member in clique):
+                clique.append(c)
+        for i, u in enumerate(clique):
+            for v in clique[i + 1:]:
+                uncovered.discard((min(u, v), max(u, v)))
+        cliques.append(clique)
+    return cliques
+
+class _SolutionCallback(cp_model.CpSolverSolutionCallback):
+    """calls handler(self) on every solution found during the search; self.Response() has the solution's values"""
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+
+    def on_solution_callback(self):
+        self.handler(self)
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import shutil
+import threading
+from student_matrix import StudentMatrix
+from constraint_parser import SchedulingConstraints
+
+# defaults, can be overridden with environment variables
+# SMARTGROUPS_SNAPSHOT_DIR: unset = no snapshots, otherwise slow solves are saved there (student data included, so keep it private)
+SNAPSHOT_DIR = os.environ.get('SMARTGROUPS_SNAPSHOT_DIR') or None
+SNAPSHOT_MIN_SECONDS = float(os.environ.get('SMARTGROUPS_SNAPSHOT_MIN_SECONDS', 10)) # solves slower than this are saved
+SNAPSHOT_MAX = int(os.environ.get('SMARTGROUPS_SNAPSHOT_MAX', 50)) # the oldest snapshots are deleted past this
+
+# the GroupScheduler arguments a snapshot keeps, besides the students and constraints ({argument: attribute})
+SCHEDULER_OPTIONS = {
+    'symmetry_breaking': 'symmetry_breaking',
+    'solver_params': 'solver_params',
+    'warm_start': 'warm_start',
+    'minimize_changes': 'minimize_changes',
+    'decompose': 'decompose',
+    'fast_path': 'fast_path',
+    'diagnose': 'diagnose_infeasible',
+    'num_solutions': 'num_solutions',
+    'min_difference': 'min_difference',
+    'aggregate': 'aggregate',
+    'balance': 'balance',
+}
+
+def save_snapshot(scheduler, unassigned_students, seconds, directory=SNAPSHOT_DIR, finished=True, snapshot_id=None,
+                  max_snapshots=SNAPSHOT_MAX):
+    """
+    save everything needed to run a solve again offline, in directory/<snapshot id>/:
+    snapshot.json has the normalized students (the parsed matrix, not the csv), the constraints, the scheduler
+    options and the diagnostics so far; model.pb the cp-sat model as it was built (only if cp-sat ran, with capture on)
+    snapshot_id: an earlier snapshot of the same solve to overwrite (e.g. with the final stats once it finished)
+    returns the snapshot id
+    """
+    students = scheduler.students
+    if snapshot_id is None:
+        snapshot_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{students.fingerprint()[:10]}"
+    path = os.path.join(directory, snapshot_id)
+    os.makedirs(path, exist_ok=True)
+
+    model_bytes = scheduler.captured_model
+    if model_bytes is not None:
+        with open(os.path.join(path, 'model.pb'), 'wb') as f:
+            f.write(model_bytes)
+    snapshot = {
+        'snapshot_id': snapshot_id,
+        'created': round(time.time(), 3),
+        'seconds': round(seconds, 4),
+        'finished': finished,
+        'students': {
+            'names': students.names,
+            'attribute_names': students.attribute_names,
+            'time_slots': students.time_slots,
+            'attributes': students.attributes.tolist(),
+            'availabilities': students.availabilities.tolist(),
+            'raw_attributes': students.raw_attributes,
+        },
+        'unassigned_students': unassigned_students,
+        'constraints': scheduler.constraints.to_dict(),
+        'options': {argument: getattr(scheduler, attribute) for argument, attribute in SCHEDULER_OPTIONS.items()},
+        'diagnostics': json.loads(json.dumps(scheduler.diagnostics, default=str)),
+        'model': 'model.pb' if model_bytes is not None else None,
+    }
+    # written next to it and renamed, so a reader never sees half a file
+    with open(os.path.join(path, 'snapshot.json.tmp'), 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(os.path.join(path, 'snapshot.json.tmp'), os.path.join(path, 'snapshot.json'))
+
+    # snapshot ids start with the time, so sorting them puts the oldest first
+    snapshots = sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+    for name in snapshots[:max(len(snapshots) - max_snapshots, 0)]:
+        if name != snapshot_id:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return snapshot_id
+
+def load_snapshot(path):
+    """
+    read a snapshot back (path: its directory, or its snapshot.json)
+    returns {'students': StudentMatrix, 'constraints': SchedulingConstraints, 'unassigned_students', 'options',
+             'model_path' (or None), 'snapshot' (the whole json)}
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'snapshot.json')
+    with open(path) as f:
+        snapshot = json.load(f)
+    data = snapshot['students']
+    students = StudentMatrix(data['names'], data['attribute_names'], data['time_slots'],
+                             data['attributes'], data['availabilities'], data['raw_attributes'])
+    return {
+        'students': students,
+        'constraints': SchedulingConstraints(**snapshot['constraints']),
+        'unassigned_students': snapshot['unassigned_students'],
+        'options': snapshot['options'],
+        'model_path': os.path.join(os.path.dirname(path), snapshot['model']) if snapshot.get('model') else None,
+        'snapshot': snapshot,
+    }
+
+class SnapshotWatch:
+    def __init__(self, scheduler, unassigned_students, directory=SNAPSHOT_DIR, min_seconds=SNAPSHOT_MIN_SECONDS):
+        """
+        snapshots a solve once it has run for min_seconds, so one that hangs (or is killed as a job) still leaves
+        a snapshot behind, then again when it finishes, with the final stats (see finish)
+        the scheduler needs capture=True for the snapshot to have the cp-sat model
+        """
+        self.scheduler = scheduler
+        self.unassigned_students = unassigned_students
+        self.directory = directory
+        self.min_seconds = min_seconds
+        self.snapshot_id = None
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.timer = threading.Timer(min_seconds, self._save, kwargs={'finished': False})
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _save(self, finished):
+        with self.lock:
+            try:
+                self.snapshot_id = save_snapshot(self.scheduler, self.unassigned_students, time.perf_counter() - self.start,
+                                                 self.directory, finished, self.snapshot_id)
+            except (OSError, TypeError, ValueError, RuntimeError):
+                pass # a snapshot is only there for debugging, it never fails the solve
+
+    def finish(self):
+        """call once the solve is done: returns the snapshot id, or None if the solve was quicker than min_seconds"""
+        self.timer.cancel()
+        if self.snapshot_id is not None or time.perf_counter() - self.start >= self.min_seconds:
+            self._save(finished=True)
+        self.scheduler.captured_model = None
+        return self.snapshot_id
@@ -0,0 +1,147 @@
+import json
+import hashlib
+import numpy as np
+
+# cell values that count as "has attribute" / "is available"; everything else is 0
+TRUE_VALUES = {'1', 'yes', 'true'}
+FALSE_VALUES = {'0', 'no', 'false', ''}
+
+
+def normalize_cell(value):
+    """
+    normalize one csv cell the same way for attributes and availabilities:
+    blanks and no/false become '0', yes/true become '1', anything else is kept (stripped)
+    """
+    if value is None:
+        return '0'
+    value = str(value).strip()
+    lowered = value.lower()
+    if lowered in TRUE_VALUES:
+        return '1'
+    if lowered in FALSE_VALUES or lowered == 'nan':
+        return '0'
+    return value
+
+
+def attribute_matrix(attribute_names, attribute_columns, num_students):
+    """
+    students x attributes 0/1 array from per-column lists of normalized cell strings,
+    plus {attribute: values} for the columns that aren't binary (see StudentMatrix raw_attributes)
+    """
+    attributes = np.zeros((num_students, len(attribute_names)), dtype=np.uint8)
+    raw_attributes = {}
+    for i, (attr, values) in enumerate(zip(attribute_names, attribute_columns)):
+        attributes[:, i] = [value == '1' for value in values]
+        if any(value not in ('0', '1') for value in values):
+            raw_attributes[attr] = list(values)
+    return attributes, raw_attributes
+
+
+class StudentMatrix:
+    def __init__(self, names, attribute_names, time_slots, attributes, availabilities, raw_attributes=None):
+        """
+        compact student data, built once at parse time
+        names: list of student names (row order)
+        attribute_names / time_slots: column names, in csv order
+        attributes: students x attributes array of 0/1
+        availabilities: students x time slots array of 0/1
+        raw_attributes: {attribute: list of strings} for attribute columns that aren't binary (e.g. email),
+                        kept only so they can still be shown and exported
+        """
+        self.names = list(names)
+        self.attribute_names = list(attribute_names)
+        self.time_slots = list(time_slots)
+        self.attributes = np.asarray(attributes, dtype=np.uint8).reshape(len(self.names), len(self.attribute_names))
+        self.availabilities = np.asarray(availabilities, dtype=np.uint8).reshape(len(self.names), len(self.time_slots))
+        self.raw_attributes = raw_attributes or {}
+        self.attribute_index = {attr: i for i, attr in enumerate(self.attribute_names)}
+        self.slot_index = {slot: i for i, slot in enumerate(self.time_slots)}
+
+    @classmethod
+    def from_columns(cls, names, attribute_names, attribute_columns, time_slots, availability_columns):
+        """
+        build from per-column lists of (already normalized) cell strings
+        """
+        num_students = len(names)
+        attributes, raw_attributes = attribute_matrix(attribute_names, attribute_columns, num_students)
+
+        availabilities = np.zeros((num_students, len(time_slots)), dtype=np.uint8)
+        for t, values in enumerate(availability_columns):
+            availabilities[:, t] = [value == '1' for value in values]
+
+        return cls(names, attribute_names, time_slots, attributes, availabilities, raw_attributes)
+
+    @classmethod
+    def from_records(cls, student_data):
+        """
+        build from the older dict format: {'names': [...], 'attributes': [{attr: value}], 'availabilities': [{slot: value}]}
+        """
+        names = student_data['names']
+        attribute_rows = student_data.get('attributes') or []
+        availability_rows = student_data.get('availabilities') or []
+        attribute_names = list(attribute_rows[0].keys()) if attribute_rows else []
+        time_slots = list(availability_rows[0].keys()) if availability_rows else []
+
+        attribute_columns = [[normalize_cell(row.get(attr)) for row in attribute_rows] for attr in attribute_names]
+        availability_columns = [[normalize_cell(row.get(slot)) for row in availability_rows] for slot in time_slots]
+        return cls.from_columns(names, attribute_names, attribute_columns, time_slots, availability_columns)
+
+    def __len__(self):
+        return len(self.names)
+
+    def attribute_column(self, attr):
+        """0/1 vector of which students have attr (all zeros if the attribute isn't in the data)"""
+        if attr not in self.attribute_index:
+            return np.zeros(len(self.names), dtype=np.uint8)
+        return self.attributes[:, self.attribute_index[attr]]
+
+    def any_attribute_column(self, attrs):
+        """0/1 vector of which students have at least one of attrs"""
+        result = np.zeros(len(self.names), dtype=np.uint8)
+        for attr in attrs:
+            result |= self.attribute_column(attr)
+        return result
+
+    def packed_availabilities(self):
+        """availabilities bit-packed along the slot axis (8 slots per byte)"""
+        return np.packbits(self.availabilities, axis=1)
+
+    def fingerprint(self):
+        """sha256 of everything in the matrix (names, column names, values); equal data gives an equal hash"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([self.names, self.attribute_names, self.time_slots,
+                                  sorted(self.raw_attributes.items())]).encode('utf8'))
+        digest.update(np.ascontiguousarray(self.attributes).tobytes())
+        digest.update(self.packed_availabilities().tobytes())
+        return digest.hexdigest()
+
+    def subset(self, indices):
+        """a new StudentMatrix with only the students at indices (in that order)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        raw_attributes = {attr: [values[i] for i in indices] for attr, values in self.raw_attributes.items()}
+        return StudentMatrix([self.names[i] for i in indices], self.attribute_names, self.time_slots,
+                             self.attributes[indices], self.availabilities[indices], raw_attributes)
+
+    def slot_subset(self, slot_indices):
+        """a new StudentMatrix with only the time slots at slot_indices (same students)"""
+        slot_indices = np.asarray(slot_indices, dtype=np.int64)
+        return StudentMatrix(self.names, self.attribute_names, [self.time_slots[t] for t in slot_indices],
+                             self.attributes, self.availabilities[:, slot_indices], self.raw_attributes)
+
+    def student_attributes(self, s):
+        """attribute dict for student s, in the same '0'/'1' string format the frontend expects"""
+        row = self.attributes[s]
+        return {attr: self.raw_attributes[attr][s] if attr in self.raw_attributes else str(int(row[i]))
+                for i, attr in enumerate(self.attribute_names)}
+
+    def student_availabilities(self, s):
+        """availability dict for student s"""
+        row = self.availabilities[s]
+        return {slot: str(int(row[t])) for t, slot in enumerate(self.time_slots)}
+
+    def student_record(self, s):
+        return {
+            'name': self.names[s],
+            'attributes': self.student_attributes(s),
+            'availabilities': self.student_availabilities(s)
+        }
@@ -0,0 +1,34 @@
+import os
+import sys
+import random
+import pytest
+
+# the backend modules import each other by name (from scheduler import ...), like when app.py runs
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES = os.path.join(os.path.dirname(BACKEND), 'examples')
+sys.path.insert(0, BACKEND)
+
+def cohort(num_students, num_slots, patterns=None, seed=0):
+    """
+    csv rows of a made-up section: First Name, Last Name, attr1, attr2, then the slots
+    patterns: availability rows most students copy (so students come out interchangeable), random ones otherwise
+    """
+    rng = random.Random(seed)
+    rows = [['First Name', 'Last Name', 'attr1', 'attr2'] + [f'Slot {t + 1}' for t in range(num_slots)]]
+    for s in range(num_students):
+        if patterns and rng.random() < 0.9:
+            available = rng.choice(patterns)
+        else:
+            available = [int(rng.random() < 0.5) for _ in range(num_slots)]
+            available[rng.randrange(num_slots)] = 1
+        rows.append([f'Student{s}', 'Test', str(int(rng.random() < 0.4)), str(int(rng.random() < 0.3))] + [str(a) for a in available])
+    return rows
+
+def groups_by_name(result):
+    """{student name: group id} of a result, without the unassigned group"""
+    return {student['name']: group['group_id'] for group in result['groups'] if not group.get('is_unassigned')
+            for student in group['students']}
+
+@pytest.fixture
+def section():
+    return cohort(60, 6, patterns=[[1, 1, 0, 0, 0, 0], [0, 0, 1, 1, 0, 0], [0, 0, 0, 0, 1, 1]], seed=1)
@@ -0,0 +1,22 @@
+import pytest
+from conftest import groups_by_name
+from pipeline import solve_rows
+
+FORM = {'given_attributes': 'attr1,attr2', 'group_size_min': '4', 'group_size_max': '6', 'group_count_max': '15', 'attr1_min_per_group': '1',
+        'attr2_max_per_group': '2', 'time_limit': '30', 'num_workers': '1', 'decompose': 'false', 'diagnostics': 'true'}
+
+@pytest.mark.parametrize('aggregate', ['true', 'false'])
+def test_bucket_and_per_student_models_agree(section, aggregate):
+    result, status = solve_rows(section, dict(FORM, aggregate=aggregate))
+    assert status == 200 and 'error' not in result, result.get('error')
+    assert result['engine'] == 'cp-sat'
+    assert result['validation']['valid'], result['validation']['violations']
+    assert sorted(groups_by_name(result)) == sorted(f'{row[0]} {row[1]}' for row in section[1:])
+    assert ('buckets' in result['diagnostics']['model']) == (aggregate == 'true')
+
+def test_bucket_and_per_student_models_both_infeasible(section):
+    # more groups than students with attr1, each needing 3 of them
+    form = dict(FORM, attr1_min_per_group='3', group_count_min='12')
+    for aggregate in ('true', 'false'):
+        result, status = solve_rows(section, dict(form, aggregate=aggregate))
+        assert result['solver_status'] == 'INFEASIBLE'
@@ -0,0 +1,49 @@
+import json
+from conftest import groups_by_name
+from pipeline import solve_rows, prepare_rows
+
+FORM = {'given_attributes': 'attr1,attr2', 'group_size_min': '4', 'group_size_max': '6', 'group_count_max': '15', 'attr1_min_per_group': '1',
+        'time_limit': '30', 'num_workers': '1', 'decompose': 'false'}
+
+def same_availability(section):
+    """the names of the biggest set of students with the same availability (so keeping them together is possible)"""
+    by_slots = {}
+    for row in section[1:]:
+        by_slots.setdefault(tuple(row[4:]), []).append(f'{row[0]} {row[1]}')
+    return max(by_slots.values(), key=len)
+
+def test_avoid_pairs_and_keep_together(section):
+    names = same_availability(section)
+    avoid = [[names[0], names[1]], [names[2], names[3]], [names[0], names[4]]]
+    keep = [[names[5], names[6], names[7]], [names[0], names[8]]]
+    result, status = solve_rows(section, dict(FORM, avoid_pairs=json.dumps(avoid), keep_together=json.dumps(keep)))
+    assert status == 200 and 'error' not in result, result.get('error')
+    assert result['validation']['valid']
+    group_of = groups_by_name(result)
+    for a, b in avoid:
+        assert group_of[a] != group_of[b]
+    for together in keep:
+        assert len({group_of[name] for name in together}) == 1
+
+def test_avoid_and_keep_the_same_pair_is_infeasible(section):
+    names = same_availability(section)[:2]
+    form = dict(FORM, avoid_pairs=json.dumps([names]), keep_together=json.dumps([names]))
+    result, status = solve_rows(section, form)
+    assert result['solver_status'] == 'INFEASIBLE'
+    assert f'{names[0]} and {names[1]} have to be kept apart, but are also in the same keep-together set.' in result['error']
+
+    # the model on its own can't hold them either
+    assert prepare_rows(section, form)['scheduler']._solve_cp_sat()['solver_status'] == 'INFEASIBLE'
+
+def test_avoid_columns_skip_yes_and_no(section):
+    names = [f'{row[0]} {row[1]}' for row in section[1:]]
+    rows = [section[0] + ['Avoid']] + [row + [''] for row in section[1:]]
+    rows[1][-1] = f'{names[1]}; no'
+    rows[2][-1] = 'yes'
+    rows[3][-1] = '1'
+    rows[4][-1] = 'No'
+    result, status = solve_rows(rows, dict(FORM, given_attributes='attr1,attr2,Avoid', avoid_columns='Avoid'))
+    assert status == 200 and 'error' not in result, result.get('error')
+    assert result['validation']['valid']
+    group_of = groups_by_name(result)
+    assert group_of[names[0]] != group_of[names[1]]
@@ -0,0 +1,54 @@
+import json
+import numpy as np
+from conftest import groups_by_name
+from pipeline import solve_rows
+from repair import repair_schedule, students_moved
+
+FORM = {'given_attributes': 'attr1,attr2', 'group_size_min': '4', 'group_size_max': '6', 'group_count_max': '15', 'attr1_min_per_group': '1',
+        'time_limit': '30', 'num_workers': '1', 'decompose': 'false'}
+
+def members(result):
+    """the groups of a result as sets of names"""
+    return {frozenset(student['name'] for student in group['students']) for group in result['groups'] if not group.get('is_unassigned')}
+
+def test_repair_keeps_untouched_groups(section):
+    previous, status = solve_rows(section, FORM)
+    assert status == 200 and 'error' not in previous, previous.get('error')
+
+    # take one student out of the biggest group, which stays valid with one student less
+    biggest = max((group for group in previous['groups'] if not group.get('is_unassigned')), key=lambda group: group['size'])
+    assert biggest['size'] > 4
+    removed = next(student['name'] for student in biggest['students'] if student['attributes']['attr1'] == '0')
+    result, status = repair_schedule(previous, dict(FORM, previous_result=json.dumps(previous), changes=json.dumps({'removed': [removed]})))
+    assert status == 200 and 'error' not in result, result.get('error')
+    assert result['validation']['valid']
+    assert result['students_moved'] == 0
+    expected = {group - {removed} for group in members(previous)}
+    assert members(result) == expected
+    assert removed not in groups_by_name(result)
+
+def test_students_moved_ignores_renumbered_groups():
+    old = np.array([0, 0, 1, 1, 2, -1])
+    assert students_moved(old, np.array([1, 1, 2, 2, 0, 0])) == 0
+    assert students_moved(old, np.array([0, 1, 1, 1, 2, 0])) == 1
+
+def test_repair_keeps_group_order(section):
+    previous, status = solve_rows(section, FORM)
+    assert status == 200 and 'error' not in previous, previous.get('error')
+    before = [{student['name'] for student in group['students']} for group in previous['groups'] if not group.get('is_unassigned')]
+
+    for emptied in range(len(before)):
+        # empty one group down to 2 students, who have to go somewhere else
+        removed = [student['name'] for student in previous['groups'][emptied]['students']][2:]
+        result, status = repair_schedule(previous, dict(FORM, previous_result=json.dumps(previous), changes=json.dumps({'removed': removed})))
+        assert status == 200 and 'error' not in result, result.get('error')
+        assert result['validation']['valid']
+
+        # every group that's mostly one previous group's students is in that group's place (dissolved ones leave a gap)
+        origins = []
+        for group in result['groups']:
+            names = {student['name'] for student in group['students']}
+            best = max(range(len(before)), key=lambda g: len(names & before[g]))
+            if len(names & before[best]) * 2 > len(names):
+                origins.append(best)
+        assert origins == sorted(origins), emptied
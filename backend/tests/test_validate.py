@@ -0,0 +1,42 @@
+import os
+import csv
+import numpy as np
+from conftest import EXAMPLES, cohort
+from validate import validate_sheet, check_grouping
+from csv_parser import parse_student_data, parse_all_constraints
+
+FORM = {'given_attributes': 'finance,healthcare,marketing,technology', 'group_size_min': '5', 'group_size_max': '6'}
+
+def read_sheet(name):
+    with open(os.path.join(EXAMPLES, 'sample_result_sheets', name)) as f:
+        return list(csv.reader(f))
+
+def test_valid_result_sheet():
+    report, status = validate_sheet(read_sheet('fun_people_results_no_missing.csv'), FORM)
+    assert status == 200
+    assert report['valid']
+    assert report['violations'] == []
+    assert report['groups'] == 7
+
+def test_invalid_result_sheet():
+    report, status = validate_sheet(read_sheet('fun_people_results_with_missing.csv'), FORM)
+    assert status == 200
+    assert not report['valid']
+    assert {v['constraint'] for v in report['violations']} == {'group_size'}
+    assert 'Group 3 has 1 student(s), at least 5 required.' in [v['message'] for v in report['violations']]
+
+def test_check_grouping_finds_each_kind_of_violation():
+    parsed = parse_student_data(cohort(12, 3, seed=2), ['attr1', 'attr2'])
+    students = parsed['students']
+    form = {'group_size_min': '3', 'group_size_max': '6', 'attr1_min_per_group': '1',
+            'avoid_pairs': f'[["{students.names[0]}", "{students.names[1]}"]]'}
+    constraints = parse_all_constraints(form, parsed['num_rows'], len(students.time_slots), ['attr1', 'attr2'], students)
+
+    # everyone in one group, at a slot some of them can't make, one student left out
+    group_of = np.zeros(len(students), dtype=np.int64)
+    group_of[-1] = -1
+    slot = int(np.argmin(students.availabilities.sum(axis=0)))
+    report = check_grouping(students, constraints, group_of, [slot])
+    kinds = {v['constraint'] for v in report['violations']}
+    assert not report['valid']
+    assert {'assigned', 'group_size', 'availability', 'avoid_pairs'} <= kinds
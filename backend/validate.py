@@ -0,0 +1,202 @@
+from collections import deque
+import numpy as np
+from csv_parser import parse_student_data, parse_given_attributes, parse_all_constraints
+from export import UNASSIGNED_GROUP
+
+def check_grouping(students, constraints, group_of, slot_of, group_names=None):
+    """
+    check a grouping against every constraint in constraints, on its own (no solver, just counting with numpy),
+    so it's cheap enough to run on every response and doesn't trust the model that produced the grouping
+    students: StudentMatrix; group_of: group index per student (-1 if the student isn't in a group)
+    slot_of: time slot index per group (-1 if the group has none); group_names: for the messages, 'Group 1', ... by default
+    returns {'valid': bool, 'violations': [{'constraint', 'group' (or None), 'message', 'students' (names, some)}],
+             'groups': int, 'students': int}
+    """
+    group_of = np.asarray(group_of, dtype=np.int64)
+    slot_of = np.asarray(slot_of, dtype=np.int64)
+    num_groups = len(slot_of)
+    names = group_names or [f'Group {g + 1}' for g in range(num_groups)]
+    in_group = group_of >= 0
+    violations = []
+
+    def violation(constraint, message, group=None, members=()):
+        violations.append({'constraint': constraint, 'group': None if group is None else names[group],
+                           'message': message, 'students': [students.names[s] for s in members]})
+
+    # every student is in a group
+    if not in_group.all():
+        missing = np.flatnonzero(~in_group).tolist()
+        violation('assigned', f'{len(missing)} student(s) are not in any group.', members=missing)
+
+    # group count
+    count_min, count_max = constraints.get_group_count_constraints()
+    if count_min and num_groups < count_min:
+        violation('group_count', f'{num_groups} group(s), at least {count_min} required.')
+    if count_max and num_groups > count_max:
+        violation('group_count', f'{num_groups} group(s), at most {count_max} allowed.')
+
+    # group sizes
+    size_min, size_max = constraints.get_group_size_constraints()
+    sizes = np.bincount(group_of[in_group], minlength=num_groups)
+    for g in np.flatnonzero(sizes < (size_min or 0)).tolist():
+        violation('group_size', f'{names[g]} has {sizes[g]} student(s), at least {size_min} required.', g)
+    if size_max:
+        for g in np.flatnonzero(sizes > size_max).tolist():
+            violation('group_size', f'{names[g]} has {sizes[g]} student(s), at most {size_max} allowed.', g)
+
+    # one time slot per group, one every member can make
+    for g in np.flatnonzero(slot_of < 0).tolist():
+        violation('time_slot', f'{names[g]} has no time slot.', g)
+    student_slot = np.where(in_group, slot_of[np.maximum(group_of, 0)] if num_groups else -1, -1)
+    timed = np.flatnonzero(student_slot >= 0)
+    unavailable = timed[students.availabilities[timed, student_slot[timed]] == 0]
+    for g in np.unique(group_of[unavailable]).tolist():
+        members = unavailable[group_of[unavailable] == g].tolist()
+        violation('availability', f'{len(members)} student(s) in {names[g]} are not available at {students.time_slots[slot_of[g]]}.', g, members)
+
+    # attribute counts per group, individual and combined
+    families = [(f"'{attr}'", students.attribute_column(attr), cons.get('min_per_group'), cons.get('max_per_group'))
+                for attr, cons in constraints.get_attribute_constraints().items()]
+    families += [(' or '.join(f"'{attr}'" for attr in combined.get('attributes', [])),
+                  students.any_attribute_column(combined.get('attributes', [])), combined.get('min'), combined.get('max'))
+                 for combined in constraints.get_combined_constraints()]
+    for label, column, least, most in families:
+        counts = np.bincount(group_of[in_group], weights=column[in_group], minlength=num_groups).astype(np.int64)
+        if least is not None:
+            for g in np.flatnonzero(counts < least).tolist():
+                violation('attribute', f'{names[g]} has {counts[g]} student(s) with {label}, at least {least} required.', g)
+        if most is not None:
+            for g in np.flatnonzero(counts > most).tolist():
+                violation('attribute', f'{names[g]} has {counts[g]} student(s) with {label}, at most {most} allowed.', g)
+
+    # avoid pairs / keep-together sets, by name
+    index_of = {name: s for s, name in enumerate(students.names)}
+    avoid_pairs, keep_together = constraints.get_pair_constraints()
+    for pair in avoid_pairs:
+        members = [index_of[name] for name in pair if name in index_of]
+        if len(members) == 2 and group_of[members[0]] >= 0 and group_of[members[0]] == group_of[members[1]]:
+            violation('avoid_pairs', f'{pair[0]} and {pair[1]} have to be kept apart, but are both in {names[group_of[members[0]]]}.',
+                      int(group_of[members[0]]), members)
+    for names_together in keep_together:
+        members = [index_of[name] for name in names_together if name in index_of]
+        if len(set(group_of[members].tolist())) > 1:
+            violation('keep_together', f'{", ".join(names_together)} have to be in the same group, but are split up.', None, members)
+
+    return {'valid': not violations, 'violations': violations, 'groups': num_groups, 'students': len(students)}
+
+def result_assignment(students, result):
+    """
+    a formatted result (full format) as (group index per student, slot index per group, group names)
+    students of the result are matched to the StudentMatrix by name, in order; the unassigned group is skipped
+    """
+    students_by_name = {}
+    for s, name in enumerate(students.names):
+        students_by_name.setdefault(name, deque()).append(s)
+    group_of = np.full(len(students), -1, dtype=np.int64)
+    slot_of, group_names = [], []
+    for group in result.get('groups', []):
+        if group.get('is_unassigned'):
+            continue
+        for student in group['students']:
+            if students_by_name.get(student['name']):
+                group_of[students_by_name[student['name']].popleft()] = len(slot_of)
+        slot_of.append(students.slot_index.get(group.get('time_slot'), -1))
+        group_names.append(f"Group {group.get('group_id', len(group_names) + 1)}")
+    return group_of, slot_of, group_names
+
+def check_result(scheduler, result):
+    """check_grouping for a scheduler's formatted result"""
+    group_of, slot_of, group_names = result_assignment(scheduler.students, result)
+    return check_grouping(scheduler.students, scheduler.constraints, group_of, slot_of, group_names)
+
+def read_result_sheet(data, given_attributes):
+    """
+    read a result sheet, the csv the results download as (Student Name, Assigned Group, Assigned Time Slot,
+    attributes, availabilities; see export.py and examples/sample_result_sheets)
+    data: csv rows, first row is the headers; given_attributes: which columns are attributes, like for the upload
+    returns {'students': StudentMatrix of the students with availabilities, 'group_of', 'slot_of', 'group_names',
+             'unassigned_students', 'num_rows', 'sheet_violations' (what check_grouping can't see)} or an error dict
+    """
+    rows = [row for row in data if row]
+    if not rows:
+        return {'error': 'The CSV file is empty.', 'status': 400}
+    headers_lower = [str(header).strip().lower() for header in rows[0]]
+    if 'assigned group' not in headers_lower or 'assigned time slot' not in headers_lower:
+        return {'error': 'A result sheet needs "Assigned Group" and "Assigned Time Slot" columns.', 'status': 400}
+    group_column, slot_column = headers_lower.index('assigned group'), headers_lower.index('assigned time slot')
+    assigned = [(row[group_column].strip() if len(row) > group_column else '',
+                 row[slot_column].strip() if len(row) > slot_column else '') for row in rows[1:]]
+
+    # the rest of the sheet is a student csv like any other
+    parsed = parse_student_data([[cell for i, cell in enumerate(row) if i not in (group_column, slot_column)] for row in rows],
+                                given_attributes)
+    if 'error' in parsed:
+        return parsed
+    students = parsed['students']
+
+    group_index, group_names, slots = {}, [], []
+    group_of = np.full(len(students), -1, dtype=np.int64)
+    sheet_violations = []
+    for s, row in enumerate(parsed['rows'].tolist()):
+        group_name, slot = assigned[row]
+        if not group_name or group_name == UNASSIGNED_GROUP:
+            continue
+        if group_name not in group_index:
+            group_index[group_name] = len(group_names)
+            group_names.append(group_name)
+            slots.append(slot)
+        group_of[s] = group_index[group_name]
+        if slot != slots[group_index[group_name]]:
+            sheet_violations.append({'constraint': 'time_slot', 'group': group_name, 'students': [students.names[s]],
+                                     'message': f'{students.names[s]} is in {group_name} at {slot}, others in it are at {slots[group_index[group_name]]}.'})
+    for g, slot in enumerate(slots):
+        if slot and slot not in students.slot_index:
+            sheet_violations.append({'constraint': 'time_slot', 'group': group_names[g], 'students': [],
+                                     'message': f'{group_names[g]} meets at {slot}, which is not a time slot column of the sheet.'})
+
+    # students without any availability can't be in a group (they're not in students, in the same order as the sheet)
+    listed = set(parsed['rows'].tolist())
+    unassigned = iter(parsed['unassigned_students'])
+    for row, (group_name, _) in enumerate(assigned):
+        if row in listed:
+            continue
+        name = next(unassigned)['name']
+        if group_name and group_name != UNASSIGNED_GROUP:
+            sheet_violations.append({'constraint': 'availability', 'group': group_name, 'students': [name],
+                                     'message': f'{name} has no availabilities, but is in {group_name}.'})
+
+    return {
+        'students': students,
+        'group_of': group_of,
+        'slot_of': [students.slot_index.get(slot, -1) for slot in slots],
+        'group_names': group_names,
+        'unassigned_students': parsed['unassigned_students'],
+        'num_rows': parsed['num_rows'],
+        'sheet_violations': sheet_violations,
+    }
+
+def check_result_sheet(sheet, constraints):
+    """check_grouping for a sheet from read_result_sheet, plus the problems only the sheet can have"""
+    report = check_grouping(sheet['students'], constraints, sheet['group_of'], sheet['slot_of'], sheet['group_names'])
+    # a time slot that isn't a column already has its own message
+    unknown_slot = {v['group'] for v in sheet['sheet_violations'] if v['constraint'] == 'time_slot' and not v['students']}
+    report['violations'] = sheet['sheet_violations'] + [v for v in report['violations']
+                                                        if not (v['constraint'] == 'time_slot' and v['group'] in unknown_slot)]
+    report['valid'] = not report['violations']
+    return report
+
+def validate_sheet(data, form):
+    """
+    the whole check for an uploaded result sheet: data is its csv rows, form has given_attributes and the same
+    constraint fields as the upload (what the grouping should have met)
+    returns (report dict, see check_grouping, http status)
+    """
+    given_attributes = parse_given_attributes(form)
+    sheet = read_result_sheet(data, given_attributes)
+    if 'error' in sheet:
+        return {'error': sheet['error']}, sheet['status']
+    constraints = parse_all_constraints(form, sheet['num_rows'], len(sheet['students'].time_slots), given_attributes,
+                                        sheet['students'], sheet['unassigned_students'])
+    if isinstance(constraints, dict):
+        return {'error': constraints['error']}, constraints['status']
+    return check_result_sheet(sheet, constraints), 200
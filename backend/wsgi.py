@@ -0,0 +1,8 @@
+"""
+production entry point, one app per server worker:
+    gunicorn -c gunicorn.conf.py wsgi:app
+(./run.sh --production does this)
+"""
+from app import create_app
+
+app = create_app()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+benchmark the hot paths on synthetic cohorts: csv parse, model build, solve and format (each timed on its own),
+plus the whole schedule() call with the normal engine choice
+records wall time, peak python memory (tracemalloc) and cp-sat stats (status, branches, conflicts)
+and compares them with a stored baseline; any regression makes the script exit with status 1
+
+run from the project root:
+    python3 benchmarks/bench_suite.py                   # compare with benchmarks/baseline.json
+    python3 benchmarks/bench_suite.py --save-baseline   # record a new baseline (after an intended change)
+    python3 benchmarks/bench_suite.py --only section    # just the scenarios with 'section' in their name
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'backend'))
+
+from ortools.sat.python import cp_model
+from csv_parser import parse_student_data, parse_all_constraints, parse_given_attributes
+from scheduler import GroupScheduler
+from synthetic import generate_cohort
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# (name, generate_cohort arguments, constraint form, run the cp-sat phases separately too)
+# the cp-sat phases are skipped where the full model is too big to be the engine anyone would use
+SCENARIOS = [
+    ('small: 40 students, 1+ attr1 per group',
+     {'students': 40, 'slots': 8, 'seed': 1},
+     {'given_attributes': 'attr1,attr2,attr3,attr4', 'group_size_min': '4', 'group_size_max': '6', 'attr1_min_per_group': '1'},
+     True),
+    ('section: 120 students, attribute + combined constraints',
+     {'students': 120, 'slots': 11, 'availability': 0.3, 'seed': 2},
+     {'given_attributes': 'attr1,attr2,attr3,attr4', 'group_size_min': '4', 'group_size_max': '6', 'group_count_max': '30',
+      'attr1_min_per_group': '1', 'attr2_max_per_group': '2',
+      'combined_constraints': json.dumps([{'attributes': ['attr3', 'attr4'], 'min': 1}])},
+     True),
+    ('section infeasible: 120 students, 3+ attr1 per group',
+     {'students': 120, 'slots': 11, 'availability': 0.3, 'seed': 3},
+     {'given_attributes': 'attr1,attr2,attr3,attr4', 'group_size_min': '4', 'group_size_max': '5', 'group_count_max': '30',
+      'attr1_min_per_group': '3'},
+     True),
+    ('skewed: 120 students, few popular slots',
+     {'students': 120, 'slots': 14, 'availability': 0.4, 'slot_skew': 0.9, 'empty_rows': 0.02, 'seed': 4},
+     {'given_attributes': 'attr1,attr2,attr3,attr4', 'group_size_min': '4', 'group_size_max': '6', 'group_count_max': '40',
+      'attr1_min_per_group': '1'},
+     True),
+    ('intake: 1000 students, sizes only',
+     {'students': 1000, 'slots': 12, 'availability': 0.25, 'seed': 5},
+     {'given_attributes': 'attr1,attr2,attr3,attr4', 'group_size_min': '4', 'group_size_max': '6', 'group_count_max': '250'},
+     False),
+    ('intake: 1000 students, 1+ attr1 per group',
+     {'students': 1000, 'slots': 12, 'availability': 0.25, 'attribute_density': 0.4, 'seed': 6},
+     {'given_attributes': 'attr1,attr2,attr3,attr4', 'group_size_min': '4', 'group_size_max': '6', 'group_count_max': '250',
+      'attr1_min_per_group': '1'},
+     False),
+    ('parse: 20000 rows x 40 slots',
+     {'students': 20000, 'slots': 40, 'attributes': 8, 'seed': 7},
+     None,
+     False),
+]
+
+# solver settings for every solve: one worker and a fixed seed, so the search (and its stats) is repeatable
+SOLVER_PARAMS = {'time_limit': 60, 'num_workers': 1, 'random_seed': 0}
+
+
+def measure(func, memory):
+    """run func once; returns (its result, {'seconds': ..., 'peak_mb': ...})"""
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    value = func()
+    stats = {'seconds': round(time.perf_counter() - start, 4)}
+    if memory:
+        stats['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+        tracemalloc.stop()
+    return value, stats
+
+
+def run_scenario(cohort, form, cp_sat_phases, memory):
+    """all phases of one scenario; returns {phase: stats}"""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(generate_cohort(**cohort))
+    text = buf.getvalue()
+    phases = {}
+
+    # parse, from the csv text like an upload
+    given_attributes = parse_given_attributes(form or {'given_attributes': ','.join(f'attr{i + 1}' for i in range(cohort.get('attributes', 4)))})
+    parsed, phases['parse'] = measure(lambda: parse_student_data(csv.reader(io.StringIO(text, newline='')), given_attributes), memory)
+    if form is None:
+        return phases
+
+    students = parsed['students']
+    constraints = parse_all_constraints(form, parsed['num_rows'], len(students.time_slots), given_attributes)
+
+    if cp_sat_phases:
+        scheduler = GroupScheduler(students, constraints, solver_params=SOLVER_PARAMS, fast_path=False, decompose=False)
+        built, phases['build'] = measure(scheduler.build_cp_model, memory)
+        proto = built['model'].Proto()
+        phases['build'].update({'variables': len(proto.variables), 'constraints': len(proto.constraints)})
+
+        solver = scheduler._make_solver()
+        status, phases['solve'] = measure(lambda: solver.Solve(built['model']), memory)
+        phases['solve'].update({
+            'status': solver.StatusName(status),
+            'branches': solver.NumBranches(),
+            'conflicts': solver.NumConflicts(),
+            'solver_wall_time': round(solver.WallTime(), 4),
+        })
+
+        if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            _, phases['format'] = measure(lambda: scheduler._format_solution(
+                solver, built['student_in_group'], built['group_uses_time'], built['group_active'], built['max_groups'], built['buckets']), memory)
+
+    # the whole thing, with whichever engine schedule() picks
+    scheduler = GroupScheduler(students, constraints, solver_params=SOLVER_PARAMS)
+    result, phases['schedule'] = measure(scheduler.schedule, memory)
+    phases['schedule'].update({'engine': result.get('engine'), 'status': result.get('solver_status')})
+    return phases
+
+
+def run(only=None, memory=True):
+    results = {}
+    for name, cohort, form, cp_sat_phases in SCENARIOS:
+        if only and only not in name:
+            continue
+        phases = run_scenario(cohort, form, cp_sat_phases, memory=False)
+        if memory:
+            # memory is measured in a second run, tracemalloc slows everything down too much to time it
+            for phase, stats in run_scenario(cohort, form, cp_sat_phases, memory=True).items():
+                phases[phase]['peak_mb'] = stats['peak_mb']
+        results[name] = phases
+        print_scenario(name, phases)
+    return results
+
+
+def print_scenario(name, phases):
+    print(name)
+    for phase, stats in phases.items():
+        extra = ' '.join(f'{key}={value}' for key, value in stats.items() if key not in ('seconds', 'peak_mb'))
+        peak = f"{stats['peak_mb']:>9.2f} MB" if 'peak_mb' in stats else ' ' * 12
+        print(f"  {phase:<10} {stats['seconds']:>9.3f} s {peak}  {extra}")
+
+
+def compare(results, baseline, tolerance, min_seconds, min_mb):
+    """
+    list of regressions against the baseline: a phase that got slower / used more memory by more than tolerance
+    (and by more than min_seconds / min_mb, so tiny phases don't fail on noise), or a solve that ends differently
+    """
+    regressions = []
+    for name, phases in results.items():
+        for phase, stats in phases.items():
+            old = baseline.get(name, {}).get(phase)
+            if old is None:
+                continue
+            if stats['seconds'] > old['seconds'] * (1 + tolerance) and stats['seconds'] - old['seconds'] > min_seconds:
+                regressions.append(f"{name} / {phase}: {old['seconds']:.3f} s -> {stats['seconds']:.3f} s")
+            if 'peak_mb' in stats and 'peak_mb' in old and \
+                    stats['peak_mb'] > old['peak_mb'] * (1 + tolerance) and stats['peak_mb'] - old['peak_mb'] > min_mb:
+                regressions.append(f"{name} / {phase}: peak {old['peak_mb']:.2f} MB -> {stats['peak_mb']:.2f} MB")
+            if 'status' in old and stats.get('status') != old['status']:
+                regressions.append(f"{name} / {phase}: status {old['status']} -> {stats.get('status')}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline json to compare with / save to')
+    parser.add_argument('--save-baseline', action='store_true', help='save these results as the new baseline')
+    parser.add_argument('--only', help='only run scenarios whose name contains this')
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slower) memory measuring run')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown / memory growth as a fraction (default 0.5)')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='ignore slowdowns smaller than this')
+    parser.add_argument('--min-mb', type=float, default=1.0, help='ignore memory growth smaller than this')
+    parser.add_argument('--output', help='also write the results to this json file')
+    args = parser.parse_args()
+
+    results = run(args.only, memory=not args.no_memory)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results) # with --only, keep the other scenarios' numbers
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f'\nsaved baseline to {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f'\nno baseline at {args.baseline}, run with --save-baseline first')
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.min_seconds, args.min_mb)
+    if regressions:
+        print('\nREGRESSIONS against the baseline:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+    print('\nno regressions against the baseline')
+
+
+if __name__ == '__main__':
+    main()
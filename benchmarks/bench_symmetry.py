@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+benchmark the scheduler with and without symmetry breaking on section-sized inputs
+run from the project root: python3 benchmarks/bench_symmetry.py [--time-limit 60]
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'backend'))
+
+from constraint_parser import SchedulingConstraints
+from scheduler import GroupScheduler
+from csv_parser import parse_student_data
+
+# every column in section1.csv that is not a name or an availability
+SECTION1_ATTRIBUTES = ['section', 'studentid', 'learning group', 'babson email', 'months professional experience',
+                       'undergraduate major', 'gender', 'country of citizenship', 'm', 'f', 'g1', 'g2', 'g3', 'g4',
+                       'g5', 'g6', 'g7', 'na', 'india', 'asia', 'sa', 'other', 'hate1', 'hate2']
+
+
+def load_section1():
+    with open(os.path.join(ROOT, 'section1.csv'), newline='') as f:
+        return list(csv.reader(f))
+
+
+def sparse_availability(data, seed=7, keep=0.35):
+    """same students and attributes as section1.csv, but each student only ticks a random ~35% of the slots"""
+    rng = random.Random(seed)
+    headers = data[0]
+    slot_columns = [i for i, h in enumerate(headers) if h.strip().lower() not in SECTION1_ATTRIBUTES
+                    and h.strip().lower() not in ('first name', 'last name')]
+    rows = [headers]
+    for row in data[1:]:
+        row = list(row)
+        picked = [i for i in slot_columns if rng.random() < keep] or [rng.choice(slot_columns)]
+        for i in slot_columns:
+            row[i] = '1' if i in picked else ''
+        rows.append(row)
+    return rows
+
+
+def stacked_section(copies=3, extra=9):
+    """a ~120-student section built by repeating section1.csv's students"""
+    data = load_section1()
+    return [data[0]] + data[1:] * copies + data[1:1 + extra]
+
+
+def make_constraints(attribute_constraints, size, count=(None, None), combined=None):
+    constraints = SchedulingConstraints()
+    constraints.set_attribute_constraints(attribute_constraints)
+    constraints.set_group_size_constraints(*size)
+    constraints.set_group_count_constraints(count[0] or 1, count[1])
+    constraints.set_combined_constraints(combined or [])
+    return constraints
+
+
+CASES = [
+    # (name, data builder, constraints builder)
+    ('section1 feasible: 1+ F per group, sizes 5-6',
+     load_section1,
+     lambda n, t: make_constraints({'f': {'min_per_group': 1}}, (5, 6), (1, t))),
+    ('section1 feasible: gender + region mix, sizes 4-5',
+     load_section1,
+     lambda n, t: make_constraints({'f': {'min_per_group': 1}, 'm': {'min_per_group': 2}, 'na': {'max_per_group': 2}},
+                                   (4, 5), (1, t))),
+    ('section1 infeasible: 2+ F per group, sizes 3-4',
+     load_section1,
+     lambda n, t: make_constraints({'f': {'min_per_group': 2}}, (3, 4), (1, t))),
+    ('section1 infeasible: 1+ Other per group, at least 3 groups',
+     load_section1,
+     lambda n, t: make_constraints({'other': {'min_per_group': 1}}, (4, 8), (3, t))),
+    ('sparse availability feasible: 1+ F per group, sizes 4-6',
+     lambda: sparse_availability(load_section1()),
+     lambda n, t: make_constraints({'f': {'min_per_group': 1}}, (4, 6), (1, t))),
+    ('120 students, sparse availability: 2+ F per group, sizes 6-7',
+     lambda: sparse_availability(stacked_section(), seed=1, keep=0.2),
+     lambda n, t: make_constraints({'f': {'min_per_group': 2}}, (6, 7), (1, n // 4))),
+    ('120 students, sparse availability: 1+ F per group, sizes 5-6',
+     lambda: sparse_availability(stacked_section(), seed=1, keep=0.2),
+     lambda n, t: make_constraints({'f': {'min_per_group': 1}}, (5, 6), (1, n // 4))),
+]
+
+
+def run_case(data, constraints, symmetry_breaking, time_limit):
+    parsed = parse_student_data(data, SECTION1_ATTRIBUTES)
+    # cap each solve so the unbroken model cannot run forever
+    scheduler = GroupScheduler(parsed['students'], constraints, symmetry_breaking=symmetry_breaking,
+                               solver_params={'time_limit': time_limit})
+    start = time.perf_counter()
+    result = scheduler.schedule()
+    elapsed = time.perf_counter() - start
+
+    if 'error' in result:
+        outcome = 'infeasible' if result['solver_status'] == 'INFEASIBLE' else 'timed out'
+    else:
+        outcome = f"{result['total_groups']} groups"
+    return elapsed, outcome
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--time-limit', type=float, default=60.0, help='per-solve time limit in seconds')
+    args = parser.parse_args()
+
+    print(f"{'case':<60} {'off (s)':>10} {'on (s)':>10} {'speedup':>8}")
+    for name, build_data, build_constraints in CASES:
+        data = build_data()
+        num_students = len(data) - 1
+        num_slots = len(data[0]) - len(SECTION1_ATTRIBUTES) - 2
+        off_time, off_outcome = run_case(data, build_constraints(num_students, num_slots), False, args.time_limit)
+        on_time, on_outcome = run_case(data, build_constraints(num_students, num_slots), True, args.time_limit)
+        print(f"{name:<60} {off_time:>10.2f} {on_time:>10.2f} {off_time / max(on_time, 1e-6):>7.1f}x")
+        print(f"{'':<60} {off_outcome:>10} {on_outcome:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+replay a snapshot of a slow solve (see backend/snapshots.py, saved when SMARTGROUPS_SNAPSHOT_DIR is set)
+with different solver parameters, and print the timing and solver stats next to the original run's
+
+run from the project root:
+    python3 benchmarks/replay.py SNAPSHOT                              # schedule() again, same options as the request
+    python3 benchmarks/replay.py SNAPSHOT --workers 8 --time-limit 30  # ... with more workers / another time limit
+    python3 benchmarks/replay.py SNAPSHOT --param cp_model_presolve=false --param symmetry_level=0
+    python3 benchmarks/replay.py SNAPSHOT --aggregate off --decompose off --no-symmetry
+    python3 benchmarks/replay.py SNAPSHOT --model                      # solve the saved cp-sat model as it was built
+SNAPSHOT is the snapshot's directory; --param takes any cp-sat parameter (SatParameters field), and can be repeated
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'backend'))
+
+from ortools.sat.python import cp_model
+from scheduler import GroupScheduler
+from snapshots import load_snapshot
+
+def parse_value(value):
+    """a --param value: true/false, a number, or else the string as it is"""
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+def on_off(value):
+    """--aggregate / --decompose / --fast-path: on, off or auto (auto = None, let the scheduler decide)"""
+    return {'on': True, 'off': False, 'auto': None}[value]
+
+def solver_params(original, args):
+    """the snapshot's solver params with the command line's changes"""
+    params = dict(original)
+    if args.time_limit is not None:
+        params['time_limit'] = args.time_limit
+    if args.workers is not None:
+        params['num_workers'] = args.workers
+    if args.seed is not None:
+        params['random_seed'] = args.seed
+    if args.gap is not None:
+        params['relative_gap'] = args.gap
+    sat_parameters = dict(params.get('sat_parameters', {}))
+    for param in args.param:
+        name, _, value = param.partition('=')
+        sat_parameters[name.strip()] = parse_value(value.strip())
+    if sat_parameters:
+        params['sat_parameters'] = sat_parameters
+    return params
+
+def replay_schedule(loaded, args):
+    """schedule() on the snapshot's students and constraints; returns the diagnostics, like a request's"""
+    options = dict(loaded['options'], solver_params=solver_params(loaded['options'].get('solver_params') or {}, args))
+    if args.no_symmetry:
+        options['symmetry_breaking'] = False
+    for option in ('aggregate', 'decompose', 'fast_path'):
+        if getattr(args, option) is not None:
+            options[option] = on_off(getattr(args, option))
+    if options.get('fast_path') is None:
+        options['fast_path'] = True # auto means on here
+
+    scheduler = GroupScheduler(loaded['students'], loaded['constraints'], **options)
+    start = time.perf_counter()
+    result = scheduler.schedule()
+    diagnostics = dict(scheduler.diagnostics)
+    diagnostics['phases'] = dict(diagnostics.get('phases', {}), total=round(time.perf_counter() - start, 4))
+    diagnostics['solver_status'] = result.get('solver_status')
+    if 'validation' in result:
+        diagnostics['valid'] = result['validation']['valid']
+    return diagnostics
+
+def replay_model(loaded, args):
+    """solve the saved cp-sat model itself (no presolve of ours, no decomposition): only solver parameters change"""
+    if loaded['model_path'] is None:
+        sys.exit('this snapshot has no cp-sat model (the solve used another engine), replay it without --model')
+    model = cp_model.CpModel()
+    with open(loaded['model_path'], 'rb') as f:
+        model.Proto().ParseFromString(f.read())
+
+    # the same solver set-up as the scheduler's (_make_solver), with the command line's parameters
+    scheduler = GroupScheduler(loaded['students'], loaded['constraints'],
+                               solver_params=solver_params(loaded['options'].get('solver_params') or {}, args))
+    solver = scheduler._make_solver()
+    start = time.perf_counter()
+    status = solver.Solve(model)
+    proto = model.Proto()
+    return {
+        'phases': {'solve': round(time.perf_counter() - start, 4)},
+        'model': {'variables': len(proto.variables), 'constraints': len(proto.constraints)},
+        'solver': scheduler._solver_stats(solver, status, model),
+        'solver_status': solver.StatusName(status),
+    }
+
+def summary(diagnostics):
+    """the lines printed per run"""
+    lines = []
+    for phase, seconds in diagnostics.get('phases', {}).items():
+        lines.append(f'  {phase:<14} {seconds:>8.3f} s')
+    facts = {'engine': diagnostics.get('engine'), 'status': diagnostics.get('solver_status'), 'valid': diagnostics.get('valid')}
+    facts.update(diagnostics.get('model') or {})
+    facts.update({key: value for key, value in (diagnostics.get('solver') or {}).items() if key != 'status'})
+    lines.append('  ' + ' '.join(f'{key}={value}' for key, value in facts.items() if value is not None))
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description='replay a snapshot of a slow solve with other solver parameters')
+    parser.add_argument('snapshot', help='snapshot directory (or its snapshot.json)')
+    parser.add_argument('--model', action='store_true', help='solve the saved cp-sat model instead of running schedule() again')
+    parser.add_argument('--time-limit', type=float, help='solver time limit in seconds')
+    parser.add_argument('--workers', type=int, help='cp-sat worker threads')
+    parser.add_argument('--seed', type=int, help='cp-sat random seed')
+    parser.add_argument('--gap', type=float, help='relative gap limit')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE', help='any cp-sat parameter (repeatable)')
+    parser.add_argument('--no-symmetry', action='store_true', help='turn symmetry breaking off')
+    parser.add_argument('--aggregate', choices=('on', 'off', 'auto'), help='bucket interchangeable students')
+    parser.add_argument('--decompose', choices=('on', 'off', 'auto'), help='solve independent blocks on their own')
+    parser.add_argument('--fast-path', dest='fast_path', choices=('on', 'off'), help='greedy split when only sizes are constrained')
+    parser.add_argument('--repeat', type=int, default=1, help='run this many times (e.g. to see the spread between runs)')
+    parser.add_argument('--json', action='store_true', help='print the diagnostics of every run as json instead')
+    args = parser.parse_args()
+
+    loaded = load_snapshot(args.snapshot)
+    original = loaded['snapshot']
+    runs = [replay_model(loaded, args) if args.model else replay_schedule(loaded, args) for _ in range(args.repeat)]
+    if args.json:
+        print(json.dumps({'original': original['diagnostics'], 'runs': runs}, indent=2))
+        return
+
+    print(f"snapshot {original['snapshot_id']}: {len(loaded['students'])} students, {len(loaded['students'].time_slots)} time slots, "
+          f"{original['seconds']:.1f} s{'' if original.get('finished') else ' (saved while still running)'}")
+    print('original')
+    print('\n'.join(summary(dict(original['diagnostics'], solver_status=(original['diagnostics'].get('solver') or {}).get('status')))))
+    for i, diagnostics in enumerate(runs):
+        print(f'replay {i + 1}' + (' (saved model)' if args.model else ''))
+        print('\n'.join(summary(diagnostics)))
+
+if __name__ == '__main__':
+    main()
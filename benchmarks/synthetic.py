@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+generate synthetic student csvs in the same layout as the real sheets
+(first name, last name, binary attribute columns, one column per time slot)
+run from the project root: python3 benchmarks/synthetic.py --students 500 --slots 12 -o /tmp/cohort.csv
+"""
+
+import argparse
+import csv
+import random
+import sys
+
+
+def generate_cohort(students=120, slots=11, attributes=4, attribute_density=0.3, availability=0.35,
+                    slot_skew=0.0, empty_rows=0.0, seed=0):
+    """
+    returns the csv rows (headers first)
+    students / slots / attributes: how many of each
+    attribute_density: chance a student has each attribute
+    availability: chance a student can make each slot (everyone gets at least one unless they're an empty row)
+    slot_skew: 0 = every slot equally popular, towards 1 = the first slots are much more popular than the last
+    empty_rows: fraction of students with no availabilities at all (they end up unassigned)
+    """
+    rng = random.Random(seed)
+    attribute_names = [f'attr{i + 1}' for i in range(attributes)]
+    slot_names = [f'slot {t + 1}' for t in range(slots)]
+    # slot t's chance is scaled down the later it is when skewed
+    slot_chances = [availability * (1 - slot_skew * t / max(slots - 1, 1)) for t in range(slots)]
+
+    rows = [['First Name', 'Last Name'] + attribute_names + slot_names]
+    for s in range(students):
+        attribute_cells = ['1' if rng.random() < attribute_density else '' for _ in attribute_names]
+        if rng.random() < empty_rows:
+            slot_cells = [''] * slots
+        else:
+            slot_cells = ['1' if rng.random() < chance else '' for chance in slot_chances]
+            if '1' not in slot_cells:
+                slot_cells[rng.randrange(slots)] = '1'
+        rows.append([f'Student{s + 1}', f'Synthetic{seed}'] + attribute_cells + slot_cells)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=120)
+    parser.add_argument('--slots', type=int, default=11)
+    parser.add_argument('--attributes', type=int, default=4)
+    parser.add_argument('--attribute-density', type=float, default=0.3)
+    parser.add_argument('--availability', type=float, default=0.35)
+    parser.add_argument('--slot-skew', type=float, default=0.0)
+    parser.add_argument('--empty-rows', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='csv file to write (default: stdout)')
+    args = parser.parse_args()
+
+    rows = generate_cohort(args.students, args.slots, args.attributes, args.attribute_density, args.availability,
+                           args.slot_skew, args.empty_rows, args.seed)
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+    else:
+        csv.writer(sys.stdout).writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
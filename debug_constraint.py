@@ -54,16 +54,11 @@ if 'error' in result:
     print(f"Error parsing data: {result['error']}")
     sys.exit(1)
 
-student_data = {
-    'names': result['student_names'],
-    'attributes': result['student_attributes'],
-    'availabilities': result['student_availabilities']
-}
+student_data = result['students']
 
 print(f"\nParsed student data:")
-for i, name in enumerate(student_data['names']):
-    attrs = student_data['attributes'][i]
-    f_val = attrs.get('f', '0')
+for i, name in enumerate(student_data.names):
+    f_val = student_data.student_attributes(i).get('f', '0')
     print(f"  {name}: F={f_val}")
 
 # Create constraints: at least 1 F per group
@@ -39,6 +39,50 @@ export const checkHealth = async () => {
     }
 };
 
+// base64 string -> bytes
+const decodeBase64 = (base64) => Uint8Array.from(atob(base64), (char) => char.charCodeAt(0));
+
+// bit i of bit-packed bytes from the backend (8 bits per byte, most significant bit first)
+const getBit = (bytes, offset, i) => (bytes[offset + (i >> 3)] >> (7 - (i & 7))) & 1;
+
+// turn a compact result (format=compact, see backend/response_format.py) back into the normal one:
+// every group gets its full student objects back, with the same attributes / availabilities dicts as before
+// alternatives keep their student indices, same as the normal result: the students table is the groups' students in order
+export const decodeCompactResult = (data) => {
+    if (!data || data.format !== 'compact') {
+        return data;
+    }
+    const { attributes: attributeNames, time_slots: timeSlots } = data.columns;
+    const table = data.students;
+
+    // one column of values per attribute ('0' / '1', or the text that was in the sheet)
+    const attributeColumns = table.attributes.map((column) => {
+        if (column.values) {
+            return column.values;
+        }
+        const bytes = decodeBase64(column.packed);
+        return table.names.map((_, s) => String(getBit(bytes, 0, s)));
+    });
+    const availabilityBytes = decodeBase64(table.availabilities || '');
+    const rowBytes = Math.ceil(timeSlots.length / 8);
+
+    const students = table.names.map((name, s) => {
+        const attributes = {};
+        attributeNames.forEach((attr, i) => { attributes[attr] = attributeColumns[i][s]; });
+        const availabilities = {};
+        timeSlots.forEach((slot, t) => {
+            availabilities[slot] = String(getBit(availabilityBytes, s * rowBytes, t));
+        });
+        return { name, attributes, availabilities };
+    });
+
+    const { format, columns, students: _table, ...rest } = data;
+    return {
+        ...rest,
+        groups: data.groups.map((group) => ({ ...group, students: group.students.map((s) => students[s]) })),
+    };
+};
+
 // validate the file before uploading
 const checkFile = (file) => {
     // if no file uploaded
@@ -77,6 +121,9 @@ export const uploadFileAndConstraints = async (file, constraints = {}) => {
         // append attributes (can be empty string if no attributes provided)
         formData.append('given_attributes', constraints.givenAttributes);  // request.form['given_attributes']
 
+        // ask for the compact result format (much smaller for big classes), it's decoded below
+        formData.append('format', 'compact');
+
         // add the group size constraints
         if (constraints.groupSizeMin !== undefined) {
             formData.append('group_size_min', constraints.groupSizeMin.toString());  // request.form['group_size_min']
@@ -122,7 +169,7 @@ export const uploadFileAndConstraints = async (file, constraints = {}) => {
         return {
             success: true,
             message: SUCCESS_MESSAGES.GROUPS_GENERATED,
-            data: response
+            data: decodeCompactResult(response)
         };
 
     } 
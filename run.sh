@@ -1,6 +1,14 @@
 #!/bin/bash
 
 # need to just do ./run.sh in terminal at the root directory of the project
+# ./run.sh --production runs just the backend, on gunicorn (see backend/gunicorn.conf.py), instead of the dev servers
+#   settings: SMARTGROUPS_PORT, SMARTGROUPS_THREADS, SMARTGROUPS_MAX_CONCURRENT_SOLVES,
+#   SMARTGROUPS_MAX_REQUEST_MB (and the other SMARTGROUPS_* variables in backend/)
+
+PRODUCTION=false
+if [[ "$1" == "--production" ]]; then
+    PRODUCTION=true
+fi
 
 echo "🌸 Starting up SmartGroups! 🌸"
 echo "=================================================="
@@ -161,24 +169,44 @@ else
 fi
 cd ..
 
-echo ""
-echo "🌱 Installing frontend dependencies..."
+# install frontend dependencies (production mode only runs the backend)
+if [[ "$PRODUCTION" != true ]]; then
+    echo ""
+    echo "🌱 Installing frontend dependencies..."
 
-# install frontend dependencies
-cd frontend
-if [[ -f "package.json" ]]; then
-    print_info "🌱 Installing npm packages..."
-    npm install
-    print_status "Frontend dependencies installed"
-else
-    print_error "package.json not found in frontend directory"
-    exit 1
+    cd frontend
+    if [[ -f "package.json" ]]; then
+        print_info "🌱 Installing npm packages..."
+        npm install
+        print_status "Frontend dependencies installed"
+    else
+        print_error "package.json not found in frontend directory"
+        exit 1
+    fi
+    cd ..
 fi
-cd ..
 
 echo ""
 echo "🌼 Starting servers... 🌼"
 
+if [[ "$PRODUCTION" == true ]]; then
+    print_info "🪷 Starting backend in production mode (gunicorn)... 🪷"
+    cd backend
+    gunicorn -c gunicorn.conf.py wsgi:app &
+    BACKEND_PID=$!
+    cd ..
+    sleep 3
+    echo ""
+    echo "=================================================="
+    echo -e "${GREEN}🌼 SmartGroups backend is running (production)! 🌼${NC}"
+    echo "=================================================="
+    echo -e "${BLUE}🪷 Backend:${NC} http://localhost:${SMARTGROUPS_PORT:-5013}"
+    echo "• To stop it, press Ctrl+C in this terminal"
+    echo "=================================================="
+    wait
+    exit 0
+fi
+
 print_info "🪷 Starting backend server... 🪷"
 cd backend
 python3 app.py &